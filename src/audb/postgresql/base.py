@@ -0,0 +1,39 @@
+"""
+The postgresql backend, aware of partitioned tables.
+
+Django 1.9 only introspects plain tables and views, so a partitioned table
+(such as core_subscriptionlog, see core.partitions) looks missing to it and
+`flush` (and so TransactionTestCase) leaves it out of the TRUNCATE of the
+tables its partitions reference, which Postgres refuses.
+"""
+from django.db.backends.base.introspection import TableInfo
+from django.db.backends.postgresql import base, introspection
+
+
+class DatabaseIntrospection(introspection.DatabaseIntrospection):
+    def get_table_list(self, cursor):
+        """
+        Returns a list of table and view names in the current database,
+        partitioned tables included and their partitions left out.
+        """
+        cursor.execute(
+            """
+            SELECT c.relname, c.relkind
+            FROM pg_catalog.pg_class c
+            LEFT JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind IN ('r', 'p', 'v')
+                AND NOT c.relispartition
+                AND n.nspname NOT IN ('pg_catalog', 'pg_toast')
+                AND pg_catalog.pg_table_is_visible(c.oid)"""
+        )
+        return [
+            TableInfo(row[0], {"r": "t", "p": "t", "v": "v"}.get(row[1]))
+            for row in cursor.fetchall()
+            if row[0] not in self.ignored_tables
+        ]
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.introspection = DatabaseIntrospection(self)
@@ -96,7 +96,7 @@ WSGI_APPLICATION = "audb.wsgi.application"
 
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql",
+        "ENGINE": "audb.postgresql",
         "NAME": os.getenv("DB_NAME", "audb"),
         "USER": os.getenv("DB_USER", "audb"),
         "PASSWORD": os.getenv("DB_PASS", "audb"),
@@ -144,6 +144,10 @@ USE_TZ = True
 
 STATIC_URL = "/static/"
 
+# Files generated by background exports and archiving (see core.tasks); must
+# be shared between the web servers and the celery workers.
+EXPORTS_ROOT = os.path.join(os.path.dirname(BASE_DIR), "exports")
+
 # Cache
 CACHES = {
     "default": {
@@ -214,6 +218,32 @@ REST_FRAMEWORK = {
     "PAGE_SIZE": 10,
 }
 
+# How many of a user's latest vars history snapshots, product actions and
+# subscription log entries are embedded in audience user responses; the rest
+# are paged through their own endpoints.
+AUDIENCE_USER_NESTED_LIMIT = 20
+
+# The most keys POST /api/audience-users/lookup resolves in one call, and the
+# fields of its records when the request names none.
+AUDIENCE_USER_LOOKUP_LIMIT = 5000
+AUDIENCE_USER_LOOKUP_FIELDS = (
+    "id,email,email_hash,omeda_id,sailthru_id,sailthru_optout,vars"
+)
+
+# User content history views older than this many days are rolled up into
+# per-email, per-content totals and removed (see core.tasks); with
+# USER_CONTENT_HISTORY_ARCHIVE they are first written to gzipped files under
+# EXPORTS_ROOT.
+USER_CONTENT_HISTORY_RETENTION_DAYS = 180
+USER_CONTENT_HISTORY_ARCHIVE = True
+
+# Interest profiles (core.models.UserInterest) count views with a weight that
+# halves every USER_INTEREST_HALF_LIFE_DAYS (changing it skews the existing
+# scores against new ones). With USER_INTEREST_SYNC_LIMIT above 0, each user's top interests of
+# every kind are synced to Sailthru as "top_<kind>s" vars.
+USER_INTEREST_HALF_LIFE_DAYS = 30
+USER_INTEREST_SYNC_LIMIT = 0
+
 
 # Django Debug Toolbar
 
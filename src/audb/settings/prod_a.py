@@ -9,6 +9,7 @@ CACHES["default"]["LOCATION"] = "redis://aud01.geprod.amc:6379/1"
 BROKER_URL = CELERY_BROKER_URLS["prod-a"]
 STATIC_ROOT = "/data/shared/assets/static/a"
 STATIC_URL = "/static/a/"
+EXPORTS_ROOT = "/data/shared/exports/a"
 
 LOGGING["handlers"]["sailthru_sync.tasks"][
     "filename"
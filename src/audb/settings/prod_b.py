@@ -9,6 +9,7 @@ CACHES["default"]["LOCATION"] = "redis://aud01.geprod.amc:6379/2"
 BROKER_URL = CELERY_BROKER_URLS["prod-b"]
 STATIC_ROOT = "/data/shared/assets/static/b"
 STATIC_URL = "/static/b/"
+EXPORTS_ROOT = "/data/shared/exports/b"
 
 LOGGING["handlers"]["sailthru_sync.tasks"][
     "filename"
@@ -11,3 +11,15 @@ SAILTHRU_CONFIG = {
 SAILTHRU_TASK_THROTTLE_INTERVAL = 5
 SAILTHRU_SYNC_ENABLED = True
 SAILTHRU_SYNC_SIGNALS_ENABLED = True
+SAILTHRU_SYNC_METRICS_ENABLED = True
+# ceiling for the bulk commands that call the Sailthru API from several threads
+SAILTHRU_API_REQUESTS_PER_SECOND = 20
+# sync tasks write Sailthru IDs and sync times (and their failures) back in
+# bulk, once this many have been collected or the oldest has waited this long
+# (checked after each task and by a timer, so a worker that is killed loses
+# at most about this many seconds of them)
+SAILTHRU_WRITEBACK_BATCH_SIZE = 100
+SAILTHRU_WRITEBACK_MAX_SECONDS = 5
+# sync failures of each Sailthru error code go to Sentry at most once per
+# this many seconds
+SAILTHRU_FAILURE_SENTRY_INTERVAL = 300
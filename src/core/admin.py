@@ -1,8 +1,8 @@
 # -*- coding: UTF-8 -*-
 
 import json
-import csv
 import datetime
+import os
 
 from celery.utils.log import get_task_logger
 from django import forms
@@ -18,10 +18,18 @@ from django.contrib.admin.filters import DateFieldListFilter
 from django.core.exceptions import PermissionDenied
 from django.core.paginator import Paginator
 from django.db import IntegrityError, models, router, transaction
-from django.http import Http404, HttpResponse
+from django.core.urlresolvers import reverse
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseNotAllowed,
+    HttpResponseRedirect,
+)
 from django.template.loader import render_to_string as django_render_to_string
-from django.template.response import SimpleTemplateResponse
+from django.template.response import SimpleTemplateResponse, TemplateResponse
 from django.utils.encoding import force_text
+from django.utils.dateparse import parse_date, parse_datetime
 from django.utils.html import escape, format_html
 from django.utils.http import quote_plus
 from django.utils.safestring import mark_safe
@@ -40,6 +48,8 @@ import sentry_sdk
 
 from . import fields
 from . import models as m
+from .tasks import export_subscription_log
+from .db import keyset_page
 from .widgets import DecomposedKeyValueJSONWidget
 
 
@@ -722,35 +732,89 @@ class ListAdmin(admin.ModelAdmin):
 
     slug_edit.short_description = "Slug / Edit"
 
+    # days of daily subscriber counts shown on the stats and overview pages
+    stats_history_days = 30
+
     def get_urls(self):
         urls = super(ListAdmin, self).get_urls()
         analyze_url = [
             url(r"^(?P<pk>\d+)/stats/$", self.admin_site.admin_view(self.stats_view)),
+            url(
+                r"^overview/$",
+                self.admin_site.admin_view(self.overview_view),
+                name="core_list_overview",
+            ),
         ]
         return analyze_url + urls
 
     def stats_view(self, request, pk):
         list_obj = self.get_object(request, pk)
-        num_users_inactive = m.AudienceUser.objects.filter(
-            subscriptions__list_id=pk, subscriptions__active=False
-        ).count()
-        num_users_active = m.AudienceUser.objects.filter(
-            subscriptions__list_id=pk, subscriptions__active=True
-        ).count()
-        list_users_total = num_users_inactive + num_users_active
+        if list_obj is None:
+            raise Http404
+        counts = m.ListSubscriberCount.objects.for_list(list_obj)
+        history = list(
+            list_obj.subscriber_count_history.all()[: self.stats_history_days]
+        )
+        # day-over-day change in active subscribers, newest first
+        for day, previous_day in zip(history, history[1:] + [None]):
+            day.active_change = (
+                day.active - previous_day.active if previous_day else None
+            )
 
         context = {
             "pk": list_obj.pk,
             "name": list_obj.slug,
             "has_permission": True,
-            "list_users_total": list_users_total,
-            "list_users_active": num_users_active,
-            "list_users_inactive": num_users_inactive,
+            "list_users_total": counts.total,
+            "list_users_active": counts.active,
+            "list_users_inactive": counts.inactive,
+            "counts_reconciled": counts.reconciled,
+            "history": history,
         }
         return HttpResponse(
             django_render_to_string("admin/stats.html", context, request=request)
         )
 
+    def overview_view(self, request):
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+
+        since = timezone.localtime(timezone.now()).date() - datetime.timedelta(
+            days=self.stats_history_days
+        )
+        active_since = dict(
+            m.ListSubscriberCountHistory.objects.filter(date=since).values_list(
+                "list_id", "active"
+            )
+        )
+        lists = (
+            m.List.objects.filter(archived=False)
+            .select_related("subscriber_count")
+            .order_by("-subscriber_count__active", "slug")
+        )
+        rows = []
+        for list_obj in lists:
+            counts = getattr(list_obj, "subscriber_count", None)
+            previous = active_since.get(list_obj.pk)
+            rows.append(
+                {
+                    "list": list_obj,
+                    "counts": counts,
+                    "active_change": counts.active - previous
+                    if counts and previous is not None
+                    else None,
+                }
+            )
+
+        context = dict(
+            self.admin_site.each_context(request),
+            opts=self.model._meta,
+            title="List subscriber overview",
+            rows=rows,
+            history_days=self.stats_history_days,
+        )
+        return TemplateResponse(request, "admin/core/list/overview.html", context)
+
 
 class SubscriptionLogListFilter(admin.SimpleListFilter):
     title = "list"
@@ -760,7 +824,7 @@ class SubscriptionLogListFilter(admin.SimpleListFilter):
         return [(request.GET.get("list_id", None), "Current")]
 
     def queryset(self, request, queryset):
-        return queryset.filter(subscription__list__id=self.value())
+        return queryset.filter(list_id=self.value())
 
 
 class SubscriptionLogTimeFilter(DateFieldListFilter):
@@ -814,11 +878,13 @@ class SubscriptionLogOptoutType(admin.SimpleListFilter):
     title = "Optout Type"
     parameter_name = "optout_type"
 
+    optout_types = (
+        ("basic", "Basic Optout"),
+        ("all", "All Optout"),
+    )
+
     def lookups(self, request, model_admin):
-        return [
-            ("basic", "Basic Optout"),
-            ("all", "All Optout"),
-        ]
+        return list(self.optout_types)
 
     def queryset(self, request, queryset):
         if self.value():
@@ -851,25 +917,24 @@ class SubscriptionLogAdmin(admin.ModelAdmin):
     last_year = today.replace(year=today.year - 1)
 
     def export_as_csv(self, request, queryset):
-        meta = self.model._meta
-        field_names = self.list_display
-
-        response = HttpResponse(content_type="text/csv")
-        response["Content-Disposition"] = "attachment; filename={}.csv".format(meta)
-        writer = csv.writer(response)
-
-        writer.writerow(field_names)
-        for obj in queryset:
-            values = []
-            for field in field_names:
-                values.append(
-                    getattr(obj, field)
-                    if hasattr(obj, field)
-                    else getattr(self, field)(obj)
-                )
-            writer.writerow(values)
-
-        return response
+        # The export runs in the background (see core.tasks), so it is
+        # described by the changelist's filters, or by the selected ids when
+        # only some rows are selected, rather than by the queryset itself.
+        if request.POST.get("select_across") == "1":
+            # the query parameters of the list_filter specs
+            filters = {"action": request.GET.get("action__exact")}
+            filters["optout_type"] = request.GET.get("optout_type")
+            since = parse_date(request.GET.get("timestamp__gte", "")) or self.last_year
+            filters["since"] = self.start_of_day(since)
+            until = parse_date(request.GET.get("timestamp__lt", ""))
+            if until:
+                filters["until"] = self.start_of_day(until)
+        else:
+            filters = {"ids": list(queryset.values_list("pk", flat=True))}
+        export = self.start_export(request, request.GET.get("list_id"), filters)
+        return HttpResponseRedirect(
+            reverse("admin:core_subscriptionlog_export", args=[export.pk])
+        )
 
     export_as_csv.short_description = "Export Selected as CSV"
 
@@ -941,6 +1006,209 @@ class SubscriptionLogAdmin(admin.ModelAdmin):
     def has_module_permission(self, request):
         return False
 
+    # The log browser: a list's log newest-first, keyset-paginated on
+    # (timestamp, id) over the (list, timestamp, id) index, so every page
+    # costs the same however far back it is.
+
+    browse_page_size = 100
+
+    browse_periods = (
+        ("Last Year", 365),
+        ("Last 6 Months", 30 * 6),
+        ("Last Month", 30),
+        ("Last 7 days", 7),
+    )
+
+    def get_urls(self):
+        urls = super(SubscriptionLogAdmin, self).get_urls()
+        browse_url = [
+            url(
+                r"^browse/$",
+                self.admin_site.admin_view(self.browse_view),
+                name="core_subscriptionlog_browse",
+            ),
+            url(
+                r"^browse/export/$",
+                self.admin_site.admin_view(self.browse_export_view),
+                name="core_subscriptionlog_browse_export",
+            ),
+            url(
+                r"^exports/(?P<pk>\d+)/$",
+                self.admin_site.admin_view(self.export_view),
+                name="core_subscriptionlog_export",
+            ),
+            url(
+                r"^exports/(?P<pk>\d+)/download/$",
+                self.admin_site.admin_view(self.export_download_view),
+                name="core_subscriptionlog_export_download",
+            ),
+        ]
+        return browse_url + urls
+
+    @staticmethod
+    def encode_cursor(entry):
+        return "{}_{}".format(entry.timestamp.isoformat(), entry.pk)
+
+    @staticmethod
+    def decode_cursor(value):
+        timestamp, _, pk = value.rpartition("_")
+        timestamp = parse_datetime(timestamp)
+        if timestamp is None or not pk.isdigit():
+            raise ValueError("Invalid cursor: {}".format(value))
+        return timestamp, int(pk)
+
+    def browse_view(self, request):
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        try:
+            list_obj = m.List.objects.get(pk=request.GET.get("list_id"))
+        except (m.List.DoesNotExist, ValueError):
+            raise Http404
+
+        try:
+            days = int(request.GET.get("days", 365))
+        except ValueError:
+            days = 365
+        since = timezone.localtime(timezone.now()) - datetime.timedelta(days=days)
+        entries = m.SubscriptionLog.objects.filter(
+            list=list_obj, timestamp__gte=since
+        ).select_related("subscription__audience_user")
+        action = request.GET.get("action")
+        if action:
+            entries = entries.filter(action=action)
+        optout_type = request.GET.get("optout_type")
+        if optout_type:
+            entries = entries.filter(
+                subscription__audience_user__sailthru_optout=optout_type
+            )
+
+        try:
+            after = request.GET.get("after")
+            after = self.decode_cursor(after) if after else None
+            before = request.GET.get("before")
+            before = self.decode_cursor(before) if before else None
+        except ValueError:
+            after = before = None
+        rows, has_more = keyset_page(
+            entries,
+            ("timestamp", "id"),
+            self.browse_page_size,
+            after=after,
+            before=before,
+        )
+
+        def page_url(**cursor):
+            params = request.GET.copy()
+            params.pop("after", None)
+            params.pop("before", None)
+            params.update(cursor)
+            return "?" + params.urlencode()
+
+        next_url = prev_url = None
+        if rows and (has_more or before):
+            next_url = page_url(after=self.encode_cursor(rows[-1]))
+        if rows and (after or (before and has_more)):
+            prev_url = page_url(before=self.encode_cursor(rows[0]))
+
+        context = dict(
+            self.admin_site.each_context(request),
+            opts=self.model._meta,
+            title="Subscription log: {}".format(list_obj.slug),
+            list_obj=list_obj,
+            entries=rows,
+            days=days,
+            periods=self.browse_periods,
+            action=action,
+            actions=m.SubscriptionLog.SUBSCRIPTION_ACTION_CHOICES,
+            optout_type=optout_type,
+            optout_types=SubscriptionLogOptoutType.optout_types,
+            next_url=next_url,
+            prev_url=prev_url,
+            exports=m.SubscriptionLogExport.objects.filter(list=list_obj)[:5],
+        )
+        return TemplateResponse(
+            request, "admin/core/subscriptionlog/browse.html", context
+        )
+
+    # Exports: the CSV is written by a celery task, which streams the rows
+    # into a gzipped file; the export's page follows its progress and links
+    # to the file once it is done.
+
+    @staticmethod
+    def start_of_day(date):
+        return timezone.make_aware(
+            datetime.datetime.combine(date, datetime.time.min)
+        ).isoformat()
+
+    def start_export(self, request, list_id, filters):
+        list_obj = m.List.objects.filter(pk=list_id).first() if list_id else None
+        export = m.SubscriptionLogExport.objects.create(
+            list=list_obj,
+            filters={key: value for key, value in filters.items() if value},
+            requested_by=request.user,
+        )
+        transaction.on_commit(lambda: export_subscription_log.apply_async([export.pk]))
+        return export
+
+    def browse_export_view(self, request):
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        if request.method != "POST":
+            return HttpResponseNotAllowed(["POST"])
+        try:
+            list_obj = m.List.objects.get(pk=request.POST.get("list_id"))
+        except (m.List.DoesNotExist, ValueError):
+            raise Http404
+        try:
+            days = int(request.POST.get("days", 365))
+        except ValueError:
+            days = 365
+        since = timezone.localtime(timezone.now()) - datetime.timedelta(days=days)
+        export = self.start_export(
+            request,
+            list_obj.pk,
+            {
+                "since": since.isoformat(),
+                "action": request.POST.get("action"),
+                "optout_type": request.POST.get("optout_type"),
+            },
+        )
+        return HttpResponseRedirect(
+            reverse("admin:core_subscriptionlog_export", args=[export.pk])
+        )
+
+    def get_export(self, request, pk):
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        try:
+            return m.SubscriptionLogExport.objects.select_related("list").get(pk=pk)
+        except m.SubscriptionLogExport.DoesNotExist:
+            raise Http404
+
+    def export_view(self, request, pk):
+        export = self.get_export(request, pk)
+        context = dict(
+            self.admin_site.each_context(request),
+            opts=self.model._meta,
+            title="Subscription log export",
+            export=export,
+        )
+        return TemplateResponse(
+            request, "admin/core/subscriptionlog/export.html", context
+        )
+
+    def export_download_view(self, request, pk):
+        export = self.get_export(request, pk)
+        if export.status != m.SubscriptionLogExport.STATUS_DONE or not export.file:
+            raise Http404
+        response = FileResponse(
+            export.file.storage.open(export.file.name), content_type="application/gzip"
+        )
+        response["Content-Disposition"] = "attachment; filename={}".format(
+            os.path.basename(export.file.name)
+        )
+        return response
+
 
 class ProductAdmin(admin.ModelAdmin):
     formfield_overrides = {
@@ -1,24 +1,96 @@
 import copy
 
+from django.conf import settings
 from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.urlresolvers import reverse
 from django.core.validators import URLValidator
 from rest_framework import serializers, validators
 from rest_framework.fields import SkipField, set_value
 from rest_framework.serializers import ValidationError
+from sailthru_sync import validators as st_validators
 
 from .fields import (
     list_slug_validator,
     normalized_email_validator,
     product_slug_validator,
+    vars_jsonfield_validator,
 )
 from . import models as m
 
 
+def parse_fields(fields_param):
+    """
+    Turns a `fields` query parameter such as "id,subscriptions.list" into a
+    tree of requested fields: {"id": None, "subscriptions": {"list": None}}.
+    None means the whole field was requested.
+    """
+    tree = {}
+    for path in fields_param.split(","):
+        names = [name.strip() for name in path.split(".") if name.strip()]
+        node = tree
+        for depth, name in enumerate(names):
+            if depth == len(names) - 1:
+                node[name] = None
+            elif node.get(name, {}) is None:
+                break  # the whole field is already requested
+            else:
+                node = node.setdefault(name, {})
+    return tree
+
+
+def requested_fields(request):
+    """The parsed `fields` query parameter, or None when it was not given."""
+    fields_param = request.query_params.get("fields", None)
+    if fields_param is None:
+        return None
+    return parse_fields(fields_param)
+
+
+def subscriber_counts_requested(request):
+    """Whether a list request asked for subscriber counts with `?counts=true`."""
+    return request is not None and request.query_params.get("counts", "").lower() in (
+        "1",
+        "true",
+        "yes",
+    )
+
+
+def prune_fields(serializer, tree):
+    # Drop any fields that are not in the tree, then recurse into nested
+    # serializers for dotted names like "subscriptions.list".
+    for field_name in set(serializer.fields) - set(tree):
+        serializer.fields.pop(field_name)
+    for field_name, subtree in tree.items():
+        if subtree and field_name in serializer.fields:
+            nested = serializer.fields[field_name]
+            nested = getattr(nested, "child", nested)
+            if isinstance(nested, serializers.Serializer):
+                prune_fields(nested, subtree)
+
+
+class LatestListSerializer(serializers.ListSerializer):
+    """
+    Serializes only the latest `AUDIENCE_USER_NESTED_LIMIT` rows of a to-many
+    relation: the `latest_<field name>` list AudienceUserViewSet loads for
+    reads, or else the head of the relation's newest-first ordering.
+    """
+
+    def get_attribute(self, instance):
+        latest = getattr(instance, "latest_" + self.field_name, None)
+        if latest is not None:
+            return latest
+        related = super().get_attribute(instance)
+        return related.all()[: settings.AUDIENCE_USER_NESTED_LIMIT]
+
+
 class DynamicFieldsModelSerializer(serializers.ModelSerializer):
     """
     A ModelSerializer that takes an additional `fields` argument that
     controls which fields should be displayed.
 
+    Nested fields can be selected with dotted names, _eg_
+    `?fields=id,subscriptions.list`.
+
     ---Note from BS---
     Modified version of copy-paste from the DRF documentation:
     http://www.django-rest-framework.org/api-guide/serializers/#example
@@ -28,14 +100,13 @@ class DynamicFieldsModelSerializer(serializers.ModelSerializer):
         # Instantiate the superclass normally
         super(DynamicFieldsModelSerializer, self).__init__(*args, **kwargs)
 
-        fields_param = self.context["request"].query_params.get("fields", None)
-        if fields_param is not None:
-            fields = fields_param.split(",")
-            # Drop any fields that are not specified in the `fields` argument.
-            allowed = set(fields)
-            existing = set(self.fields)
-            for field_name in existing - allowed:
-                self.fields.pop(field_name)
+        # views that choose the fields themselves pass them in the context
+        if "fields" in self.context:
+            fields = self.context["fields"]
+        else:
+            fields = requested_fields(self.context["request"])
+        if fields is not None:
+            prune_fields(self, fields)
 
 
 class AthenaContentMetadataSerializer(serializers.ModelSerializer):
@@ -44,6 +115,21 @@ class AthenaContentMetadataSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
+class AthenaContentMetadataBulkSerializer(serializers.ModelSerializer):
+    """
+    Validates one line of a bulk load (see core.bulk) without touching the
+    database: the content type is taken as its name (or pk) and resolved for
+    the whole batch at once, and existing ids are updated, not rejected.
+    """
+
+    athena_content_type = serializers.CharField(max_length=200)
+
+    class Meta:
+        model = m.AthenaContentMetadata
+        exclude = ("id",)
+        extra_kwargs = {"athena_content_id": {"validators": []}}
+
+
 class ReferrerField(serializers.URLField):
     """
     Intended to make `referrer` more inclusive.
@@ -68,7 +154,7 @@ class ReferrerField(serializers.URLField):
 class UserContentHistorySerializer(serializers.ModelSerializer):
     class Meta:
         model = m.UserContentHistory
-        fields = "__all__"
+        exclude = ("interests_ingested",)
 
     referrer = ReferrerField(allow_blank=True, required=False, max_length=500)
 
@@ -81,6 +167,30 @@ class UserContentHistorySerializer(serializers.ModelSerializer):
         return super(UserContentHistorySerializer, self).to_internal_value(data)
 
 
+class UserContentRollupSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = m.UserContentRollup
+        fields = (
+            "email",
+            "athena_content_metadata",
+            "first_seen",
+            "last_seen",
+            "count",
+            "last_referrer",
+        )
+
+
+class UserInterestSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = m.UserInterest
+        fields = ("kind", "value", "weight", "updated")
+
+    weight = serializers.SerializerMethodField()
+
+    def get_weight(self, obj):
+        return round(obj.weight(self.context.get("now")), 4)
+
+
 class CompactListSerializer(serializers.ModelSerializer):
     class Meta:
         model = m.List
@@ -251,6 +361,8 @@ class ListSerializer(serializers.ModelSerializer):
             "sync_externally",
             "archived",
             "subscription_triggers",
+            "subscribers_active",
+            "subscribers_inactive",
         )
 
     slug = serializers.CharField(
@@ -267,6 +379,22 @@ class ListSerializer(serializers.ModelSerializer):
         many=True, read_only=True, required=False
     )
 
+    # only included on request, from the precomputed counters; null until a
+    # new list's counters are first reconciled
+    subscribers_active = serializers.IntegerField(
+        source="subscriber_count.active", read_only=True
+    )
+
+    subscribers_inactive = serializers.IntegerField(
+        source="subscriber_count.inactive", read_only=True
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not subscriber_counts_requested(self.context.get("request")):
+            self.fields.pop("subscribers_active")
+            self.fields.pop("subscribers_inactive")
+
 
 class SubscriptionTriggerSerializer(serializers.ModelSerializer):
     class Meta:
@@ -336,6 +464,27 @@ class UserSourceSerializer(serializers.ModelSerializer):
     timestamp = serializers.DateTimeField(required=False)
 
 
+class AudienceUserBulkSerializer(serializers.Serializer):
+    """
+    Validates one line of a bulk user load (see core.bulk) without touching
+    the database: existing emails are updated, as with PUT, not rejected.
+    """
+
+    email = serializers.EmailField(validators=[normalized_email_validator])
+
+    vars = serializers.DictField(
+        required=False,
+        validators=[
+            vars_jsonfield_validator,
+            st_validators.reserved_words_jsonfield_validator,
+        ],
+    )
+
+    omeda_id = serializers.CharField(max_length=255, required=False, allow_null=True)
+
+    source_signups = UserSourceSerializer(many=True, required=False)
+
+
 class UserVarsHistorySerializer(serializers.ModelSerializer):
     class Meta:
         model = m.UserVarsHistory
@@ -345,6 +494,22 @@ class UserVarsHistorySerializer(serializers.ModelSerializer):
         )
 
 
+class SubscriptionLogSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = m.SubscriptionLog
+        fields = (
+            "id",
+            "list",
+            "action",
+            "comment",
+            "timestamp",
+        )
+
+    list = serializers.SlugRelatedField(
+        source="subscription.list", slug_field="slug", read_only=True
+    )
+
+
 class OptoutHistorySerializer(serializers.ModelSerializer):
     class Meta:
         model = m.OptoutHistory
@@ -554,11 +719,14 @@ class AudienceUserSerializer(DynamicFieldsModelSerializer):
             "sailthru_id",
             "vars",
             "vars_history",
+            "vars_history_url",
             "source_signups",
             "sailthru_optout",
             "subscriptions",
             "subscription_log",
+            "subscription_log_url",
             "product_actions",
+            "product_actions_url",
         )
 
     email = serializers.EmailField(
@@ -576,13 +744,54 @@ class AudienceUserSerializer(DynamicFieldsModelSerializer):
 
     source_signups = UserSourceSerializer(many=True, read_only=False, required=False)
 
-    vars_history = UserVarsHistorySerializer(many=True, read_only=True)
+    # vars history, product actions and the subscription log grow without
+    # bound, so only the latest few are embedded; the *_url fields link to
+    # the paginated collections
+    vars_history = LatestListSerializer(
+        child=UserVarsHistorySerializer(), read_only=True
+    )
 
-    subscription_log = serializers.ListField(
-        child=serializers.CharField(), required=False, read_only=True
+    vars_history_url = serializers.SerializerMethodField()
+
+    subscription_log = serializers.SerializerMethodField()
+
+    subscription_log_url = serializers.SerializerMethodField()
+
+    product_actions = LatestListSerializer(
+        child=ProductActionSerializer(), read_only=True
     )
 
-    product_actions = ProductActionSerializer(many=True, read_only=True)
+    product_actions_url = serializers.SerializerMethodField()
+
+    def get_subscription_log(self, obj):
+        # AudienceUserViewSet loads the latest entries for reads; fall back to
+        # querying them for everything else
+        entries = getattr(obj, "latest_subscription_log", None)
+        if entries is None:
+            entries = obj.subscription_log.order_by("-timestamp", "-id")[
+                : settings.AUDIENCE_USER_NESTED_LIMIT
+            ]
+        # oldest first, as in the full log
+        return [
+            str(entry)
+            for entry in sorted(entries, key=lambda entry: (entry.timestamp, entry.pk))
+        ]
+
+    def _collection_url(self, view_name, obj):
+        url = reverse(view_name, kwargs={"audienceuser_pk": obj.pk})
+        request = self.context.get("request")
+        return request.build_absolute_uri(url) if request else url
+
+    def get_vars_history_url(self, obj):
+        return self._collection_url("uservarshistory-list", obj)
+
+    def get_subscription_log_url(self, obj):
+        return self._collection_url("subscriptionlog-list", obj)
+
+    def get_product_actions_url(self, obj):
+        return self._collection_url("productaction-list", obj) + "?page_size={}".format(
+            settings.AUDIENCE_USER_NESTED_LIMIT
+        )
 
     def create(self, validated_data):
         source_signups = validated_data.pop("source_signups", [])
@@ -1,18 +1,67 @@
 import copy
+import datetime
+from collections import OrderedDict
 
+from django.conf import settings
+from django.db.models import Prefetch, Q
 from django.http import Http404
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from rest_framework import status, viewsets
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.decorators import list_route
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 from rest_framework.response import Response
 
 from . import api_serializers
+from .bulk import AudienceUserLoader, ContentMetadataLoader
 from . import models as m
+from .db import prefetch_latest
 
 
 class BigPaginator(PageNumberPagination):
     page_size = 100
 
 
+class HistoryPaginator(CursorPagination):
+    """
+    Newest-first pages through a user's history, which can run to thousands
+    of rows: a cursor page costs the same however deep it is and needs no
+    COUNT(*). Timestamps can tie, so the id breaks ties: the order is the
+    same as that of the latest rows AudienceUserSerializer embeds.
+    """
+
+    ordering = ("-timestamp", "-id")
+    page_size = 50
+    max_page_size = 500
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params["page_size"])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(page_size, self.max_page_size) if page_size > 0 else self.page_size
+
+
+class OptionalHistoryPaginator(HistoryPaginator):
+    """
+    For history collections that have always been returned whole: pages only
+    when a `page_size` or `cursor` is given.
+    """
+
+    def get_page_size(self, request):
+        if not {"page_size", self.cursor_query_param} & set(request.query_params):
+            return None
+        return super().get_page_size(request)
+
+
+class ContentSearchPaginator(HistoryPaginator):
+    """Newest-first pages through athena content search results."""
+
+    ordering = ("-date_created", "-id")
+
+
 class AthenaContentMetadataViewSet(viewsets.ModelViewSet):
     model = m.AthenaContentMetadata
     pagination_class = BigPaginator
@@ -28,13 +77,88 @@ class AthenaContentMetadataViewSet(viewsets.ModelViewSet):
         except (m.AthenaContentMetadata.DoesNotExist, ValueError):
             return None
 
+    # ?topics=a,b finds content with all of the values, ?topics__overlap=a,b
+    # content with any of them; both are served by GIN indexes
+    array_filters = ("topics", "keywords", "interests", "authors")
+
+    @staticmethod
+    def _split(value):
+        return [item.strip() for item in (value or "").split(",") if item.strip()]
+
+    @staticmethod
+    def _parse_moment(name, value):
+        try:
+            moment = parse_datetime(value)
+            if moment is None:
+                day = parse_date(value)
+                moment = day and datetime.datetime.combine(day, datetime.time())
+        except ValueError:
+            moment = None
+        if moment is None:
+            raise ValidationError({name: ["Expected a date or datetime."]})
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        return moment
+
     def get_queryset(self):
         queryset = m.AthenaContentMetadata.objects.all()
-        slug = self.request.query_params.get("slug", None)
+        params = self.request.query_params
+        slug = params.get("slug", None)
         if slug:
             queryset = queryset.filter(slug=slug)
+
+        site_names = self._split(params.get("site_name"))
+        if site_names:
+            queryset = queryset.filter(site_name__in=site_names)
+
+        for field in self.array_filters:
+            values = self._split(params.get(field))
+            if values:
+                queryset = queryset.filter(**{field + "__contains": values})
+            values = self._split(params.get(field + "__overlap"))
+            if values:
+                queryset = queryset.filter(**{field + "__overlap": values})
+
+        # categories are {"primary": slug, "secondary": [slug, ...]}
+        category = params.get("category")
+        if category:
+            queryset = queryset.filter(
+                Q(categories__contains={"primary": category})
+                | Q(categories__contains={"secondary": [category]})
+            )
+        primary_category = params.get("primary_category")
+        if primary_category:
+            queryset = queryset.filter(
+                categories__contains={"primary": primary_category}
+            )
+
+        # published_after is inclusive, published_before exclusive
+        if params.get("published_after"):
+            queryset = queryset.filter(
+                date_published__gte=self._parse_moment(
+                    "published_after", params["published_after"]
+                )
+            )
+        if params.get("published_before"):
+            queryset = queryset.filter(
+                date_published__lt=self._parse_moment(
+                    "published_before", params["published_before"]
+                )
+            )
         return queryset
 
+    @list_route(methods=["get"])
+    def search(self, request):
+        """
+        The content matching the filters of get_queryset(), most recently
+        created first, in cursor pages that need no COUNT(*) and cost the
+        same however deep they are.
+        """
+        paginator = ContentSearchPaginator()
+        page = paginator.paginate_queryset(self.get_queryset(), request, view=self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
     def create(self, request):
         # handles creates _and_ updates via POST
         existing_metadata = self._get_existing_metadata(request.data)
@@ -48,6 +172,16 @@ class AthenaContentMetadataViewSet(viewsets.ModelViewSet):
         )
         return Response(serializer.data, status=return_status)
 
+    @list_route(methods=["post"])
+    def bulk(self, request):
+        """
+        Upserts an NDJSON body of metadata, one object per line (see
+        core.bulk); responds with the created and updated counts and the
+        errors of the lines that were skipped.
+        """
+        loader = ContentMetadataLoader().load(request.body.splitlines())
+        return Response(loader.result)
+
     def destroy(self, request):
         # metadata entries do not need to be delete-able via the REST API
         return Response(status=status.HTTP_501_NOT_IMPLEMENTED)
@@ -66,6 +200,21 @@ class UserContentHistoryViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(email=email)
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        # Views from before the retention period only survive as per-content
+        # rollups, which come with the first page of an email's history.
+        email = request.query_params.get("email")
+        page = request.query_params.get(self.paginator.page_query_param, "1")
+        if email and page == "1" and isinstance(response.data, dict):
+            rollups = m.UserContentRollup.objects.filter(email=email).order_by(
+                "-last_seen"
+            )
+            response.data["rollups"] = api_serializers.UserContentRollupSerializer(
+                rollups, many=True
+            ).data
+        return response
+
     def update(self, request):
         # content history entries do not need to be update-able via the REST API
         return Response(status=status.HTTP_501_NOT_IMPLEMENTED)
@@ -75,25 +224,356 @@ class UserContentHistoryViewSet(viewsets.ModelViewSet):
         return Response(status=status.HTTP_501_NOT_IMPLEMENTED)
 
 
+class UserInterestViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    An email's top interests: ?email= (required), optionally of one ?kind=,
+    the `?limit=` highest by decayed weight. Read straight off the
+    (email, score) index.
+    """
+
+    model = m.UserInterest
+    queryset = m.UserInterest.objects.all()
+    serializer_class = api_serializers.UserInterestSerializer
+    pagination_class = None
+    default_limit = 10
+    max_limit = 100
+
+    def get_limit(self):
+        try:
+            limit = int(self.request.query_params["limit"])
+        except (KeyError, ValueError):
+            return self.default_limit
+        return min(limit, self.max_limit) if limit > 0 else self.default_limit
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["now"] = timezone.now()
+        return context
+
+    def list(self, request, *args, **kwargs):
+        email = request.query_params.get("email")
+        if not email:
+            return Response(
+                {"email": ["This query parameter is required."]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        interests = m.UserInterest.objects.top(
+            email, self.get_limit(), kind=request.query_params.get("kind") or None
+        )
+        serializer = self.get_serializer(interests, many=True)
+        return Response(serializer.data)
+
+
+def wants(fields, name):
+    """
+    Whether `name` is needed for a (sub)tree from `api_serializers.parse_fields`;
+    None stands for every field.
+    """
+    return fields is None or name in fields
+
+
 class AudienceUserViewSet(viewsets.ModelViewSet):
     model = m.AudienceUser
     serializer_class = api_serializers.AudienceUserSerializer
     queryset = m.AudienceUser.objects.all()
 
+    # the most hashes resolve-hashes takes at once
+    max_resolve_hashes = 1000
+
     def get_queryset(self):
-        prefetch_fields = (
-            "product_actions",
-            "source_signups",
-            "vars_history",
-            "subscriptions",
-            "subscriptions__list",
-        )
-        queryset = m.AudienceUser.objects.all().prefetch_related(*prefetch_fields)
+        queryset = m.AudienceUser.objects.all()
+        if self.request.method in SAFE_METHODS:
+            queryset = self.plan_queryset(
+                queryset, api_serializers.requested_fields(self.request)
+            )
         email = self.request.query_params.get("email", None)
         if email:
             queryset = queryset.filter(email=email)
+        email_hash = self.request.query_params.get("email_hash", None)
+        if email_hash:
+            queryset = queryset.filter(email_hash=email_hash.lower())
         return queryset
 
+    def plan_queryset(self, queryset, fields):
+        """
+        Loads only what the requested `fields` need: the user's own columns
+        and the related collections (and their nested relations) that are
+        actually serialized.
+        """
+        if fields is not None:
+            concrete = {field.name for field in m.AudienceUser._meta.concrete_fields}
+            columns = {"id"}
+            for name in fields:
+                if name in concrete:
+                    columns.add(name)
+            queryset = queryset.only(*columns)
+        return queryset.prefetch_related(*self.get_prefetches(fields))
+
+    @staticmethod
+    def get_prefetches(fields):
+        prefetches = []
+        if wants(fields, "source_signups"):
+            prefetches.append("source_signups")
+        if wants(fields, "subscriptions"):
+            subscriptions = m.Subscription.objects.all()
+            if wants(fields.get("subscriptions") if fields else None, "list"):
+                subscriptions = subscriptions.select_related("list")
+            prefetches.append(Prefetch("subscriptions", queryset=subscriptions))
+        return prefetches
+
+    @staticmethod
+    def get_latest_collections(fields):
+        """
+        (to_attr, parent path, queryset, ordering) for each of the unbounded
+        collections the requested `fields` need; see `load_latest()`.
+        """
+        collections = []
+        if wants(fields, "vars_history"):
+            collections.append(
+                (
+                    "latest_vars_history",
+                    "audience_user",
+                    m.UserVarsHistory.objects.all(),
+                    ("-timestamp", "-id"),
+                )
+            )
+
+        if wants(fields, "subscription_log"):
+            # the log is rendered with its subscription's list
+            collections.append(
+                (
+                    "latest_subscription_log",
+                    "subscription__audience_user",
+                    m.SubscriptionLog.objects.select_related("subscription__list"),
+                    ("-timestamp", "-id"),
+                )
+            )
+
+        if wants(fields, "product_actions"):
+            action_fields = fields and fields.get("product_actions")
+            actions = m.ProductAction.objects.all()
+            if wants(action_fields, "product"):
+                product_fields = action_fields and action_fields.get("product")
+                actions = actions.select_related("product")
+                for name in ("subtypes", "topics"):
+                    if wants(product_fields, name):
+                        actions = actions.prefetch_related("product__" + name)
+            if wants(action_fields, "details"):
+                actions = actions.prefetch_related("details")
+            collections.append(
+                (
+                    "latest_product_actions",
+                    "audience_user",
+                    actions,
+                    ("-timestamp", "-id"),
+                )
+            )
+
+        return collections
+
+    def load_latest(self, users, fields):
+        """
+        Loads the latest `AUDIENCE_USER_NESTED_LIMIT` rows of each unbounded
+        collection for all of `users` at once; the serializer embeds only
+        those.
+        """
+        for to_attr, parent_path, queryset, ordering in self.get_latest_collections(
+            fields
+        ):
+            prefetch_latest(
+                users,
+                parent_path,
+                queryset,
+                settings.AUDIENCE_USER_NESTED_LIMIT,
+                ordering,
+                to_attr,
+            )
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if page is not None:
+            self.load_latest(page, api_serializers.requested_fields(self.request))
+        return page
+
+    def get_object(self):
+        user = super().get_object()
+        if self.request.method in SAFE_METHODS:
+            self.load_latest([user], api_serializers.requested_fields(self.request))
+        return user
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get("email", None):
+            # emails are unique, so an email lookup is a single indexed query
+            # for at most one user: skip the paginator and its COUNT(*)
+            users = list(self.filter_queryset(self.get_queryset())[:1])
+        elif request.query_params.get("email_hash", None):
+            # as are their hashes, barring collisions
+            users = list(self.filter_queryset(self.get_queryset()))
+        else:
+            return super().list(request, *args, **kwargs)
+        self.load_latest(users, api_serializers.requested_fields(request))
+        serializer = self.get_serializer(users, many=True)
+        return Response(
+            OrderedDict(
+                [
+                    ("count", len(users)),
+                    ("next", None),
+                    ("previous", None),
+                    ("results", serializer.data),
+                ]
+            )
+        )
+
+    # the keys lookup takes, and the columns they match
+    lookup_keys = OrderedDict(
+        (("emails", "email"), ("ids", "id"), ("omeda_ids", "omeda_id"))
+    )
+
+    @list_route(methods=["post"])
+    def lookup(self, request):
+        """
+        Finds many users in one query by one kind of key, given as a list:
+        {"emails": [...]}, {"ids": [...]} or {"omeda_ids": [...]}, up to
+        AUDIENCE_USER_LOOKUP_LIMIT of them. The records have the fields of
+        "fields" (in the body or the query string, as with ?fields=), or
+        AUDIENCE_USER_LOOKUP_FIELDS; keys that matched no user are listed in
+        "not_found".
+        """
+        data = request.data if isinstance(request.data, dict) else {}
+        given = [key for key in self.lookup_keys if key in data]
+        if len(given) != 1:
+            return Response(
+                {
+                    "non_field_errors": [
+                        "Expected exactly one of: {}.".format(
+                            ", ".join(self.lookup_keys)
+                        )
+                    ]
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        key = given[0]
+        values = data[key]
+        if not isinstance(values, list):
+            return Response(
+                {key: ["Expected a list."]}, status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(values) > settings.AUDIENCE_USER_LOOKUP_LIMIT:
+            return Response(
+                {
+                    key: [
+                        "At most {} at a time.".format(
+                            settings.AUDIENCE_USER_LOOKUP_LIMIT
+                        )
+                    ]
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            if key == "ids":
+                values = [int(value) for value in values]
+            else:
+                values = [str(value).strip() for value in values]
+        except (TypeError, ValueError):
+            return Response(
+                {key: ["Expected a list of integers."]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if key == "emails":
+            values = [value.lower() for value in values]
+
+        fields = api_serializers.parse_fields(
+            data.get("fields")
+            or request.query_params.get("fields")
+            or settings.AUDIENCE_USER_LOOKUP_FIELDS
+        )
+        column = self.lookup_keys[key]
+        queryset = self.plan_queryset(
+            m.AudienceUser.objects.filter(**{column + "__in": set(values)}),
+            # the key has to be loaded to tell which ones were found
+            dict(fields, **{column: None}),
+        )
+        users = list(queryset)
+        self.load_latest(users, fields)
+
+        found = {getattr(user, column) for user in users}
+        serializer = api_serializers.AudienceUserSerializer(
+            users, many=True, context=dict(self.get_serializer_context(), fields=fields)
+        )
+        return Response(
+            OrderedDict(
+                (
+                    ("results", serializer.data),
+                    (
+                        "not_found",
+                        list(
+                            OrderedDict.fromkeys(
+                                value for value in values if value not in found
+                            )
+                        ),
+                    ),
+                )
+            )
+        )
+
+    @list_route(methods=["post"], url_path="resolve-hashes")
+    def resolve_hashes(self, request):
+        """
+        Maps a list of email hashes ({"email_hashes": [...]}) to the users
+        they belong to, with one indexed query: responds with the id and
+        email of each user found, and the hashes that matched nobody.
+        """
+        data = request.data if isinstance(request.data, dict) else {}
+        hashes = data.get("email_hashes")
+        if not isinstance(hashes, list) or not all(
+            isinstance(value, str) for value in hashes
+        ):
+            return Response(
+                {"email_hashes": ["Expected a list of md5 hashes."]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(hashes) > self.max_resolve_hashes:
+            return Response(
+                {
+                    "email_hashes": [
+                        "At most {} hashes at a time.".format(self.max_resolve_hashes)
+                    ]
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        hashes = {value.strip().lower() for value in hashes}
+        users = (
+            m.AudienceUser.objects.filter(email_hash__in=hashes)
+            .order_by("email_hash", "pk")
+            .values_list("email_hash", "pk", "email")
+        )
+        results = [
+            OrderedDict((("email_hash", email_hash), ("id", pk), ("email", email)))
+            for email_hash, pk, email in users
+        ]
+        resolved = {result["email_hash"] for result in results}
+        return Response(
+            OrderedDict(
+                (
+                    ("results", results),
+                    ("unresolved", sorted(hashes - resolved)),
+                )
+            )
+        )
+
+    @list_route(methods=["post"])
+    def bulk(self, request):
+        """
+        Creates or updates the users of an NDJSON body, one
+        {email, vars, omeda_id, source_signups} object per line (see
+        core.bulk); vars are merged into existing users' as with PUT.
+        Responds with the created, updated and unchanged counts and the
+        errors of the lines that were skipped.
+        """
+        loader = AudienceUserLoader().load(request.body.splitlines())
+        return Response(loader.result)
+
     def destroy(self, request, pk):
         # disabled because for now we only want to handle user deletes via the admin,
         # where we have some special stuff to do the delete-at-Sailthru procedure
@@ -110,6 +590,8 @@ class ListViewSet(viewsets.ModelViewSet):
         queryset = m.List.objects.all().prefetch_related(
             "subscription_triggers__related_list"
         )
+        if api_serializers.subscriber_counts_requested(self.request):
+            queryset = queryset.select_related("subscriber_count")
 
         list_type = self.request.query_params.get("type", None)
         if list_type:
@@ -356,6 +838,7 @@ class ProductActionsViewset(viewsets.ModelViewSet):
     model = m.ProductAction
     queryset = m.ProductAction.objects.all()
     serializer_class = api_serializers.ProductActionSerializer
+    pagination_class = OptionalHistoryPaginator
 
     @staticmethod
     def _get_existing_product_action(data):
@@ -384,6 +867,10 @@ class ProductActionsViewset(viewsets.ModelViewSet):
             )
         except m.AudienceUser.DoesNotExist:
             raise Http404
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = api_serializers.ProductActionSerializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
         serializer = api_serializers.ProductActionSerializer(queryset, many=True)
         return Response(serializer.data)
 
@@ -431,6 +918,39 @@ class ProductActionsViewset(viewsets.ModelViewSet):
         return Response(status=status.HTTP_501_NOT_IMPLEMENTED)
 
 
+class AudienceUserHistoryViewset(viewsets.ReadOnlyModelViewSet):
+    """
+    Read-only, paginated history of an audience user; AudienceUserSerializer
+    embeds only the latest entries and links here for the rest.
+    """
+
+    pagination_class = HistoryPaginator
+    # lookup from the history model to the audience user
+    audience_user_lookup = "audience_user"
+
+    def get_queryset(self):
+        audienceuser_pk = self.kwargs["audienceuser_pk"]
+        try:
+            if not m.AudienceUser.objects.filter(pk=audienceuser_pk).exists():
+                raise Http404
+        except ValueError:
+            raise Http404
+        return self.queryset.filter(**{self.audience_user_lookup: audienceuser_pk})
+
+
+class UserVarsHistoryViewset(AudienceUserHistoryViewset):
+    model = m.UserVarsHistory
+    queryset = m.UserVarsHistory.objects.all()
+    serializer_class = api_serializers.UserVarsHistorySerializer
+
+
+class SubscriptionLogViewset(AudienceUserHistoryViewset):
+    model = m.SubscriptionLog
+    queryset = m.SubscriptionLog.objects.select_related("subscription__list")
+    serializer_class = api_serializers.SubscriptionLogSerializer
+    audience_user_lookup = "subscription__audience_user"
+
+
 class VarKeyViewSet(viewsets.ModelViewSet):
     model = m.VarKey
     pagination_class = BigPaginator
@@ -6,4 +6,5 @@ class CoreConfig(AppConfig):
     verbose_name = "Audience Data"
 
     def ready(self):
+        from . import lookups
         from .signals import receivers
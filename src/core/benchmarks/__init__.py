@@ -0,0 +1,11 @@
+"""
+Benchmark suites for the API and model hot paths.
+
+The suites are ordinary Django test cases in `bench_*.py` modules, so they are
+skipped by the default test run. Run them against the Postgres container with:
+
+    python src/manage.py test core.benchmarks --pattern="bench_*.py"
+
+See `harness.py` for the environment variables that record baselines and
+tune the thresholds.
+"""
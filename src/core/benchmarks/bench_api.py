@@ -0,0 +1,462 @@
+import json
+
+from django import test
+from django.contrib.auth.models import User
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .. import models as m
+from . import fixtures
+from .harness import ITERATIONS, BenchmarkTestCase
+
+
+@test.override_settings(SAILTHRU_SYNC_SIGNALS_ENABLED=False, RAVEN_CONFIG={"dsn": None})
+class ApiBenchmarks(BenchmarkTestCase):
+    """List, retrieve and create benchmarks for every endpoint in core/urls.py."""
+
+    client_class = APIClient
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.api_user = User.objects.create(username="benchmark")
+        cls.token = Token.objects.create(user=cls.api_user)
+        cls.users, cls.lists, cls.products = fixtures.seed_audience()
+        cls.content_type, cls.metadata = fixtures.seed_content(cls.users)
+        cls.blank_users = fixtures.seed_blank_users(ITERATIONS)
+        cls.user = cls.users[0]
+        cls.var_key = m.VarKey.objects.first()
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.api_user, token=self.token)
+
+    def get(self, url, expected_status=status.HTTP_200_OK):
+        def request(iteration):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, expected_status, url)
+
+        return request
+
+    def post(self, url, payload, expected_status=status.HTTP_201_CREATED):
+        """`url` and `payload` are callables taking the iteration number."""
+
+        def request(iteration):
+            response = self.client.post(
+                url(iteration), payload(iteration), format="json"
+            )
+            self.assertEqual(
+                response.status_code, expected_status, response.content[:500]
+            )
+
+        return request
+
+    # audience users
+
+    def test_audience_users_list(self):
+        self.measure("audience_users.list", self.get("/api/audience-users"))
+
+    def test_audience_users_list_by_email(self):
+        self.measure(
+            "audience_users.list_by_email",
+            self.get("/api/audience-users?email={}".format(self.user.email)),
+        )
+
+    def test_audience_users_list_by_email_sparse(self):
+        self.measure(
+            "audience_users.list_by_email_sparse",
+            self.get(
+                "/api/audience-users?email={}&fields=id,email,vars".format(
+                    self.user.email
+                )
+            ),
+        )
+
+    def test_audience_users_retrieve(self):
+        self.measure(
+            "audience_users.retrieve",
+            self.get("/api/audience-users/{}".format(self.user.pk)),
+        )
+
+    def test_audience_users_lookup(self):
+        emails = [user.email for user in self.users] + [
+            "missing{}@example.com".format(n) for n in range(100)
+        ]
+        self.measure(
+            "audience_users.lookup",
+            self.post(
+                lambda i: "/api/audience-users/lookup",
+                lambda i: {"emails": emails},
+                expected_status=status.HTTP_200_OK,
+            ),
+        )
+
+    def test_audience_users_create(self):
+        self.measure(
+            "audience_users.create",
+            self.post(
+                lambda i: "/api/audience-users",
+                lambda i: {
+                    "email": "created{}@example.com".format(i),
+                    "vars": {"benchmark_var_0": str(i)},
+                    "source_signups": [{"name": "benchmark_source_0"}],
+                },
+            ),
+        )
+
+    def test_audience_users_bulk(self):
+        def request(iteration):
+            # half of each batch updates the previous iteration's users
+            body = "\n".join(
+                json.dumps(
+                    {
+                        "email": "bulk{}@example.com".format(iteration * 50 + n),
+                        "vars": {"benchmark_var_0": str(iteration)},
+                        "source_signups": [{"name": "benchmark_source_0"}],
+                    }
+                )
+                for n in range(100)
+            )
+            response = self.client.post(
+                "/api/audience-users/bulk", body, content_type="application/x-ndjson"
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json()["errors"], [])
+
+        self.measure("audience_users.bulk_100", request)
+
+    # nested under audience users
+
+    def test_subscriptions_list(self):
+        self.measure(
+            "subscriptions.list",
+            self.get("/api/audience-users/{}/subscriptions".format(self.user.pk)),
+        )
+
+    def test_subscriptions_retrieve(self):
+        subscription = self.user.subscriptions.first()
+        self.measure(
+            "subscriptions.retrieve",
+            self.get(
+                "/api/audience-users/{}/subscriptions/{}".format(
+                    self.user.pk, subscription.pk
+                )
+            ),
+        )
+
+    def test_subscriptions_create(self):
+        self.measure(
+            "subscriptions.create",
+            self.post(
+                lambda i: "/api/audience-users/{}/subscriptions".format(
+                    self.blank_users[i].pk
+                ),
+                lambda i: {"list": self.lists[0].slug},
+            ),
+        )
+
+    def test_product_actions_list(self):
+        self.measure(
+            "product_actions.list",
+            self.get("/api/audience-users/{}/product-actions".format(self.user.pk)),
+        )
+
+    def test_product_actions_retrieve(self):
+        action = self.user.product_actions.first()
+        self.measure(
+            "product_actions.retrieve",
+            self.get(
+                "/api/audience-users/{}/product-actions/{}".format(
+                    self.user.pk, action.pk
+                )
+            ),
+        )
+
+    def test_product_actions_create(self):
+        self.measure(
+            "product_actions.create",
+            self.post(
+                lambda i: "/api/audience-users/{}/product-actions".format(
+                    self.blank_users[i].pk
+                ),
+                lambda i: {
+                    "product": self.products[0].slug,
+                    "type": "registered",
+                    "timestamp": "2016-01-01T00:00:00Z",
+                    "details": ["first detail", "second detail"],
+                },
+            ),
+        )
+
+    def test_optout_history_list(self):
+        self.measure(
+            "optout_history.list",
+            self.get("/api/audience-users/{}/optout-history".format(self.user.pk)),
+        )
+
+    def test_optout_history_retrieve(self):
+        optout = self.user.optout_history.first()
+        self.measure(
+            "optout_history.retrieve",
+            self.get(
+                "/api/audience-users/{}/optout-history/{}".format(
+                    self.user.pk, optout.pk
+                )
+            ),
+        )
+
+    def test_optout_history_create(self):
+        self.measure(
+            "optout_history.create",
+            self.post(
+                lambda i: "/api/audience-users/{}/optout-history".format(
+                    self.blank_users[i].pk
+                ),
+                lambda i: {"sailthru_optout": "basic", "comment": "benchmark"},
+            ),
+        )
+
+    # lists
+
+    def test_lists_list(self):
+        self.measure("lists.list", self.get("/api/lists"))
+
+    def test_lists_retrieve(self):
+        self.measure(
+            "lists.retrieve", self.get("/api/lists/{}".format(self.lists[0].pk))
+        )
+
+    def test_lists_create(self):
+        self.measure(
+            "lists.create",
+            self.post(
+                lambda i: "/api/lists",
+                lambda i: {
+                    "name": "Created list {}".format(i),
+                    "slug": "created_list_{}".format(i),
+                    "type": "newsletter",
+                },
+            ),
+        )
+
+    def test_subscription_triggers_list(self):
+        self.measure(
+            "subscription_triggers.list",
+            self.get("/api/lists/{}/subscription-triggers".format(self.lists[0].pk)),
+        )
+
+    def test_subscription_triggers_retrieve(self):
+        trigger = self.lists[0].subscription_triggers.first()
+        self.measure(
+            "subscription_triggers.retrieve",
+            self.get(
+                "/api/lists/{}/subscription-triggers/{}".format(
+                    self.lists[0].pk, trigger.pk
+                )
+            ),
+        )
+
+    def test_subscription_triggers_create(self):
+        offset = fixtures.TRIGGERS_PER_LIST + 1
+        self.measure(
+            "subscription_triggers.create",
+            self.post(
+                lambda i: "/api/lists/{}/subscription-triggers".format(
+                    self.lists[0].pk
+                ),
+                lambda i: {
+                    "related_list_slug": self.lists[offset + i].slug,
+                    "override_previous_unsubscribes": False,
+                },
+            ),
+        )
+
+    # products
+
+    def test_products_list(self):
+        self.measure("products.list", self.get("/api/products"))
+
+    def test_products_retrieve(self):
+        self.measure(
+            "products.retrieve",
+            self.get("/api/products/{}".format(self.products[0].pk)),
+        )
+
+    def test_products_create(self):
+        self.measure(
+            "products.create",
+            self.post(
+                lambda i: "/api/products",
+                lambda i: {
+                    "name": "Created product {}".format(i),
+                    "slug": "createdproduct{}".format(i),
+                    "brand": "Govexec",
+                    "type": "event",
+                    "subtypes": [{"name": "Benchmark subtype 0"}],
+                    "topics": [{"name": "Benchmark topic 0"}],
+                },
+            ),
+        )
+
+    def test_product_subtypes_list(self):
+        self.measure("product_subtypes.list", self.get("/api/product-subtypes"))
+
+    def test_product_subtypes_retrieve(self):
+        subtype = self.products[0].subtypes.first()
+        self.measure(
+            "product_subtypes.retrieve",
+            self.get("/api/product-subtypes/{}".format(subtype.pk)),
+        )
+
+    def test_product_subtypes_create(self):
+        self.measure(
+            "product_subtypes.create",
+            self.post(
+                lambda i: "/api/product-subtypes",
+                lambda i: {"name": "Created subtype {}".format(i)},
+            ),
+        )
+
+    def test_product_topics_list(self):
+        self.measure("product_topics.list", self.get("/api/product-topics"))
+
+    def test_product_topics_retrieve(self):
+        topic = self.products[0].topics.first()
+        self.measure(
+            "product_topics.retrieve",
+            self.get("/api/product-topics/{}".format(topic.pk)),
+        )
+
+    def test_product_topics_create(self):
+        self.measure(
+            "product_topics.create",
+            self.post(
+                lambda i: "/api/product-topics",
+                lambda i: {"name": "Created topic {}".format(i)},
+            ),
+        )
+
+    # vars
+
+    def test_vars_list(self):
+        self.measure("vars.list", self.get("/api/vars"))
+
+    def test_vars_retrieve(self):
+        self.measure(
+            "vars.retrieve",
+            self.get("/api/vars/{}".format(self.var_key.pk)),
+        )
+
+    def test_vars_create(self):
+        self.measure(
+            "vars.create",
+            self.post(
+                lambda i: "/api/vars",
+                lambda i: {"key": "created_var_{}".format(i), "type": "other"},
+            ),
+        )
+
+    # athena content
+
+    def test_athena_content_metadata_list(self):
+        self.measure(
+            "athena_content_metadata.list", self.get("/api/athena-content-metadata")
+        )
+
+    def test_athena_content_metadata_retrieve(self):
+        self.measure(
+            "athena_content_metadata.retrieve",
+            self.get("/api/athena-content-metadata/{}".format(self.metadata[0].pk)),
+        )
+
+    def test_athena_content_metadata_search(self):
+        self.measure(
+            "athena_content_metadata.search",
+            self.get(
+                "/api/athena-content-metadata/search"
+                "?topics__overlap=topic-0,topic-1&category=category-0"
+                "&published_after=2000-01-01"
+            ),
+        )
+
+    def test_athena_content_metadata_create(self):
+        self.measure(
+            "athena_content_metadata.create",
+            self.post(
+                lambda i: "/api/athena-content-metadata",
+                lambda i: {
+                    "athena_content_id": 100000 + i,
+                    "athena_content_type": self.content_type.pk,
+                    "date_created": "2020-01-01T00:00:00Z",
+                    "title": "Created content {}".format(i),
+                    "slug": "created-content-{}".format(i),
+                    "absolute_url": "https://www.example.com/created/{}/".format(i),
+                    "site_name": "govexec",
+                    "organization": "govexec",
+                    "authors": ["Author 0"],
+                    "categories": {"primary": "category-0"},
+                    "topics": ["topic-0"],
+                    "keywords": ["keyword-0"],
+                    "interests": ["interest-0"],
+                },
+            ),
+        )
+
+    def test_athena_content_metadata_bulk(self):
+        def request(iteration):
+            # half of each batch updates the previous iteration's content
+            body = "\n".join(
+                json.dumps(
+                    {
+                        "athena_content_id": 200000 + iteration * 50 + n,
+                        "athena_content_type": "post_manager.post",
+                        "date_created": "2020-01-01T00:00:00Z",
+                        "title": "Bulk content {}".format(n),
+                        "slug": "bulk-content-{}".format(n),
+                        "absolute_url": "https://www.example.com/bulk/{}/".format(n),
+                        "site_name": "govexec",
+                        "organization": "govexec",
+                        "authors": ["Author 0"],
+                        "categories": {"primary": "category-0"},
+                        "topics": ["topic-0"],
+                    }
+                )
+                for n in range(100)
+            )
+            response = self.client.post(
+                "/api/athena-content-metadata/bulk",
+                body,
+                content_type="application/x-ndjson",
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json()["errors"], [])
+
+        self.measure("athena_content_metadata.bulk_100", request)
+
+    def test_user_content_history_list(self):
+        self.measure("user_content_history.list", self.get("/api/user-content-history"))
+
+    def test_user_content_history_list_by_email(self):
+        self.measure(
+            "user_content_history.list_by_email",
+            self.get("/api/user-content-history?email={}".format(self.user.email)),
+        )
+
+    def test_user_content_history_retrieve(self):
+        history = self.metadata[0].user_content_history.first()
+        self.measure(
+            "user_content_history.retrieve",
+            self.get("/api/user-content-history/{}".format(history.pk)),
+        )
+
+    def test_user_content_history_create(self):
+        self.measure(
+            "user_content_history.create",
+            self.post(
+                lambda i: "/api/user-content-history",
+                lambda i: {
+                    "email": self.user.email,
+                    "athena_content_metadata": self.metadata[i].athena_content_id,
+                    "referrer": "https://www.example.com/",
+                },
+            ),
+        )
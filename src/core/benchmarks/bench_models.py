@@ -0,0 +1,165 @@
+from unittest import mock
+
+from django.db import connection
+from django.utils import timezone
+from model_mommy import mommy
+from sailthru_sync.tasks import sync_user_basic
+
+from .. import models as m
+from . import fixtures
+from .harness import ITERATIONS, BenchmarkTestCase
+
+
+TRIGGER_FAN_OUT = (0, 5, 20)
+SUBSCRIPTION_FAN_OUT = (0, 10, 50)
+VAR_FAN_OUT = (1, 10, 50)
+
+
+def counting_enqueued_syncs(operation):
+    """
+    Wraps `operation(iteration)` so the on-commit sync enqueues it schedules
+    are run (against a mocked task) and counted. Test transactions never
+    commit, so the callbacks are taken off the connection and run directly.
+    """
+
+    def benchmark(iteration):
+        pending = len(connection.run_on_commit)
+        with mock.patch.object(sync_user_basic, "apply_async") as apply_async:
+            operation(iteration)
+            callbacks = connection.run_on_commit[pending:]
+            del connection.run_on_commit[pending:]
+            for _, callback in callbacks:
+                callback()
+        return {
+            "enqueued_tasks": apply_async.call_count,
+            "enqueued_users": len(
+                {args[0][0] for args, kwargs in apply_async.call_args_list}
+            ),
+        }
+
+    return benchmark
+
+
+class ModelWriteBenchmarks(BenchmarkTestCase):
+    """
+    Signal cascades behind the core model operations at increasing fan-out.
+
+    Every write benchmark gets its own user per iteration so each call does
+    the same amount of work.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.related_lists = fixtures.seed_lists(
+            count=max(TRIGGER_FAN_OUT + SUBSCRIPTION_FAN_OUT) + 1,
+            triggers_per_list=0,
+        )
+
+        cls.triggering_lists = {}
+        for triggers in TRIGGER_FAN_OUT:
+            list_ = mommy.make(
+                "core.List",
+                name="Triggering list {}".format(triggers),
+                slug="triggering_list_{}".format(triggers),
+                type="newsletter",
+            )
+            for related_list in cls.related_lists[:triggers]:
+                mommy.make(
+                    "core.SubscriptionTrigger",
+                    primary_list=list_,
+                    related_list=related_list,
+                )
+            cls.triggering_lists[triggers] = list_
+
+        cls.trigger_users = {
+            triggers: fixtures.seed_blank_users(
+                ITERATIONS, prefix="triggers{}-".format(triggers)
+            )
+            for triggers in TRIGGER_FAN_OUT
+        }
+
+        cls.subscribed_users = {}
+        for subscriptions in SUBSCRIPTION_FAN_OUT:
+            users = fixtures.seed_blank_users(
+                ITERATIONS, prefix="subscriptions{}-".format(subscriptions)
+            )
+            for user in users:
+                for list_ in cls.related_lists[:subscriptions]:
+                    mommy.make(
+                        "core.Subscription",
+                        audience_user=user,
+                        list=list_,
+                        log_override={"action": "update"},
+                    )
+            cls.subscribed_users[subscriptions] = users
+
+        cls.vars_user = fixtures.seed_blank_users(1, prefix="vars")[0]
+
+    def benchmark_list_subscribe(self, users, list_):
+        def operation(iteration):
+            users[iteration].list_subscribe(list_.slug)
+
+        return counting_enqueued_syncs(operation)
+
+    def test_list_subscribe_by_triggers(self):
+        for triggers in TRIGGER_FAN_OUT:
+            self.measure(
+                "list_subscribe.triggers_{}".format(triggers),
+                self.benchmark_list_subscribe(
+                    self.trigger_users[triggers], self.triggering_lists[triggers]
+                ),
+            )
+
+    def test_list_subscribe_by_subscriptions(self):
+        list_ = self.related_lists[-1]
+        for subscriptions in SUBSCRIPTION_FAN_OUT:
+            self.measure(
+                "list_subscribe.subscriptions_{}".format(subscriptions),
+                self.benchmark_list_subscribe(
+                    self.subscribed_users[subscriptions], list_
+                ),
+            )
+
+    def test_list_unsubscribe_by_subscriptions(self):
+        list_ = self.related_lists[0]
+        for subscriptions in SUBSCRIPTION_FAN_OUT[1:]:
+            users = self.subscribed_users[subscriptions]
+
+            def operation(iteration, users=users):
+                users[iteration].list_unsubscribe(list_.slug)
+
+            self.measure(
+                "list_unsubscribe.subscriptions_{}".format(subscriptions),
+                counting_enqueued_syncs(operation),
+            )
+
+    def test_record_optout_by_subscriptions(self):
+        for subscriptions in SUBSCRIPTION_FAN_OUT:
+            users = self.subscribed_users[subscriptions]
+
+            def operation(iteration, users=users):
+                users[iteration].record_optout(
+                    m.AudienceUser.OPTOUT_BASIC,
+                    "benchmark optout",
+                    effective_date=timezone.now(),
+                )
+
+            self.measure(
+                "record_optout.subscriptions_{}".format(subscriptions),
+                counting_enqueued_syncs(operation),
+            )
+
+    def test_user_save_by_vars(self):
+        for var_count in VAR_FAN_OUT:
+
+            def operation(iteration, var_count=var_count):
+                self.vars_user.vars = {
+                    "benchmark_var_{}".format(n): str(iteration)
+                    for n in range(var_count)
+                }
+                self.vars_user.save()
+
+            self.measure(
+                "user_save.vars_{}".format(var_count),
+                counting_enqueued_syncs(operation),
+            )
@@ -0,0 +1,169 @@
+"""
+Data seeding for the benchmark suites.
+
+Volumes are deliberately fixed: baselines are only comparable when every run
+seeds exactly the same rows.
+"""
+from datetime import timedelta
+
+from django.utils import timezone
+from model_mommy import mommy
+
+from .. import models as m
+
+
+USERS = 30
+LISTS = 30
+SUBSCRIPTIONS_PER_USER = 15
+PRODUCTS = 10
+PRODUCT_ACTIONS_PER_USER = 8
+DETAILS_PER_PRODUCT_ACTION = 3
+VARS_HISTORY_PER_USER = 6
+SOURCES_PER_USER = 3
+TRIGGERS_PER_LIST = 2
+CONTENT_METADATA = 50
+CONTENT_HISTORY_PER_USER = 10
+
+
+def seed_lists(count=LISTS, triggers_per_list=TRIGGERS_PER_LIST):
+    lists = [
+        mommy.make(
+            "core.List",
+            name="Benchmark list {}".format(n),
+            slug="benchmark_list_{}".format(n),
+            type="newsletter" if n % 2 else "list",
+        )
+        for n in range(count)
+    ]
+    for n, list_ in enumerate(lists):
+        for offset in range(1, triggers_per_list + 1):
+            mommy.make(
+                "core.SubscriptionTrigger",
+                primary_list=list_,
+                related_list=lists[(n + offset) % count],
+            )
+    return lists
+
+
+def seed_products(count=PRODUCTS):
+    subtypes = [
+        mommy.make("core.ProductSubtype", name="Benchmark subtype {}".format(n))
+        for n in range(3)
+    ]
+    topics = [
+        mommy.make("core.ProductTopic", name="Benchmark topic {}".format(n))
+        for n in range(3)
+    ]
+    products = []
+    for n in range(count):
+        product = mommy.make(
+            "core.Product",
+            name="Benchmark product {}".format(n),
+            slug="benchmarkproduct{}".format(n),
+            brand=m.Product.PRODUCT_BRAND_CHOICES[0][0],
+            type=m.Product.product_types()[n % len(m.Product.product_types())],
+        )
+        product.subtypes.add(subtypes[n % len(subtypes)])
+        product.topics.add(*topics[: (n % len(topics)) + 1])
+        products.append(product)
+    return products
+
+
+def seed_user(n, lists, products):
+    user = mommy.make(
+        "core.AudienceUser",
+        email="benchmark{}@example.com".format(n),
+        vars={"benchmark_var_0": "0"},
+    )
+    for version in range(1, VARS_HISTORY_PER_USER):
+        user.vars = {
+            "benchmark_var_{}".format(key): str(version) for key in range(version + 1)
+        }
+        user.save()
+
+    for source in range(SOURCES_PER_USER):
+        mommy.make(
+            "core.UserSource",
+            audience_user=user,
+            name="benchmark_source_{}".format(source),
+        )
+
+    for offset in range(SUBSCRIPTIONS_PER_USER):
+        list_ = lists[(n + offset) % len(lists)]
+        mommy.make(
+            "core.Subscription",
+            audience_user=user,
+            list=list_,
+            active=bool(offset % 3),
+            # "update" keeps the subscription triggers from firing while seeding
+            log_override={"action": "update"},
+        )
+
+    now = timezone.now()
+    for offset in range(PRODUCT_ACTIONS_PER_USER):
+        product = products[(n + offset) % len(products)]
+        action = mommy.make(
+            "core.ProductAction",
+            audience_user=user,
+            product=product,
+            type="registered" if offset % 2 else "consumed",
+            timestamp=now - timedelta(days=offset),
+        )
+        for detail in range(DETAILS_PER_PRODUCT_ACTION):
+            mommy.make(
+                "core.ProductActionDetail",
+                product_action=action,
+                description="Benchmark detail {}".format(detail),
+                timestamp=action.timestamp,
+            )
+    return user
+
+
+def seed_audience(users=USERS):
+    """Seeds lists, products and `users` fully populated audience users."""
+    lists = seed_lists()
+    products = seed_products()
+    audience = [seed_user(n, lists, products) for n in range(users)]
+    return audience, lists, products
+
+
+def seed_content(users):
+    content_type = mommy.make("core.AthenaContentType", name="post_manager.post")
+    now = timezone.now()
+    metadata = [
+        mommy.make(
+            "core.AthenaContentMetadata",
+            athena_content_id=n + 1,
+            athena_content_type=content_type,
+            date_created=now - timedelta(days=n),
+            date_published=now - timedelta(days=n),
+            title="Benchmark content {}".format(n),
+            slug="benchmark-content-{}".format(n),
+            absolute_url="https://www.example.com/content/{}/".format(n),
+            site_name="govexec",
+            organization="govexec",
+            authors=["Author {}".format(n % 5)],
+            categories={"primary": "category-{}".format(n % 4)},
+            topics=["topic-{}".format(n % 6)],
+            keywords=["keyword-{}".format(n % 7)],
+            interests=["interest-{}".format(n % 8)],
+        )
+        for n in range(CONTENT_METADATA)
+    ]
+    for n, user in enumerate(users):
+        for offset in range(CONTENT_HISTORY_PER_USER):
+            mommy.make(
+                "core.UserContentHistory",
+                email=user.email,
+                athena_content_metadata=metadata[(n + offset) % len(metadata)],
+                referrer="https://www.example.com/",
+            )
+    return content_type, metadata
+
+
+def seed_blank_users(count, prefix="blank"):
+    """Users without any related rows, for benchmarks that write to a new user."""
+    return [
+        mommy.make("core.AudienceUser", email="{}{}@example.com".format(prefix, n))
+        for n in range(count)
+    ]
@@ -0,0 +1,257 @@
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+
+from django import test
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+RECORD = os.environ.get("AUDB_BENCHMARK_RECORD", "") == "1"
+REPEAT = int(os.environ.get("AUDB_BENCHMARK_REPEAT", 5))
+# Every measurement calls the benchmarked function this many times.
+ITERATIONS = REPEAT + 3
+# Wall time and memory are noisy, so they are allowed to exceed the baseline by
+# a fraction of it plus a small absolute slack (which matters for the cheapest
+# requests); query counts have to match the baseline or improve on it.
+TIME_TOLERANCE = float(os.environ.get("AUDB_BENCHMARK_TIME_TOLERANCE", 1.0))
+TIME_SLACK_SECONDS = 0.005
+MEMORY_TOLERANCE = float(os.environ.get("AUDB_BENCHMARK_MEMORY_TOLERANCE", 0.5))
+MEMORY_SLACK_KIB = 64
+REPORT_DIR = os.environ.get("AUDB_BENCHMARK_REPORT_DIR", "")
+REVISION = os.environ.get("AUDB_BENCHMARK_REVISION", "")
+
+
+class Measurement(object):
+    def __init__(self, name, queries, seconds, peak_kib, extra=None):
+        self.name = name
+        self.queries = queries
+        self.seconds = seconds
+        self.peak_kib = peak_kib
+        self.extra = extra or {}
+        self.problems = []
+
+    def as_dict(self):
+        data = OrderedDict(
+            (
+                ("queries", self.queries),
+                ("seconds", round(self.seconds, 6)),
+                ("peak_kib", round(self.peak_kib, 1)),
+            )
+        )
+        data.update(sorted(self.extra.items()))
+        return data
+
+
+class BenchmarkTestCase(test.TestCase):
+    """
+    Base class for the benchmark suites in this package.
+
+    Each call to `measure()` runs a callable several times and records its
+    query count, median wall time and peak allocated memory, then compares
+    them with the suite's stored baseline. Run with AUDB_BENCHMARK_RECORD=1 to
+    write the current numbers as the new baseline instead.
+    """
+
+    baseline_name = None
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.measurements = OrderedDict()
+
+    @classmethod
+    def tearDownClass(cls):
+        try:
+            if cls.measurements:
+                cls.print_report()
+                if RECORD:
+                    cls.record_baseline()
+                if REPORT_DIR:
+                    cls.write_report()
+        finally:
+            super().tearDownClass()
+
+    @classmethod
+    def get_baseline_name(cls):
+        return cls.baseline_name or cls.__module__.rsplit(".", 1)[-1]
+
+    @classmethod
+    def baseline_path(cls):
+        return os.path.join(BASELINE_DIR, "{}.json".format(cls.get_baseline_name()))
+
+    @classmethod
+    def load_baseline(cls):
+        try:
+            with open(cls.baseline_path()) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    @classmethod
+    def record_baseline(cls):
+        baseline = cls.load_baseline()
+        for name, measurement in cls.measurements.items():
+            baseline[name] = measurement.as_dict()
+        with open(cls.baseline_path(), "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    @classmethod
+    def report_data(cls):
+        return OrderedDict(
+            (
+                ("suite", cls.get_baseline_name()),
+                ("timestamp", int(time.time())),
+                ("revision", REVISION),
+                (
+                    "results",
+                    OrderedDict(
+                        (name, measurement.as_dict())
+                        for name, measurement in cls.measurements.items()
+                    ),
+                ),
+            )
+        )
+
+    @classmethod
+    def write_report(cls):
+        os.makedirs(REPORT_DIR, exist_ok=True)
+        path = os.path.join(REPORT_DIR, "{}.json".format(cls.get_baseline_name()))
+        report = cls.report_data()
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        # One line per suite run, so the cost of each benchmark can be
+        # followed across revisions.
+        with open(os.path.join(REPORT_DIR, "history.ndjson"), "a") as f:
+            f.write(json.dumps(report) + "\n")
+
+    @classmethod
+    def print_report(cls):
+        baseline = cls.load_baseline()
+        width = max(len(name) for name in cls.measurements)
+        lines = [
+            "",
+            "{} ({})".format(cls.get_baseline_name(), cls.__name__),
+            "{:<{width}}  {:>7}  {:>10}  {:>10}  {}".format(
+                "benchmark", "queries", "ms", "peak KiB", "baseline", width=width
+            ),
+        ]
+        for name, measurement in cls.measurements.items():
+            expected = baseline.get(name)
+            if expected:
+                reference = "{}q / {:.1f}ms".format(
+                    expected["queries"], expected["seconds"] * 1000
+                )
+            else:
+                reference = "-"
+            counts = "".join(
+                "  {}={}".format(key, value)
+                for key, value in sorted(measurement.extra.items())
+            )
+            lines.append(
+                "{:<{width}}  {:>7}  {:>10.2f}  {:>10.1f}  {}{}{}".format(
+                    name,
+                    measurement.queries,
+                    measurement.seconds * 1000,
+                    measurement.peak_kib,
+                    reference,
+                    counts,
+                    "  !! " + "; ".join(measurement.problems)
+                    if measurement.problems
+                    else "",
+                    width=width,
+                )
+            )
+        sys.stderr.write("\n".join(lines) + "\n")
+
+    def measure(self, name, func, repeat=None, extra=None):
+        """
+        Runs `func(iteration)` once to warm caches, once to count queries,
+        `repeat` times for wall time and once more under tracemalloc.
+        `iteration` increases on every call so write benchmarks can build
+        unique payloads. If `func` returns a dict of counts, the counts from
+        the query run are recorded and checked alongside the queries.
+        """
+        repeat = repeat or REPEAT
+        iteration = 0
+
+        func(iteration)
+        iteration += 1
+
+        # The query log is a bounded deque; once seeding has filled it up its
+        # length stops changing, so empty it before counting.
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as queries:
+            counts = func(iteration)
+        # Captured queries are read lazily from the shared log, which later
+        # requests reset, so take the count straight away.
+        query_count = len(queries)
+        iteration += 1
+
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func(iteration)
+            timings.append(time.perf_counter() - start)
+            iteration += 1
+
+        tracemalloc.start()
+        try:
+            func(iteration)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        extra = dict(extra or {})
+        extra.update(counts or {})
+        measurement = Measurement(
+            name,
+            queries=query_count,
+            seconds=statistics.median(timings),
+            peak_kib=peak / 1024,
+            extra=extra,
+        )
+        self.measurements[name] = measurement
+        self.check(measurement)
+        return measurement
+
+    def check(self, measurement):
+        if RECORD:
+            return
+        expected = self.load_baseline().get(measurement.name)
+        if expected is None:
+            measurement.problems.append("no baseline")
+            self.fail(
+                "No baseline recorded for {}; run the suite with "
+                "AUDB_BENCHMARK_RECORD=1 to record one.".format(measurement.name)
+            )
+
+        if measurement.queries > expected["queries"]:
+            measurement.problems.append("queries")
+        max_seconds = expected["seconds"] * (1 + TIME_TOLERANCE) + TIME_SLACK_SECONDS
+        if measurement.seconds > max_seconds:
+            measurement.problems.append("time")
+        max_peak = expected["peak_kib"] * (1 + MEMORY_TOLERANCE) + MEMORY_SLACK_KIB
+        if measurement.peak_kib > max_peak:
+            measurement.problems.append("memory")
+        for key, value in measurement.extra.items():
+            if key in expected and value > expected[key]:
+                measurement.problems.append(key)
+
+        if measurement.problems:
+            self.fail(
+                "{} exceeded its baseline ({}): measured {}, baseline {}.".format(
+                    measurement.name,
+                    ", ".join(measurement.problems),
+                    dict(measurement.as_dict()),
+                    expected,
+                )
+            )
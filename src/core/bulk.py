@@ -0,0 +1,207 @@
+"""
+Bulk loading from NDJSON, one object per line in the format of the matching
+API endpoint:
+
+- AthenaContentMetadata (with the content type given by name or pk), for the
+  athena-content-metadata/bulk endpoint and the load_athena_content_metadata
+  command;
+- AudienceUsers, as {email, vars, omeda_id, source_signups}, for the
+  audience-users/bulk endpoint and the load_audience_users command.
+"""
+import json
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+
+from . import api_serializers
+from . import models as m
+
+
+BATCH_SIZE = 1000
+
+
+class NDJSONLoader(object):
+    """
+    Validates NDJSON lines with `serializer_class` and writes them
+    `batch_size` at a time through `write()`. Invalid lines are skipped and
+    reported in `errors` as {"line": number, "errors": ...}; the rest of
+    their batch is still written.
+    """
+
+    serializer_class = None
+
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self.created = 0
+        self.updated = 0
+        self.errors = []
+        # one serializer validates every line, so its fields are only built
+        # once (as a ListSerializer does with its child)
+        self.serializer = self.serializer_class()
+
+    @property
+    def result(self):
+        return {"created": self.created, "updated": self.updated, "errors": self.errors}
+
+    def load(self, lines):
+        """Loads an iterable of lines (str or bytes); returns the loader."""
+        batch = []
+        for number, line in enumerate(lines, start=1):
+            if isinstance(line, bytes):
+                try:
+                    line = line.decode("utf-8")
+                except UnicodeDecodeError as e:
+                    self.add_error(number, ["Invalid UTF-8: {}".format(e)])
+                    continue
+            if not line.strip():
+                continue
+            batch.append((number, line))
+            if len(batch) >= self.batch_size:
+                self.load_batch(batch)
+                batch = []
+        if batch:
+            self.load_batch(batch)
+        return self
+
+    def load_batch(self, lines):
+        """Loads a list of (line number, line) pairs."""
+        rows = []
+        for number, line in lines:
+            try:
+                data = json.loads(line)
+            except ValueError as e:
+                self.add_error(number, ["Invalid JSON: {}".format(e)])
+                continue
+            if not isinstance(data, dict):
+                self.add_error(number, ["Expected an object."])
+                continue
+            try:
+                rows.append((number, dict(self.serializer.run_validation(data))))
+            except ValidationError as e:
+                self.add_error(number, e.detail)
+        self.write(rows)
+
+    def add_error(self, number, errors):
+        self.errors.append({"line": number, "errors": errors})
+
+    def write(self, rows):
+        """Writes a batch of (line number, validated data) pairs."""
+        raise NotImplementedError
+
+
+class ContentMetadataLoader(NDJSONLoader):
+    """
+    Upserts athena content metadata, each batch with one query for its
+    unknown content types and one INSERT ... ON CONFLICT.
+    """
+
+    serializer_class = api_serializers.AthenaContentMetadataBulkSerializer
+
+    def __init__(self, batch_size=BATCH_SIZE):
+        super().__init__(batch_size)
+        # content type names and pks (as strings) to pks
+        self.content_types = {}
+
+    def write(self, rows):
+        self.resolve_content_types({row["athena_content_type"] for _, row in rows})
+
+        # the last line for an id wins, as if they had been posted in order
+        records = {}
+        for number, row in rows:
+            content_type = row.pop("athena_content_type")
+            if content_type not in self.content_types:
+                self.add_error(
+                    number,
+                    {
+                        "athena_content_type": [
+                            "Unknown content type {!r}.".format(content_type)
+                        ]
+                    },
+                )
+                continue
+            row["athena_content_type_id"] = self.content_types[content_type]
+            records[row["athena_content_id"]] = row
+
+        created, updated = m.AthenaContentMetadata.objects.upsert(
+            list(records.values())
+        )
+        self.created += created
+        self.updated += updated
+
+    def resolve_content_types(self, keys):
+        keys = set(keys) - set(self.content_types)
+        if not keys:
+            return
+        pks = [int(key) for key in keys if key.isdigit()]
+        for pk, name in m.AthenaContentType.objects.filter(
+            Q(name__in=keys) | Q(pk__in=pks)
+        ).values_list("pk", "name"):
+            self.content_types[name] = pk
+            self.content_types[str(pk)] = pk
+
+
+class AudienceUserLoader(NDJSONLoader):
+    """
+    Creates or updates audience users by email, each batch in one
+    transaction through AudienceUser.objects.upsert(), and queues one
+    Sailthru sync task per batch for the users it created or changed.
+    Users whose line changed nothing are counted in `unchanged`.
+    """
+
+    serializer_class = api_serializers.AudienceUserBulkSerializer
+
+    def __init__(self, batch_size=BATCH_SIZE):
+        super().__init__(batch_size)
+        self.unchanged = 0
+
+    @property
+    def result(self):
+        result = super().result
+        result["unchanged"] = self.unchanged
+        return result
+
+    def write(self, rows):
+        # several lines for an email are applied in order, as separate PUTs
+        # would be
+        records = {}
+        for _, row in rows:
+            record = records.get(row["email"])
+            if record is None:
+                records[row["email"]] = row
+                continue
+            record["vars"] = dict(record.get("vars") or {}, **row.get("vars", {}))
+            if row.get("omeda_id") is not None:
+                record["omeda_id"] = row["omeda_id"]
+            record["source_signups"] = record.get("source_signups", []) + row.get(
+                "source_signups", []
+            )
+
+        records_by_email = records
+        records = list(records.values())
+        with transaction.atomic():
+            results = m.AudienceUser.objects.upsert(records)
+            to_sync = []
+            for email, pk, created, changed in results:
+                record = records_by_email[email]
+                if created:
+                    self.created += 1
+                elif changed:
+                    self.updated += 1
+                else:
+                    self.unchanged += 1
+                if changed or record.get("source_signups"):
+                    to_sync.append(pk)
+            if to_sync and sync_signals_enabled():
+                transaction.on_commit(lambda: queue_sync(to_sync))
+
+
+def sync_signals_enabled():
+    return settings.SAILTHRU_SYNC_ENABLED and settings.SAILTHRU_SYNC_SIGNALS_ENABLED
+
+
+def queue_sync(user_pks):
+    from sailthru_sync.tasks import sync_users_basic
+
+    sync_users_basic.apply_async([user_pks])
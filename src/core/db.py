@@ -0,0 +1,242 @@
+"""
+Query helpers that go beyond what the ORM can express.
+"""
+import uuid
+from collections import OrderedDict, defaultdict
+
+from django.db import connections, models, transaction
+
+
+def _column(model, field_name):
+    return model._meta.get_field(field_name).column
+
+
+def latest_per_parent(queryset, parent_path, parent_ids, limit, ordering):
+    """
+    Filters `queryset` down to the first `limit` rows, by `ordering`, of each
+    parent in `parent_ids`.
+
+    `parent_path` is the lookup from the queryset's model to the parent, _eg_
+    "audience_user" or "subscription__audience_user"; `ordering` is a sequence
+    of field names on the queryset's model with an optional "-" prefix. The
+    rows are picked with one LATERAL subquery over the parents, so each
+    parent only reads its first `limit` rows (given an index to read them
+    in order) however many it has.
+    """
+    model = queryset.model
+    hops = parent_path.split("__")
+
+    # walk the foreign keys up to the one that points at the parent
+    joins = []
+    alias, current = "latest_0", model
+    for depth, hop in enumerate(hops[:-1], start=1):
+        field = current._meta.get_field(hop)
+        related = field.related_model
+        related_alias = "latest_{}".format(depth)
+        joins.append(
+            'INNER JOIN "{table}" {related_alias} '
+            'ON {related_alias}."{pk}" = {alias}."{column}"'.format(
+                table=related._meta.db_table,
+                related_alias=related_alias,
+                pk=related._meta.pk.column,
+                alias=alias,
+                column=field.column,
+            )
+        )
+        alias, current = related_alias, related
+    parent_column = '{}."{}"'.format(alias, _column(current, hops[-1]))
+
+    order_by = ", ".join(
+        'latest_0."{}" {}'.format(
+            _column(model, name.lstrip("-")), "DESC" if name.startswith("-") else "ASC"
+        )
+        for name in ordering
+    )
+
+    table = model._meta.db_table
+    pk = model._meta.pk.column
+    where = (
+        '"{table}"."{pk}" IN ('
+        "SELECT latest.{pk} FROM unnest(%s::integer[]) AS parent(id) "
+        "CROSS JOIN LATERAL ("
+        'SELECT latest_0."{pk}" FROM "{table}" latest_0 {joins} '
+        "WHERE {parent_column} = parent.id ORDER BY {order_by} LIMIT %s"
+        ") AS latest)"
+    ).format(
+        table=table,
+        pk=pk,
+        joins=" ".join(joins),
+        parent_column=parent_column,
+        order_by=order_by,
+    )
+    return queryset.extra(where=[where], params=[list(parent_ids), limit])
+
+
+def prefetch_latest(instances, parent_path, queryset, limit, ordering, to_attr):
+    """
+    Sets `to_attr` on each of `instances` to a list of its first `limit`
+    related rows from `queryset`, loaded for all of them in one query.
+
+    The rows keep `queryset`'s own ordering. For multi-hop `parent_path`s the
+    intermediate relations should be in `queryset`'s select_related().
+    """
+    if not instances:
+        return
+    *hops, parent_field = parent_path.split("__")
+    grouped = defaultdict(list)
+    rows = latest_per_parent(
+        queryset, parent_path, {instance.pk for instance in instances}, limit, ordering
+    )
+    for row in rows:
+        target = row
+        for hop in hops:
+            target = getattr(target, hop)
+        grouped[getattr(target, parent_field + "_id")].append(row)
+    for instance in instances:
+        setattr(instance, to_attr, grouped[instance.pk])
+
+
+def keyset_page(queryset, key, page_size, after=None, before=None):
+    """
+    One page of `queryset` in descending `key` order, found by seeking to a
+    position instead of skipping rows with OFFSET, so deep pages cost the same
+    as the first one. `key` is a pair of field names, the last one unique
+    (_eg_ ("timestamp", "id")), and should be covered by an index.
+
+    `after` is the key of the last row of the current page, to get the next
+    (older) page; `before` is the key of its first row, to get the previous
+    (newer) page. Returns the rows, newest first, and whether there are more
+    rows beyond them in the direction of travel.
+    """
+    model = queryset.model
+    columns = "({})".format(
+        ", ".join(
+            '"{}"."{}"'.format(model._meta.db_table, _column(model, name))
+            for name in key
+        )
+    )
+    placeholders = "({})".format(", ".join(["%s"] * len(key)))
+
+    if before is not None:
+        queryset = queryset.extra(
+            where=["{} > {}".format(columns, placeholders)], params=list(before)
+        ).order_by(*key)
+    else:
+        if after is not None:
+            queryset = queryset.extra(
+                where=["{} < {}".format(columns, placeholders)], params=list(after)
+            )
+        queryset = queryset.order_by(*("-" + name for name in key))
+
+    rows = list(queryset[: page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if before is not None:
+        rows.reverse()
+    return rows, has_more
+
+
+def stream_rows(queryset, chunk_size=2000):
+    """
+    Yields the rows of a values_list() `queryset` as tuples, read through a
+    server-side cursor `chunk_size` rows at a time, so a result of any size is
+    exported in constant memory. (Django 1.9's iterator() still fetches the
+    whole result into the client.)
+
+    The rows come straight from the database driver: no model instances and
+    no field conversions beyond psycopg2's own.
+    """
+    connection = connections[queryset.db]
+    sql, params = queryset.query.get_compiler(using=queryset.db).as_sql()
+    # named cursors only live as long as the transaction they are declared in
+    with transaction.atomic(using=queryset.db):
+        connection.ensure_connection()
+        cursor = connection.connection.cursor(name="stream_{}".format(uuid.uuid4().hex))
+        cursor.itersize = chunk_size
+        try:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            cursor.close()
+
+
+def _cascade(model, where, params, seen=()):
+    """
+    The (model, where, params) steps that delete the rows of `model` matching
+    `where` and every row they cascade to, children first.
+    """
+    if model in seen:
+        raise ValueError("Cannot cascade through a cycle at {}.".format(model))
+    steps = []
+    for relation in model._meta.get_fields(include_hidden=True):
+        if not (
+            (relation.one_to_many or relation.one_to_one)
+            and relation.auto_created
+            and not relation.concrete
+        ):
+            continue
+        if relation.on_delete is models.DO_NOTHING:
+            continue
+        if relation.on_delete is not models.CASCADE:
+            raise ValueError(
+                "{}.{} does not cascade.".format(
+                    relation.related_model.__name__, relation.field.name
+                )
+            )
+        field = relation.field
+        child = field.model
+        child_where = '"{child}"."{column}" IN (SELECT "{table}"."{target}" FROM "{table}" WHERE {where})'.format(
+            child=child._meta.db_table,
+            column=field.column,
+            table=model._meta.db_table,
+            target=field.target_field.column,
+            where=where,
+        )
+        steps += _cascade(child, child_where, params, seen + (model,))
+    steps.append((model, where, params))
+    return steps
+
+
+def cascade_delete(model, pks, count_only=False, using="default"):
+    """
+    Deletes the rows of `model` with `pks` and everything that cascades from
+    them, with one DELETE per table however many rows there are, and returns
+    the number of rows of each model ({"app_label.Model": count}). With
+    `count_only` nothing is deleted, the rows are only counted.
+
+    Unlike QuerySet.delete() no model instances are loaded, so no delete
+    signals are sent: callers keep up whatever their receivers would have.
+    """
+    table = model._meta.db_table
+    steps = _cascade(
+        model,
+        '"{}"."{}" = ANY(%s::integer[])'.format(table, model._meta.pk.column),
+        [list(pks)],
+    )
+    counts = OrderedDict()
+    with transaction.atomic(using), connections[using].cursor() as cursor:
+        for step_model, where, params in steps:
+            if count_only:
+                cursor.execute(
+                    'SELECT count(*) FROM "{}" WHERE {}'.format(
+                        step_model._meta.db_table, where
+                    ),
+                    params,
+                )
+                count = cursor.fetchone()[0]
+            else:
+                cursor.execute(
+                    'DELETE FROM "{}" WHERE {}'.format(
+                        step_model._meta.db_table, where
+                    ),
+                    params,
+                )
+                count = cursor.rowcount
+            label = step_model._meta.label
+            counts[label] = counts.get(label, 0) + count
+    return counts
@@ -5,6 +5,7 @@ from functools import wraps
 from audb import celery_app
 from celery.utils.log import get_task_logger
 from django.core.cache import cache
+from sailthru_sync import metrics
 
 
 class throttle(object):
@@ -53,11 +54,13 @@ class throttle(object):
             if not cache.add(queued_task_lock, 1, delay):
                 msg = "Throttle %s: Task %s already queued--nothing to do (lock %s already exists)."
                 logger.debug(msg, task.request.id, task.name, queued_task_lock)
+                metrics.THROTTLED_TASKS.inc(task=task.name, outcome="dropped")
             else:
                 celery_app.send_task(
                     task.name, countdown=delay, args=args, kwargs=kwargs
                 )
                 msg = "Throttle %s: Task %s queued to run after %d seconds (lock %s added)."
                 logger.debug(msg, task.request.id, task.name, delay, queued_task_lock)
+                metrics.THROTTLED_TASKS.inc(task=task.name, outcome="requeued")
 
         return wrapper
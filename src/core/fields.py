@@ -1,3 +1,4 @@
+import hashlib
 import re
 
 from django.core import validators as django_validators
@@ -27,6 +28,17 @@ def normalized_email_validator(value):
         raise ValidationError("Email addresses must be lowercase.")
 
 
+def hash_email(email):
+    """
+    The md5 of `email` as NormalizedEmailField stores it (stripped), which
+    is how partners identify users; None for no email. The one definition
+    of AudienceUser.email_hash, for Python and SQL writes alike.
+    """
+    if not email:
+        return None
+    return hashlib.md5(email.strip().encode("utf-8")).hexdigest()
+
+
 def vars_jsonfield_validator(value):
     if not isinstance(value, type(dict())):
         raise ValidationError("This field must be a dictionary.")
@@ -0,0 +1,17 @@
+"""
+Lookups that Django 1.9 is missing or gets wrong for Postgres.
+"""
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.lookups import Overlap
+
+
+@ArrayField.register_lookup
+class ArrayOverlap(Overlap):
+    """
+    `__overlap` with the values cast to the column's type, as Django already
+    does for `__contains`: Postgres has no `varchar[] && text[]` operator.
+    """
+
+    def as_sql(self, qn, connection):
+        sql, params = super().as_sql(qn, connection)
+        return "%s::%s" % (sql, self.lhs.output_field.db_type(connection)), params
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import AudienceUser
+
+
+class Command(BaseCommand):
+    help = """
+    Sets the email_hash of the users that have an email but no hash yet, in
+    chunks of ``--batch-size`` users (each its own UPDATE, so locks are
+    short-lived). Safe to stop and run again.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Users hashed per UPDATE.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1.")
+
+        pending = AudienceUser.objects.filter(
+            email__isnull=False, email_hash__isnull=True
+        ).order_by("pk")
+        hashed, last_pk = 0, 0
+        while True:
+            ids = list(
+                pending.filter(pk__gt=last_pk).values_list("pk", flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            hashed += AudienceUser.objects.hash_emails(ids)
+            last_pk = ids[-1]
+            if options["verbosity"] > 1:
+                self.stdout.write(
+                    "Hashed {} users (up to id {})".format(hashed, last_pk)
+                )
+        self.stdout.write("Hashed {} users.".format(hashed))
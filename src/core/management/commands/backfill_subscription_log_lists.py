@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Max, Min
+
+from core.models import Subscription, SubscriptionLog
+
+
+class Command(BaseCommand):
+    help = """
+    Copies the list of each subscription log entry that has none yet from
+    its subscription, in id ranges of ``--batch-size`` entries (each its own
+    UPDATE, so locks are short-lived). Safe to stop and run again.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=50000,
+            help="Log entry ids covered per UPDATE.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1.")
+
+        bounds = SubscriptionLog.objects.filter(list__isnull=True).aggregate(
+            low=Min("pk"), high=Max("pk")
+        )
+        copied = 0
+        if bounds["low"] is not None:
+            for start in range(bounds["low"], bounds["high"] + 1, batch_size):
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "UPDATE {log} AS log SET list_id = s.list_id "
+                        "FROM {subscription} AS s "
+                        "WHERE s.id = log.subscription_id AND log.list_id IS NULL "
+                        "AND log.id >= %s AND log.id < %s".format(
+                            log=SubscriptionLog._meta.db_table,
+                            subscription=Subscription._meta.db_table,
+                        ),
+                        [start, start + batch_size],
+                    )
+                    copied += cursor.rowcount
+                if options["verbosity"] > 1:
+                    self.stdout.write(
+                        "Copied {} lists (up to id {})".format(
+                            copied, start + batch_size - 1
+                        )
+                    )
+        self.stdout.write("Copied {} lists.".format(copied))
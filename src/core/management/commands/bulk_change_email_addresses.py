@@ -1,15 +1,29 @@
+import json
+import os
 from argparse import RawTextHelpFormatter
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from django.conf import settings
-from django.core.exceptions import ImproperlyConfigured
+from django.core.exceptions import ImproperlyConfigured, ValidationError
 from django.core.management.base import BaseCommand, CommandError
-from django.db import IntegrityError, transaction
+from django.core.validators import validate_email
+from django.db import transaction
 
+from core.fields import normalized_email_validator
 from core.models import AudienceUser
 from sailthru_sync.models import SyncLock
+from sailthru_sync.ratelimit import RateLimiter
+from sailthru_sync.tasks import sync_users_basic
 from sailthru_sync.utils import sailthru_client
 
 
+# statuses of the pairs in the report
+SAILTHRU_CHANGED = "sailthru_changed"
+CHANGED = "changed"
+FAILED = "failed"
+
+
 class Command(BaseCommand):
     help = """
     Use this command to change users' email addresses __ONLY WHEN__ a user
@@ -20,11 +34,28 @@ class Command(BaseCommand):
     email address pairs like:
 
         old@email.com,new@email.com
+
+    Pairs are changed ``--batch-size`` at a time: the emails are changed at
+    Sailthru by ``--workers`` threads, at most ``--rate`` requests per second
+    between them, then in audb with one UPDATE.
+
+    The outcome of each pair is appended to the ``--report`` file (by
+    default the input file's name plus ".report.jsonl") as one JSON object
+    per line: {"old_email", "new_email", "status", "error"}, with a status of
+    "sailthru_changed", "changed" or "failed". Running the command again
+    with the same report resumes where it stopped: changed pairs are skipped
+    and pairs only changed at Sailthru are only changed in audb.
     """
 
     def add_arguments(self, parser):
         parser.formatter_class = RawTextHelpFormatter
         parser.add_argument("--file", nargs=1, type=str)
+        parser.add_argument("--report", type=str)
+        parser.add_argument("--workers", type=int, default=8)
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--rate", type=float, default=settings.SAILTHRU_API_REQUESTS_PER_SECOND
+        )
 
     def handle(self, *args, **options):
         if not settings.SAILTHRU_SYNC_ENABLED:
@@ -34,104 +65,250 @@ class Command(BaseCommand):
 
         if not options["file"]:
             raise CommandError("--file must be specified")
+        for option in ("workers", "batch_size", "rate"):
+            if options[option] <= 0:
+                raise CommandError(
+                    "--{} must be positive".format(option.replace("_", "-"))
+                )
 
         with open(options["file"][0], "r") as input_file:
-            pairs = [x.strip().split(",") for x in input_file.readlines()]
-            self._sanity_check_pairs(pairs)
-            for old_email, new_email in pairs:
-                self._change_email(old_email, new_email)
+            pairs = [x.strip().split(",") for x in input_file if x.strip()]
+
+        report_path = options["report"] or options["file"][0] + ".report.jsonl"
+        statuses = self._read_report(report_path)
+        pending = [pair for pair in pairs if statuses.get(tuple(pair)) != CHANGED]
+        self.counts = Counter()
+        recovered = self._changed_in_audb(
+            [pair for pair in pending if statuses.get(tuple(pair)) == SAILTHRU_CHANGED]
+        )
+        if recovered:
+            with open(report_path, "a", buffering=1) as self.report:
+                for old_email, new_email in recovered:
+                    self._record(old_email, new_email, CHANGED)
+            pending = [pair for pair in pending if tuple(pair) not in recovered]
+        self.stdout.write(
+            "{} pairs, {} already changed.".format(
+                len(pairs), len(pairs) - len(pending)
+            )
+        )
+        if not pending:
+            return
+        self.users = self._sanity_check_pairs(pending)
+        self.sailthru_changed = {
+            tuple(pair)
+            for pair in pending
+            if statuses.get(tuple(pair)) == SAILTHRU_CHANGED
+        }
+
+        self.limiter = RateLimiter(options["rate"])
+        batch_size = options["batch_size"]
+        with open(report_path, "a", buffering=1) as self.report, ThreadPoolExecutor(
+            max_workers=options["workers"]
+        ) as self.executor:
+            for start in range(0, len(pending), batch_size):
+                self._change_batch(pending[start : start + batch_size])
+                self.stdout.write(
+                    "{} of {} pairs done: {} changed, {} failed.".format(
+                        min(start + batch_size, len(pending)),
+                        len(pending),
+                        self.counts[CHANGED],
+                        self.counts[FAILED],
+                    )
+                )
+
+    @staticmethod
+    def _read_report(path):
+        """The last status of each (old, new) pair in the report at `path`."""
+        statuses = {}
+        if not os.path.exists(path):
+            return statuses
+        with open(path, "r") as report:
+            for line in report:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line of a run that was killed mid-write
+                    continue
+                statuses[(entry["old_email"], entry["new_email"])] = entry["status"]
+        return statuses
+
+    @staticmethod
+    def _changed_in_audb(pairs):
+        """
+        The (old, new) `pairs` reported as changed at Sailthru that audb has
+        changed too, the run having stopped after committing the change but
+        before reporting it: the old email is gone and the new one is taken.
+        Their users are synced again, in case the sync queued on that commit
+        was lost with the run.
+        """
+        if not pairs:
+            return set()
+        users = AudienceUser.objects.find_by_email(
+            [email for pair in pairs for email in pair]
+        )
+        changed = {
+            (old_email, new_email)
+            for old_email, new_email in pairs
+            if old_email not in users and new_email in users
+        }
+        if changed and settings.SAILTHRU_SYNC_SIGNALS_ENABLED:
+            sync_users_basic.apply_async(
+                [[users[new_email][0] for _, new_email in changed]]
+            )
+        return changed
 
     @staticmethod
-    def _sanity_check_pairs(pairs):
+    def _listing(emails, limit=10):
+        emails = sorted(emails)
+        listing = ", ".join(emails[:limit])
+        if len(emails) > limit:
+            listing += " (and {} more)".format(len(emails) - limit)
+        return listing
+
+    @classmethod
+    def _sanity_check_pairs(cls, pairs):
+        """
+        Checks the pairs as a whole, in linear time and with one query;
+        returns the (pk, sailthru_id) of the user of each old email.
+        """
         if not pairs:
             raise CommandError("No old/new email pairs found")
         if [x for x in pairs if len(x) != 2]:
             raise CommandError(
                 "Input file should contain one comma-separated pair on each line"
             )
+        if [x for x in pairs if not x[0] or not x[1]]:
+            raise CommandError("Cannot have empty emails")
 
-        old_emails = [x[0] for x in pairs]
-        new_emails = [x[1] for x in pairs]
+        old_emails = Counter(x[0] for x in pairs)
+        new_emails = Counter(x[1] for x in pairs)
 
-        for old_email, new_email in pairs:
-            if not old_email or not new_email:
-                raise CommandError("Cannot have empty emails")
-            if old_emails.count(old_email) > 1:
-                raise CommandError(
-                    "Same old email found in multiple pairs: {}".format(old_email)
-                )
-            if new_emails.count(new_emails) > 1:
-                raise CommandError(
-                    "Same new email found in multiple pairs: {}".format(new_email)
+        repeated = [email for email, count in old_emails.items() if count > 1]
+        if repeated:
+            raise CommandError(
+                "Same old email found in multiple pairs: {}".format(
+                    cls._listing(repeated)
                 )
-            if old_email in new_emails:
-                raise CommandError(
-                    "Old email being used as a new email in one or more pairs: {}".format(
-                        old_email
-                    )
+            )
+        repeated = [email for email, count in new_emails.items() if count > 1]
+        if repeated:
+            raise CommandError(
+                "Same new email found in multiple pairs: {}".format(
+                    cls._listing(repeated)
                 )
-            if new_email in old_emails:
-                raise CommandError(
-                    "New email being used as a old email in one or more pairs: {}".format(
-                        new_email
-                    )
+            )
+        both = set(old_emails) & set(new_emails)
+        if both:
+            raise CommandError(
+                "Email used as both an old and a new email: {}".format(
+                    cls._listing(both)
                 )
+            )
+
+        invalid = []
+        for new_email in new_emails:
             try:
-                AudienceUser.objects.get(email=old_email)
-            except AudienceUser.DoesNotExist:
-                raise CommandError(
-                    "User with email does not exist in audb: {}".format(old_email)
+                validate_email(new_email)
+                normalized_email_validator(new_email)
+            except ValidationError:
+                invalid.append(new_email)
+        if invalid:
+            raise CommandError("Invalid new email: {}".format(cls._listing(invalid)))
+
+        users = AudienceUser.objects.find_by_email(list(old_emails) + list(new_emails))
+        missing = set(old_emails) - set(users)
+        if missing:
+            raise CommandError(
+                "User with email does not exist in audb: {}".format(
+                    cls._listing(missing)
                 )
-            if AudienceUser.objects.filter(email=new_email).exists():
-                raise CommandError(
-                    "Update-to email already exists: {}".format(new_email)
+            )
+        existing = set(new_emails) & set(users)
+        if existing:
+            raise CommandError(
+                "Update-to email already exists: {}".format(cls._listing(existing))
+            )
+        return users
+
+    def _record(self, old_email, new_email, status, error=None):
+        if status != SAILTHRU_CHANGED:
+            self.counts[status] += 1
+        if error is not None:
+            self.stdout.write("[ERROR] {} > {}: {}".format(old_email, new_email, error))
+        self.report.write(
+            json.dumps(
+                OrderedDict(
+                    (
+                        ("old_email", old_email),
+                        ("new_email", new_email),
+                        ("status", status),
+                        ("error", error),
+                    )
                 )
+            )
+            + "\n"
+        )
 
-    def _check_st_response(self, user, new_email, response_body):
+    def _check_st_response(self, sailthru_id, new_email, response_body):
         st_sync_email = response_body.get("keys", {}).get("email", None)
         st_sync_sid = response_body.get("keys", {}).get("sid", None)
         if st_sync_email != new_email:
             raise Exception(
                 "expected email not gotten, instead: {}".format(st_sync_email)
             )
-        if st_sync_sid != user.sailthru_id:
-            raise Exception(
-                "SIDs do not match: {} {}".format(st_sync_sid, user.sailthru_id)
-            )
-
-    def _change_email(self, old_email, new_email):
-        self.stdout.write("changing: {} > {}".format(old_email, new_email))
-
-        user = AudienceUser.objects.get(email=old_email)
+        if st_sync_sid != sailthru_id:
+            raise Exception("SIDs do not match: {} {}".format(st_sync_sid, sailthru_id))
 
+    def _change_batch(self, pairs):
+        pks = {old_email: self.users[old_email][0] for old_email, _ in pairs}
+        locked = SyncLock.objects.lock_many(AudienceUser, pks.values())
         try:
-            sync_lock = self._get_sync_lock(user)
-        except Exception as e:
-            self.stdout.write("[ERROR] {}".format(e))
-            return
+            changed = []
+            futures = {}
+            for old_email, new_email in pairs:
+                if pks[old_email] not in locked:
+                    self._record(
+                        old_email,
+                        new_email,
+                        FAILED,
+                        "This user is currently locked, preventing syncing with "
+                        "Sailthru.",
+                    )
+                elif (old_email, new_email) in self.sailthru_changed:
+                    changed.append((old_email, new_email))
+                else:
+                    future = self.executor.submit(
+                        self._update_email_at_sailthru, old_email, new_email
+                    )
+                    futures[future] = (old_email, new_email)
 
-        try:
-            st_update = self._update_email_at_sailthru(old_email, new_email)
-        except Exception as e:
-            st_update = None
-            self.stdout.write("[ERROR] {}".format(e))
+            for future in as_completed(futures):
+                old_email, new_email = futures[future]
+                try:
+                    self._check_st_response(
+                        self.users[old_email][1], new_email, future.result()
+                    )
+                except Exception as e:
+                    self._record(old_email, new_email, FAILED, str(e))
+                else:
+                    # checkpointed before audb is changed, so that a rerun
+                    # does not ask Sailthru for the old email again
+                    self._record(old_email, new_email, SAILTHRU_CHANGED)
+                    changed.append((old_email, new_email))
         finally:
-            self._free_sync_lock(sync_lock)
-
-        if not st_update:
-            return
+            SyncLock.objects.release_many(AudienceUser, locked)
 
-        response_body = st_update.get_body()
-        try:
-            self._check_st_response(user, new_email, response_body)
-        except Exception as e:
-            self.stdout.write("[ERROR] {}".format(e))
+        if not changed:
             return
-
-        user.email = new_email
-        user.validate_and_save()
+        with transaction.atomic():
+            user_pks = AudienceUser.objects.change_emails(changed)
+            if settings.SAILTHRU_SYNC_SIGNALS_ENABLED:
+                transaction.on_commit(lambda: sync_users_basic.apply_async([user_pks]))
+        for old_email, new_email in changed:
+            self._record(old_email, new_email, CHANGED)
 
     def _update_email_at_sailthru(self, old_email, new_email):
+        # runs in a worker thread: no database access here
         payload = {
             "id": old_email,
             "key": "email",
@@ -142,23 +319,8 @@ class Command(BaseCommand):
                 "keys": 1,
             },
         }
+        self.limiter.wait()
         response = sailthru_client().api_post("user", payload)
         if not response.is_ok():
             raise Exception(response.get_body())
-        return response
-
-    @staticmethod
-    def _get_sync_lock(user):
-        try:
-            lock = SyncLock(locked_instance=user)
-            with transaction.atomic():
-                lock.save()
-        except IntegrityError:
-            raise Exception(
-                "This user is currently locked, preventing syncing with Sailthru."
-            )
-        return lock
-
-    @staticmethod
-    def _free_sync_lock(lock):
-        lock.delete()
+        return response.get_body()
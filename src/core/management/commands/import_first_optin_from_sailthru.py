@@ -1,17 +1,23 @@
 import csv
 from datetime import datetime
+from itertools import islice
 from pytz import exceptions
 
+from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 from django.utils import timezone
 
-from core.models import AudienceUser
+from core.models import AudienceUser, OptoutHistory, Subscription
+from sailthru_sync.tasks import sync_users_basic
 
 
 COLUMN_EMAIL = "Email"
 COLUMN_ID = "Profile Id"
 COLUMN_PROFILE_CREATED = "Profile Created Date"
 
+COMMENT = "Imported initial optin from Sailthru to audb (via CSV export)"
+
 
 def parse_datetime(str_value):
     # print("Attempting to parse {}".format(str_value))
@@ -28,6 +34,12 @@ class Command(BaseCommand):
         Given a CSV export from Sailthru with `{}` and `{}`
         column headers, updates every matching AudienceUser with the appropriate
         optout status.
+
+        Rows are imported `--batch-size` at a time, each batch with a few
+        set-based queries: running the import again moves the dates of the
+        opt-ins it recorded instead of adding more. No user is synced with
+        Sailthru while importing; those whose optout status changed are
+        queued for one sync each at the end.
         """.format(
         COLUMN_ID, COLUMN_PROFILE_CREATED
     )
@@ -46,10 +58,24 @@ class Command(BaseCommand):
             help="Max number of rows to process",
             default=["999999999"],
         )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Rows matched and written per transaction",
+        )
 
     def handle(self, *args, **options):
         if not options["file"]:
             raise CommandError("--file must be specified")
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1")
+
+        self.found = 0
+        self.not_found = 0
+        self.to_sync = set()
+        rows_completed = 0
+        rows_max = int(options["limit"][0])
 
         with open(options["file"][0], "r") as csvfile:
             reader = csv.reader(csvfile)
@@ -59,45 +85,61 @@ class Command(BaseCommand):
             profile_created_index = header_row.index(COLUMN_PROFILE_CREATED)
             email_index = header_row.index(COLUMN_EMAIL)
 
-            found = 0
-            not_found = 0
-            rows_completed = 0
-            rows_max = int(options["limit"][0])
-
-            for row in reader:
-                email = row[email_index]
-                profile_created_date = parse_datetime(row[profile_created_index])
-                try:
-                    user = AudienceUser.objects.get(email=email)
-                    user.disable_sync()
-
-                    user.record_optout(
-                        "none",
-                        "Imported initial optin from Sailthru to audb (via CSV export)",
-                        effective_date=profile_created_date,
-                    )
-                    found += 1
-                except AudienceUser.DoesNotExist:
-                    not_found += 1
-
-                rows_completed += 1
-
-                if rows_completed % 1000 == 0:
-                    print(
-                        (
-                            "Completed {} rows so far "
-                            "({} emails found; {} not found)"
-                        ).format(rows_completed, found, not_found)
+            rows = islice(reader, rows_max)
+            while True:
+                batch = list(islice(rows, options["batch_size"]))
+                if not batch:
+                    break
+                self._import_batch(
+                    [
+                        (row[email_index], parse_datetime(row[profile_created_index]))
+                        for row in batch
+                    ]
+                )
+                rows_completed += len(batch)
+                self.stdout.write(
+                    "Completed {} rows so far ({} emails found; {} not found)".format(
+                        rows_completed, self.found, self.not_found
                     )
+                )
+
+        if self.to_sync and settings.SAILTHRU_SYNC_SIGNALS_ENABLED:
+            sync_users_basic.apply_async([sorted(self.to_sync)])
+
+        self.stdout.write(
+            (
+                "--------------\n--------------\n"
+                "Import completed.\n"
+                "{} total rows; {} emails found; {} not found; "
+                "{} users queued for sync\n"
+                "--------------\n--------------"
+            ).format(rows_completed, self.found, self.not_found, len(self.to_sync))
+        )
 
-                if rows_completed >= rows_max:
-                    break
+    def _import_batch(self, rows):
+        # the earliest date of an email listed more than once
+        dates = {}
+        for email, profile_created_date in rows:
+            if email not in dates or profile_created_date < dates[email]:
+                dates[email] = profile_created_date
 
-            print(
-                (
-                    "--------------\n--------------\n"
-                    "Import completed.\n"
-                    "{} total rows; {} emails found; {} not found\n"
-                    "--------------\n--------------"
-                ).format(rows_completed, found, not_found)
+        users = AudienceUser.objects.find_by_email(dates)
+        self.found += sum(1 for email, _ in rows if email in users)
+        self.not_found += sum(1 for email, _ in rows if email not in users)
+
+        with transaction.atomic():
+            OptoutHistory.objects.set_initial_optins(
+                ((pk, dates[email]) for email, (pk, _) in users.items()), COMMENT
+            )
+            changed = AudienceUser.objects.reset_sailthru_optouts(
+                pk for pk, _ in users.values()
             )
+            # as reset_sailthru_optout() would; only possible for users whose
+            # cached status was stale
+            for pk, optout in changed:
+                if optout in (AudienceUser.OPTOUT_ALL, AudienceUser.OPTOUT_BASIC):
+                    Subscription.objects.unsubscribe_from_all(
+                        AudienceUser.objects.get(pk=pk),
+                        comment="unsubscribe triggered by sailthru optout (all/basic)",
+                    )
+        self.to_sync.update(pk for pk, _ in changed)
@@ -0,0 +1,51 @@
+import gzip
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import bulk
+
+
+class Command(BaseCommand):
+    help = """
+    Upserts athena content metadata from an NDJSON file (gzipped if its name
+    ends in .gz, or "-" for stdin), one object per line in the format of the
+    athena-content-metadata API, with the content type given by name or pk.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help='NDJSON file to load, or "-" for stdin.')
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=bulk.BATCH_SIZE,
+            help="Lines validated and written per query.",
+        )
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        path = options["path"]
+        if path == "-":
+            lines = sys.stdin
+        else:
+            try:
+                opener = gzip.open if path.endswith(".gz") else open
+                lines = opener(path, "rt", encoding="utf-8")
+            except OSError as e:
+                raise CommandError(e)
+
+        loader = bulk.ContentMetadataLoader(batch_size=options["batch_size"])
+        try:
+            loader.load(lines)
+        finally:
+            if lines is not sys.stdin:
+                lines.close()
+
+        for error in loader.errors:
+            self.stderr.write("Line {}: {}".format(error["line"], error["errors"]))
+        self.stdout.write(
+            "Created {}, updated {}, skipped {}.".format(
+                loader.created, loader.updated, len(loader.errors)
+            )
+        )
@@ -0,0 +1,52 @@
+import gzip
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import bulk
+
+
+class Command(BaseCommand):
+    help = """
+    Creates or updates audience users from an NDJSON file (gzipped if its name
+    ends in .gz, or "-" for stdin), one {email, vars, omeda_id, source_signups}
+    object per line. Vars are merged into existing users' vars, as with the
+    audience-users API.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help='NDJSON file to load, or "-" for stdin.')
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=bulk.BATCH_SIZE,
+            help="Lines validated and written per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        path = options["path"]
+        if path == "-":
+            lines = sys.stdin
+        else:
+            try:
+                opener = gzip.open if path.endswith(".gz") else open
+                lines = opener(path, "rt", encoding="utf-8")
+            except OSError as e:
+                raise CommandError(e)
+
+        loader = bulk.AudienceUserLoader(batch_size=options["batch_size"])
+        try:
+            loader.load(lines)
+        finally:
+            if lines is not sys.stdin:
+                lines.close()
+
+        for error in loader.errors:
+            self.stderr.write("Line {}: {}".format(error["line"], error["errors"]))
+        self.stdout.write(
+            "Created {}, updated {}, unchanged {}, skipped {}.".format(
+                loader.created, loader.updated, loader.unchanged, len(loader.errors)
+            )
+        )
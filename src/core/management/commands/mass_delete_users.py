@@ -1,65 +1,209 @@
+import json
 from argparse import RawTextHelpFormatter
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
 
 from celery.utils.log import get_task_logger
-from django.db import router
 from django.conf import settings
-from django.contrib.admin.utils import NestedObjects
 from django.core.exceptions import ImproperlyConfigured
 from django.core.management.base import BaseCommand, CommandError
 from core.models import AudienceUser
 from sailthru_sync import converter as sync_converter
 from sailthru_sync.converter.errors import ConversionError
+from sailthru_sync.models import SyncLock
+from sailthru_sync.ratelimit import RateLimiter
 from sailthru_sync.utils import sailthru_client
 import sentry_sdk
 
 
 sync_logger = get_task_logger("sailthru_sync.tasks")
 
+# statuses of the emails in the audit log
+DELETED = "deleted"
+MISSING = "missing"
+FAILED = "failed"
+
 
 class Command(BaseCommand):
     help = """
     Use this command to mass delete users from Audb and Sailthru
 
-    Specify the input file with ``--file``. This file should contain email addresses
+    Specify the input file with ``--file``. This file should contain email
+    addresses, one per line after a header line.
+
+    Emails are handled ``--batch-size`` at a time: their users are looked up
+    with one query, merged into the deleted user at Sailthru by ``--workers``
+    threads (at most ``--rate`` requests per second between them), and
+    deleted from audb, with all their data, with one DELETE per table. That
+    includes the content views and interests kept under their emails.
+
+    Each email's outcome is appended to the ``--audit`` file (by default the
+    input file's name plus ".audit.jsonl") as one JSON object per line:
+    {"email", "user_id", "status", "error"}, with a status of "deleted",
+    "missing" or "failed".
+
+    With ``--dry-run`` nothing is deleted, here or at Sailthru: the command
+    only counts the users found and the rows that deleting them would remove.
     """
 
     def add_arguments(self, parser):
         parser.formatter_class = RawTextHelpFormatter
         parser.add_argument("--file", nargs=1, type=str)
+        parser.add_argument("--audit", type=str)
+        parser.add_argument("--dry-run", action="store_true", default=False)
+        parser.add_argument("--workers", type=int, default=8)
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--rate", type=float, default=settings.SAILTHRU_API_REQUESTS_PER_SECOND
+        )
 
     def handle(self, *args, **options):
-        if not settings.SAILTHRU_SYNC_ENABLED:
+        if not settings.SAILTHRU_SYNC_ENABLED and not options["dry_run"]:
             raise ImproperlyConfigured(
                 "Cannot run because Sailthru sync is currently disabled."
             )
 
         if not options["file"]:
             raise CommandError("--file must be specified")
-
+        for option in ("workers", "batch_size", "rate"):
+            if options[option] <= 0:
+                raise CommandError(
+                    "--{} must be positive".format(option.replace("_", "-"))
+                )
+
+        self.dry_run = options["dry_run"]
+        self.counts = Counter()
+        self.deleted_rows = Counter()
+        self.limiter = RateLimiter(options["rate"])
+        audit_path = options["audit"] or options["file"][0] + ".audit.jsonl"
         with open(options["file"][0], "r") as input_file:
-            pairs = [x.strip().split(",") for x in input_file.readlines()]
-
             # skip over header in first line
-            for row in pairs[1:]:
-                email_address = row[0]
+            next(input_file, None)
+            emails = (line.strip().split(",")[0] for line in input_file)
+            emails = (email for email in emails if email)
+            if self.dry_run:
+                self.audit = None
+                self._run(emails, options["batch_size"])
+            else:
+                with open(audit_path, "a", buffering=1) as self.audit:
+                    with ThreadPoolExecutor(
+                        max_workers=options["workers"]
+                    ) as self.executor:
+                        self._run(emails, options["batch_size"])
+
+        verb = "Would delete" if self.dry_run else "Deleted"
+        self.stdout.write(
+            "{} {} users ({} missing, {} failed).".format(
+                verb, self.counts[DELETED], self.counts[MISSING], self.counts[FAILED]
+            )
+        )
+        for label, count in sorted(self.deleted_rows.items()):
+            self.stdout.write("  {}: {}".format(label, count))
+
+    def _run(self, emails, batch_size):
+        seen = set()
+        emails = (email for email in emails if not (email in seen or seen.add(email)))
+        while True:
+            batch = list(islice(emails, batch_size))
+            if not batch:
+                return
+            self._delete_batch(batch)
+            self.stdout.write(
+                "{} emails done: {} deleted, {} missing, {} failed.".format(
+                    sum(self.counts.values()),
+                    self.counts[DELETED],
+                    self.counts[MISSING],
+                    self.counts[FAILED],
+                )
+            )
 
-                try:
-                    user = AudienceUser.objects.get(email=email_address)
-                except AudienceUser.DoesNotExist:
-                    print("User: {} does not exist in Audb".format(str(email_address)))
-                    continue
+    def _record(self, email, user_id, status, error=None):
+        self.counts[status] += 1
+        if error is not None:
+            self.stdout.write("[ERROR] {}: {}".format(email, error))
+        if self.audit is None:
+            return
+        self.audit.write(
+            json.dumps(
+                OrderedDict(
+                    (
+                        ("email", email),
+                        ("user_id", user_id),
+                        ("status", status),
+                        ("error", error),
+                    )
+                )
+            )
+            + "\n"
+        )
+
+    def _delete_batch(self, emails):
+        users = AudienceUser.objects.find_by_email(emails)
+        for email in emails:
+            if email not in users:
+                self._record(email, None, MISSING)
+
+        if self.dry_run:
+            for email in users:
+                self._record(email, users[email][0], DELETED)
+            self.deleted_rows.update(
+                AudienceUser.objects.delete_many(
+                    [pk for pk, _ in users.values()], count_only=True
+                )
+            )
+            return
 
-                data = self._get_sync_data(user)
-                response = self._sync_to_sailthru(data, user)
-                if not response.is_ok():
-                    print("Sailthru failed for: {}".format(str(email_address)))
-                    print(response.get_error().message)
+        locked = SyncLock.objects.lock_many(
+            AudienceUser, [pk for pk, _ in users.values()]
+        )
+        try:
+            futures = {}
+            for email, (pk, sid) in users.items():
+                if pk not in locked:
+                    self._record(
+                        email,
+                        pk,
+                        FAILED,
+                        "This user is currently locked, preventing syncing with "
+                        "Sailthru.",
+                    )
                     continue
+                # the converter only needs the user's Sailthru keys
+                user = AudienceUser(pk=pk, email=email, sailthru_id=sid)
+                futures[self.executor.submit(self._delete_at_sailthru, user)] = user
 
-                using = router.db_for_write(user._meta.model)
-                collector = NestedObjects(using=using)
-                collector.collect([user])
-                collector.delete()
+            deleted = []
+            for future in as_completed(futures):
+                user = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    self._record(user.email, user.pk, FAILED, str(e))
+                else:
+                    deleted.append(user)
+
+            self.deleted_rows.update(
+                AudienceUser.objects.delete_many(user.pk for user in deleted)
+            )
+            for user in deleted:
+                self._record(user.email, user.pk, DELETED)
+        finally:
+            SyncLock.objects.release_many(AudienceUser, locked)
+
+    def _delete_at_sailthru(self, user):
+        # runs in a worker thread: no database access here
+        data = self._get_sync_data(user)
+        if data is None:
+            raise Exception("Could not convert the user for Sailthru.")
+        self.limiter.wait()
+        response = self._sync_to_sailthru(data, user)
+        if response is None:
+            raise Exception("Sailthru request failed.")
+        if not response.is_ok():
+            raise Exception(
+                "Sailthru failed: {}".format(response.get_error().get_message())
+            )
 
     def _get_sync_data(self, user):
         try:
@@ -1,83 +1,230 @@
 import csv
+import gzip
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+from django.conf import settings
 from django.core.mail import EmailMessage
 from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
 
+from core.models import List, Subscription
+from sailthru_sync.ratelimit import RateLimiter
 from sailthru_sync.utils import sailthru_client
 from sailthru.sailthru_error import SailthruClientError
 
 
+# how each list compares between Sailthru and audb
+MATCH = "match"
+DRIFT = "drift"
+MISSING_IN_AUDB = "missing_in_audb"
+MISSING_IN_SAILTHRU = "missing_in_sailthru"
+
+
 class Command(BaseCommand):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.output_file = "/tmp/sailthru_lists.csv"
-        self.sailthru_lists = None
+    help = """
+    Exports Sailthru's lists to a gzipped CSV, side by side with the number
+    of active subscribers of the matching audb list (counted for all lists
+    with one query), so sync drift shows up without a spreadsheet.
+
+    Each row has a "status": "match" or "drift" when the Sailthru list's
+    email_count does or does not equal audb's count, "missing_in_audb" for
+    Sailthru lists with no audb list and "missing_in_sailthru" for audb
+    lists (of type "list", that can sync) Sailthru does not have.
+
+    The counts are those of Sailthru's list index; with ``--counts`` each
+    list's own counts are fetched instead, by ``--workers`` threads at most
+    ``--rate`` requests per second between them.
+    """
+
+    fieldnames = [
+        "name",
+        "list_id",
+        "type",
+        "create_time",
+        "email_count",
+        "valid_count",
+        "audb_active",
+        "difference",
+        "status",
+    ]
 
     def add_arguments(self, parser):
         parser.add_argument(
             "--email", nargs="*", help="Destination address(es) for .csv export"
         )
+        parser.add_argument("--output", default="/tmp/sailthru_lists.csv.gz")
+        parser.add_argument(
+            "--counts",
+            action="store_true",
+            default=False,
+            help="Fetch each list's member counts instead of the index's.",
+        )
+        parser.add_argument(
+            "--drift-only",
+            action="store_true",
+            default=False,
+            help="Only export the lists that do not match.",
+        )
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument(
+            "--rate", type=float, default=settings.SAILTHRU_API_REQUESTS_PER_SECOND
+        )
 
-    def get_lists(self):
+    @staticmethod
+    def _get(params):
         try:
-            response = sailthru_client().api_get("list", {})
-
-            if response.is_ok():
-                body = response.get_body()
-                self.sailthru_lists = body["lists"]
-
-            else:
-                error = response.get_error()
-                print("Error: " + error.get_message())
-                print("Status Code: " + str(response.get_status_code()))
-                print("Error Code: " + str(error.get_error_code()))
-
+            response = sailthru_client().api_get("list", params)
         except SailthruClientError as e:
-            # Handle exceptions
-            print("Exception")
-            print(e)
-
-    def create_csv(self):
-        with open(self.output_file, "w") as csvfile:
-            fieldnames = [
-                "name",
-                "list_id",
-                "type",
-                "email_count",
-                "valid_count",
-                "create_time",
-            ]
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            raise CommandError("Sailthru request failed: {}".format(e))
+        if not response.is_ok():
+            error = response.get_error()
+            raise CommandError(
+                "Sailthru error {} (status {}): {}".format(
+                    error.get_error_code(),
+                    response.get_status_code(),
+                    error.get_message(),
+                )
+            )
+        return response.get_body()
 
-            writer.writeheader()
+    def get_lists(self):
+        """Yields the lists of Sailthru's list index."""
+        # the index comes back whole, in one response
+        for row in self._get({}).get("lists", []):
+            yield row
+
+    def get_list_counts(self, name):
+        self.limiter.wait()
+        body = self._get({"list": name})
+        return body.get("email_count"), body.get("valid_count")
+
+    @staticmethod
+    def audb_counts():
+        """Active subscribers (with an email) of each audb list, by slug."""
+        return dict(
+            Subscription.objects.filter(active=True, audience_user__email__isnull=False)
+            .values_list("list__slug")
+            .annotate(count=Count("id"))
+            .order_by()
+        )
 
-            for row in self.sailthru_lists:
-                # convert datetime column
-                try:
-                    row["create_time"] = datetime.strptime(
-                        row["create_time"], "%a, %d %b %Y %H:%M:%S %z"
+    @staticmethod
+    def parse_create_time(value):
+        try:
+            return datetime.strptime(value, "%a, %d %b %Y %H:%M:%S %z")
+        except (TypeError, ValueError):
+            return value
+
+    def reconcile(self, sailthru_lists, audb_counts, audb_slugs, synced_slugs):
+        """
+        Yields the rows of the export: Sailthru's lists, then the audb lists
+        in `synced_slugs` Sailthru does not have.
+        """
+        seen = set()
+        for row in sailthru_lists:
+            name = row.get("name")
+            seen.add(name)
+            audb_active = audb_counts.get(name, 0) if name in audb_slugs else None
+            email_count = row.get("email_count")
+            if audb_active is None:
+                status = MISSING_IN_AUDB
+                difference = None
+            else:
+                difference = (email_count or 0) - audb_active
+                status = MATCH if difference == 0 else DRIFT
+            yield {
+                "name": name,
+                "list_id": row.get("list_id"),
+                "type": row.get("type"),
+                "create_time": self.parse_create_time(row.get("create_time")),
+                "email_count": email_count,
+                "valid_count": row.get("valid_count"),
+                "audb_active": audb_active,
+                "difference": difference,
+                "status": status,
+            }
+
+        for slug in sorted(synced_slugs - seen):
+            yield {
+                "name": slug,
+                "audb_active": audb_counts.get(slug, 0),
+                "status": MISSING_IN_SAILTHRU,
+            }
+
+    def with_list_counts(self, rows, workers):
+        """Replaces the index counts of `rows` with each list's own."""
+        rows = iter(rows)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # keep a window of requests in flight, in order
+            window = []
+            for row in rows:
+                if row["status"] != MISSING_IN_SAILTHRU:
+                    window.append(
+                        (row, executor.submit(self.get_list_counts, row["name"]))
                     )
-                except:
-                    pass
-
+                else:
+                    window.append((row, None))
+                if len(window) >= workers * 2:
+                    yield self._apply_counts(*window.pop(0))
+            for row, future in window:
+                yield self._apply_counts(row, future)
+
+    @staticmethod
+    def _apply_counts(row, future):
+        if future is None:
+            return row
+        row["email_count"], row["valid_count"] = future.result()
+        if row["audb_active"] is not None:
+            row["difference"] = (row["email_count"] or 0) - row["audb_active"]
+            row["status"] = MATCH if row["difference"] == 0 else DRIFT
+        return row
+
+    def create_csv(self, rows, drift_only=False):
+        written = 0
+        with gzip.open(self.output_file, "wt", newline="") as csvfile:
+            writer = csv.DictWriter(
+                csvfile, fieldnames=self.fieldnames, extrasaction="ignore"
+            )
+            writer.writeheader()
+            for row in rows:
+                if drift_only and row["status"] == MATCH:
+                    continue
                 writer.writerow(row)
+                written += 1
+        return written
 
     def email_csv(self, recipients):
         email = EmailMessage(
             "Sailthru Lists",
-            "Sailthru Lists attached as .csv file.",
+            "Sailthru Lists attached as a gzipped .csv file.",
             "noreply@govexec.com",
             recipients,
         )
-        email.attach_file(self.output_file, "text/csv")
+        email.attach_file(self.output_file, "application/gzip")
         email.send()
 
     def handle(self, *args, **options):
-        # if not options["email"]:
-        #     raise CommandError("--email required for destination")
+        if options["workers"] <= 0 or options["rate"] <= 0:
+            raise CommandError("--workers and --rate must be positive")
+        self.output_file = options["output"]
+        self.limiter = RateLimiter(options["rate"])
+
+        lists = List.objects.filter(type="list")
+        audb_slugs = set(lists.values_list("slug", flat=True))
+        # those for which List.can_sync()
+        synced_slugs = set(
+            lists.filter(sync_externally=True, archived=False).values_list(
+                "slug", flat=True
+            )
+        )
+        rows = self.reconcile(
+            self.get_lists(), self.audb_counts(), audb_slugs, synced_slugs
+        )
+        if options["counts"]:
+            rows = self.with_list_counts(rows, options["workers"])
+        written = self.create_csv(rows, drift_only=options["drift_only"])
+        self.stdout.write("Wrote {} lists to {}.".format(written, self.output_file))
 
-        self.get_lists()
-        self.create_csv()
         if options["email"]:
             self.email_csv(options["email"])
@@ -0,0 +1,96 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core import partitions
+
+
+class Command(BaseCommand):
+    help = """
+    Maintains the monthly partitions of the subscription log: creates the
+    partitions of the coming months and, with ``--retain-months``, detaches
+    the partitions older than that many months.
+
+    Detached partitions are kept as standalone tables unless ``--drop`` is
+    given; ``--archive-schema`` moves them into another schema instead.
+
+    Before migration 0027 partitions the table, ``--prepare`` builds what it
+    needs without blocking writes (see core.partitions.prepare_table), so
+    that the migration only holds its lock for a moment.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--prepare",
+            action="store_true",
+            help="Ready the unpartitioned table for migration 0027, and exit.",
+        )
+        parser.add_argument(
+            "--months-ahead",
+            type=int,
+            default=partitions.MONTHS_AHEAD,
+            help="Months after the current one to create partitions for.",
+        )
+        parser.add_argument(
+            "--retain-months",
+            type=int,
+            help="Detach the partitions of entries older than this many months.",
+        )
+        parser.add_argument(
+            "--archive-schema", help="Move detached partitions into this schema."
+        )
+        parser.add_argument(
+            "--drop", action="store_true", help="Drop detached partitions."
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only list the partitions that would be created or detached.",
+        )
+
+    def handle(self, *args, **options):
+        if options["prepare"]:
+            try:
+                bound = partitions.prepare_table()
+            except ValueError as e:
+                raise CommandError(str(e))
+            self.stdout.write(
+                "Prepared {} for partitioning: every entry is from before {}; "
+                "migrate before then.".format(partitions.TABLE, bound.isoformat())
+            )
+            return
+
+        if options["drop"] and options["archive_schema"]:
+            raise CommandError("--drop and --archive-schema are exclusive.")
+        if options["retain_months"] is not None and options["retain_months"] < 1:
+            raise CommandError("--retain-months must be at least 1.")
+        dry_run = options["dry_run"]
+
+        if dry_run:
+            created = [
+                partitions.PARTITION_NAME.format(month)
+                for month in partitions.missing_partitions(options["months_ahead"])
+            ]
+        else:
+            created = partitions.ensure_partitions(options["months_ahead"])
+        for name in created:
+            self.stdout.write(
+                "{} {}".format("Would create" if dry_run else "Created", name)
+            )
+
+        if options["retain_months"] is None:
+            return
+        before = partitions.add_months(
+            partitions.month_start(timezone.now()), -options["retain_months"]
+        )
+        if dry_run:
+            retired = [
+                partition.name for partition in partitions.expired_partitions(before)
+            ]
+        else:
+            retired = partitions.retire_partitions(
+                before, archive_schema=options["archive_schema"], drop=options["drop"]
+            )
+        for name in retired:
+            self.stdout.write(
+                "{} {}".format("Would detach" if dry_run else "Detached", name)
+            )
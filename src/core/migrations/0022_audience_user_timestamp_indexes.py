@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-19 17:15
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0021_auto_20230419_1004"),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name="productaction",
+            index_together=set([("audience_user", "timestamp")]),
+        ),
+        migrations.AlterIndexTogether(
+            name="uservarshistory",
+            index_together=set([("audience_user", "timestamp")]),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-19 17:18
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0022_audience_user_timestamp_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ListSubscriberCount",
+            fields=[
+                (
+                    "list",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="subscriber_count",
+                        serialize=False,
+                        to="core.List",
+                    ),
+                ),
+                ("active", models.IntegerField(default=0)),
+                ("inactive", models.IntegerField(default=0)),
+                ("modified", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "reconciled",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="When the counts were last recounted.",
+                        null=True,
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ListSubscriberCountHistory",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField()),
+                ("active", models.IntegerField()),
+                ("inactive", models.IntegerField()),
+                (
+                    "list",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="subscriber_count_history",
+                        to="core.List",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "List subscriber count history",
+                "ordering": ["-date"],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name="listsubscribercounthistory",
+            unique_together=set([("list", "date")]),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+TASK_NAME = "Reconcile list subscriber counts."
+
+
+def count_subscribers(apps, schema_editor):
+    List = apps.get_model("core", "List")
+    Subscription = apps.get_model("core", "Subscription")
+    ListSubscriberCount = apps.get_model("core", "ListSubscriberCount")
+
+    counts = {}
+    for row in (
+        Subscription.objects.values("list_id", "active")
+        .annotate(n=models.Count("id"))
+        .order_by()
+    ):
+        counts.setdefault(row["list_id"], [0, 0])[0 if row["active"] else 1] = row["n"]
+
+    now = timezone.now()
+    ListSubscriberCount.objects.bulk_create(
+        ListSubscriberCount(
+            list_id=list_id,
+            active=counts.get(list_id, [0, 0])[0],
+            inactive=counts.get(list_id, [0, 0])[1],
+            modified=now,
+            reconciled=now,
+        )
+        for list_id in List.objects.values_list("id", flat=True)
+    )
+
+
+def add_periodic_task(apps, schema_editor):
+    Cron = apps.get_model("djcelery", "CrontabSchedule")
+    PeriodicTask = apps.get_model("djcelery", "PeriodicTask")
+
+    cron = Cron.objects.create(
+        minute=15, hour=3, day_of_week="*", day_of_month="*", month_of_year="*"
+    )
+    PeriodicTask.objects.create(
+        name=TASK_NAME,
+        task="core.tasks.reconcile_list_subscriber_counts",
+        enabled=True,
+        crontab=cron,
+    )
+
+
+def remove_periodic_task(apps, schema_editor):
+    PeriodicTask = apps.get_model("djcelery", "PeriodicTask")
+
+    for task in PeriodicTask.objects.filter(name=TASK_NAME):
+        task.crontab.delete()
+        task.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("djcelery", "0001_initial"),
+        ("core", "0023_list_subscriber_counts"),
+    ]
+
+    operations = [
+        migrations.RunPython(count_subscribers, migrations.RunPython.noop),
+        migrations.RunPython(add_periodic_task, remove_periodic_task),
+    ]
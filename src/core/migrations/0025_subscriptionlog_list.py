@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-19 17:22
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Existing log entries get their list from the backfill_subscription_log_lists
+# command, in id ranges, rather than from one long UPDATE here.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0024_list_subscriber_counts_data"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="subscriptionlog",
+            name="list",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="core.List",
+            ),
+        ),
+        migrations.AlterIndexTogether(
+            name="subscriptionlog",
+            index_together=set([("list", "timestamp", "id")]),
+        ),
+    ]
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+import re
+
+from django.db import migrations
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+
+# Partitions core_subscriptionlog by month on "timestamp" (see core.partitions).
+# Needs PostgreSQL 12 or later: upgrade the server before migrating.
+#
+# The existing table is kept and attached as core_subscriptionlog_legacy, the
+# partition of everything before the bound below, so its rows are never
+# copied. Attaching needs a (id, timestamp) unique index on it and a
+# validated CHECK proving its range. Run
+#
+#     manage.py subscription_log_partitions --prepare
+#
+# first: it builds both without blocking writes, and the migration then only
+# swaps catalog entries. Its ACCESS EXCLUSIVE lock on the table is held for
+# well under a second, whatever the table's size. Without --prepare the
+# migration builds them itself, under that lock: writes to the log are
+# blocked for a full scan of the table plus an index build over it.
+#
+# The database's primary key becomes (id, timestamp), while the model state
+# keeps `id` as the primary key. Django only ever reads and writes by id, and
+# the autodetector compares model states, not the database, so it won't try
+# to change the key back; but a migration altering SubscriptionLog.id, or
+# its primary key, has to be written by hand for the partitioned table.
+#
+# Reversing it puts the entries of every attached partition back into the
+# legacy table and restores its primary key on id, which builds that index
+# under an ACCESS EXCLUSIVE lock. Partitions that were already retired (see
+# core.partitions.retire_partitions) are not brought back.
+
+TABLE = "core_subscriptionlog"
+LEGACY = TABLE + "_legacy"
+UNIQUE_INDEX = TABLE + "_id_timestamp_uniq"
+RANGE_CHECK = TABLE + "_partition_range"
+MONTHS_AHEAD = 3
+TASK_NAME = "Create subscription log partitions."
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def literal(value):
+    return "'{}'".format(value.isoformat())
+
+
+def prepared_bound(cursor):
+    """The bound of the CHECK added by --prepare, or None."""
+    cursor.execute(
+        "SELECT pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND conname = %s AND convalidated",
+        [TABLE, RANGE_CHECK],
+    )
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return parse_datetime(re.search(r"'([^']+)'", row[0]).group(1))
+
+
+def has_valid_index(cursor):
+    cursor.execute(
+        "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)",
+        [UNIQUE_INDEX],
+    )
+    row = cursor.fetchone()
+    return row is not None and row[0]
+
+
+def partition_table(apps, schema_editor):
+    if schema_editor.connection.pg_version < 120000:
+        raise RuntimeError(
+            "Partitioning the subscription log needs PostgreSQL 12 or later."
+        )
+    now = timezone.localtime(timezone.now(), timezone.utc)
+    current_month = datetime.datetime(now.year, now.month, 1, tzinfo=timezone.utc)
+    execute = schema_editor.execute
+
+    with schema_editor.connection.cursor() as cursor:
+        bound = prepared_bound(cursor)
+        indexed = has_valid_index(cursor)
+    if bound is None:
+        bound = add_months(current_month, 1)
+        execute(
+            "ALTER TABLE {} DROP CONSTRAINT IF EXISTS {}".format(TABLE, RANGE_CHECK)
+        )
+        execute(
+            "ALTER TABLE {} ADD CONSTRAINT {} "
+            'CHECK ("timestamp" < {}) NOT VALID'.format(
+                TABLE, RANGE_CHECK, literal(bound)
+            )
+        )
+        execute("ALTER TABLE {} VALIDATE CONSTRAINT {}".format(TABLE, RANGE_CHECK))
+    if not indexed:
+        execute("DROP INDEX IF EXISTS {}".format(UNIQUE_INDEX))
+        execute(
+            'CREATE UNIQUE INDEX {} ON {} (id, "timestamp")'.format(UNIQUE_INDEX, TABLE)
+        )
+
+    execute("ALTER TABLE {} RENAME TO {}".format(TABLE, LEGACY))
+    # replaced by the partitioned table's (id, timestamp) key once attached
+    execute("ALTER TABLE {} DROP CONSTRAINT {}_pkey".format(LEGACY, TABLE))
+    execute(
+        "ALTER TABLE {} ADD CONSTRAINT {} UNIQUE USING INDEX {}".format(
+            LEGACY, UNIQUE_INDEX, UNIQUE_INDEX
+        )
+    )
+
+    execute(
+        "CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS) "
+        'PARTITION BY RANGE ("timestamp")'.format(TABLE, LEGACY)
+    )
+    execute("ALTER SEQUENCE {0}_id_seq OWNED BY {0}.id".format(TABLE))
+    execute('ALTER TABLE {} ADD PRIMARY KEY (id, "timestamp")'.format(TABLE))
+    execute("CREATE INDEX ON {} (subscription_id)".format(TABLE))
+    execute('CREATE INDEX ON {} ("timestamp")'.format(TABLE))
+    execute('CREATE INDEX ON {} (list_id, "timestamp", id)'.format(TABLE))
+    for column, target in (
+        ("subscription_id", "core_subscription"),
+        ("list_id", "core_list"),
+    ):
+        execute(
+            "ALTER TABLE {0} ADD CONSTRAINT {0}_{1}_fk FOREIGN KEY ({1}) "
+            "REFERENCES {2} (id) DEFERRABLE INITIALLY DEFERRED".format(
+                TABLE, column, target
+            )
+        )
+
+    # the validated CHECK implies the partition's range, the unique index and
+    # the table's own indexes and foreign keys become the partitioned table's
+    # ones, so this neither scans nor indexes the table
+    execute(
+        "ALTER TABLE {} ATTACH PARTITION {} "
+        "FOR VALUES FROM (MINVALUE) TO ({})".format(TABLE, LEGACY, literal(bound))
+    )
+    execute("ALTER TABLE {} DROP CONSTRAINT {}".format(LEGACY, RANGE_CHECK))
+
+    execute("CREATE TABLE {0}_default PARTITION OF {0} DEFAULT".format(TABLE))
+    month = bound
+    while month <= add_months(current_month, MONTHS_AHEAD):
+        execute(
+            "CREATE TABLE {}_p{:%Y_%m} PARTITION OF {} "
+            "FOR VALUES FROM ({}) TO ({})".format(
+                TABLE, month, TABLE, literal(month), literal(add_months(month, 1))
+            )
+        )
+        month = add_months(month, 1)
+
+
+def unpartition_table(apps, schema_editor):
+    execute = schema_editor.execute
+    execute("ALTER TABLE {} DETACH PARTITION {}".format(TABLE, LEGACY))
+    # the entries of the monthly and default partitions
+    execute("INSERT INTO {} SELECT * FROM {}".format(LEGACY, TABLE))
+    execute("ALTER SEQUENCE {}_id_seq OWNED BY {}.id".format(TABLE, LEGACY))
+    execute("DROP TABLE {}".format(TABLE))
+    execute("ALTER TABLE {} RENAME TO {}".format(LEGACY, TABLE))
+    execute("ALTER TABLE {} DROP CONSTRAINT {}".format(TABLE, UNIQUE_INDEX))
+    execute("ALTER TABLE {0} ADD CONSTRAINT {0}_pkey PRIMARY KEY (id)".format(TABLE))
+
+
+def add_periodic_task(apps, schema_editor):
+    Cron = apps.get_model("djcelery", "CrontabSchedule")
+    PeriodicTask = apps.get_model("djcelery", "PeriodicTask")
+
+    cron = Cron.objects.create(
+        minute=45, hour=3, day_of_week="*", day_of_month="*", month_of_year="*"
+    )
+    PeriodicTask.objects.create(
+        name=TASK_NAME,
+        task="core.tasks.maintain_subscription_log_partitions",
+        enabled=True,
+        crontab=cron,
+    )
+
+
+def remove_periodic_task(apps, schema_editor):
+    PeriodicTask = apps.get_model("djcelery", "PeriodicTask")
+
+    for task in PeriodicTask.objects.filter(name=TASK_NAME):
+        task.crontab.delete()
+        task.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("djcelery", "0001_initial"),
+        ("core", "0026_subscriptionlogexport"),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_table, unpartition_table),
+        migrations.RunPython(add_periodic_task, remove_periodic_task),
+    ]
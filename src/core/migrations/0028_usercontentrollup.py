@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-19 17:36
+from __future__ import unicode_literals
+
+import core.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+TASK_NAME = "Compact user content history."
+
+
+def add_periodic_task(apps, schema_editor):
+    Cron = apps.get_model("djcelery", "CrontabSchedule")
+    PeriodicTask = apps.get_model("djcelery", "PeriodicTask")
+
+    cron = Cron.objects.create(
+        minute=15, hour=4, day_of_week="*", day_of_month="*", month_of_year="*"
+    )
+    PeriodicTask.objects.create(
+        name=TASK_NAME,
+        task="core.tasks.compact_user_content_history",
+        enabled=True,
+        crontab=cron,
+    )
+
+
+def remove_periodic_task(apps, schema_editor):
+    PeriodicTask = apps.get_model("djcelery", "PeriodicTask")
+
+    for task in PeriodicTask.objects.filter(name=TASK_NAME):
+        task.crontab.delete()
+        task.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0027_partition_subscriptionlog"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserContentRollup",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("email", models.EmailField(max_length=500)),
+                ("first_seen", models.DateTimeField()),
+                ("last_seen", models.DateTimeField()),
+                ("count", models.IntegerField()),
+                (
+                    "last_referrer",
+                    core.fields.ReferrerField(blank=True, max_length=500, null=True),
+                ),
+                (
+                    "athena_content_metadata",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="user_content_rollups",
+                        to="core.AthenaContentMetadata",
+                        to_field="athena_content_id",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name="usercontentrollup",
+            unique_together=set([("email", "athena_content_metadata")]),
+        ),
+        migrations.RunPython(add_periodic_task, remove_periodic_task),
+    ]
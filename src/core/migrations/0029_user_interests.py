@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-19 17:39
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+TASK_NAME = "Ingest user interests."
+
+
+def add_periodic_task(apps, schema_editor):
+    Cron = apps.get_model("djcelery", "CrontabSchedule")
+    PeriodicTask = apps.get_model("djcelery", "PeriodicTask")
+
+    cron = Cron.objects.create(
+        minute="*/5", hour="*", day_of_week="*", day_of_month="*", month_of_year="*"
+    )
+    PeriodicTask.objects.create(
+        name=TASK_NAME,
+        task="core.tasks.ingest_user_interests",
+        enabled=True,
+        crontab=cron,
+    )
+
+
+def remove_periodic_task(apps, schema_editor):
+    PeriodicTask = apps.get_model("djcelery", "PeriodicTask")
+
+    for task in PeriodicTask.objects.filter(name=TASK_NAME):
+        task.crontab.delete()
+        task.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0028_usercontentrollup"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AggregationPosition",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=100, unique=True)),
+                ("position", models.BigIntegerField(default=0)),
+                ("updated", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="UserInterest",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("email", models.EmailField(max_length=500)),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("topic", "topic"),
+                            ("keyword", "keyword"),
+                            ("interest", "interest"),
+                            ("author", "author"),
+                            ("category", "category"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("value", models.CharField(max_length=255)),
+                ("score", models.FloatField()),
+                ("updated", models.DateTimeField()),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name="userinterest",
+            unique_together=set([("email", "kind", "value")]),
+        ),
+        migrations.AlterIndexTogether(
+            name="userinterest",
+            index_together=set([("email", "score")]),
+        ),
+        migrations.RunPython(add_periodic_task, remove_periodic_task),
+    ]
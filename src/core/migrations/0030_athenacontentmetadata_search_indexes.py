@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-19 17:48
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+# GIN indexes for the containment (@>) and overlap (&&) searches of the
+# athena-content-metadata API; Django 1.9 can't declare them on the model.
+GIN_INDEXES = (
+    ("topics", "array_ops"),
+    ("keywords", "array_ops"),
+    ("interests", "array_ops"),
+    ("authors", "array_ops"),
+    ("categories", "jsonb_path_ops"),
+)
+
+
+def gin_index(column, opclass):
+    name = "core_athenacontentmetadata_{}_gin".format(column)
+    return migrations.RunSQL(
+        "CREATE INDEX {} ON core_athenacontentmetadata "
+        "USING gin ({} {})".format(name, column, opclass),
+        "DROP INDEX {}".format(name),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0029_user_interests"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="athenacontentmetadata",
+            name="date_created",
+            field=models.DateTimeField(
+                db_index=True,
+                help_text="This date the original post was created in the govexec database.",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="athenacontentmetadata",
+            name="date_published",
+            field=models.DateTimeField(
+                blank=True,
+                db_index=True,
+                help_text="The date and time the post went live.",
+                null=True,
+                verbose_name="Publish date",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="athenacontentmetadata",
+            name="site_name",
+            field=models.CharField(db_index=True, max_length=25),
+        ),
+    ] + [gin_index(column, opclass) for column, opclass in GIN_INDEXES]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-19 17:52
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+# Existing users are hashed by 0034_audienceuser_email_hash_data, or ahead of
+# it, in chunks, by the backfill_email_hashes command.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0030_athenacontentmetadata_search_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="audienceuser",
+            name="email_hash",
+            field=models.CharField(
+                blank=True, db_index=True, editable=False, max_length=32, null=True
+            ),
+        ),
+    ]
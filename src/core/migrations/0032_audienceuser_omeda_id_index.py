@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-19 17:55
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0031_audienceuser_email_hash"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="audienceuser",
+            name="omeda_id",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                max_length=255,
+                null=True,
+                verbose_name="Omeda ID",
+            ),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-19 18:18
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0032_audienceuser_omeda_id_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="audienceuser",
+            name="last_synced_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
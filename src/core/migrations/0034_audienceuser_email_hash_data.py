@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import core.fields
+from django.db import migrations
+
+
+# Hashes the users the backfill_email_hashes command has not hashed yet, so
+# that every user with an email has its hash once migrated; running the
+# command beforehand keeps this migration's transaction short.
+
+BATCH_SIZE = 5000
+
+
+def hash_emails(apps, schema_editor):
+    AudienceUser = apps.get_model("core", "AudienceUser")
+    pending = AudienceUser.objects.filter(
+        email__isnull=False, email_hash__isnull=True
+    ).order_by("pk")
+    last_pk = 0
+    with schema_editor.connection.cursor() as cursor:
+        while True:
+            users = list(
+                pending.filter(pk__gt=last_pk).values_list("pk", "email")[:BATCH_SIZE]
+            )
+            if not users:
+                break
+            cursor.execute(
+                "UPDATE core_audienceuser u SET email_hash = v.hash "
+                "FROM (VALUES {}) AS v (id, hash) WHERE u.id = v.id".format(
+                    ", ".join(["(%s::integer, %s)"] * len(users))
+                ),
+                [
+                    value
+                    for pk, email in users
+                    for value in (pk, core.fields.hash_email(email))
+                ],
+            )
+            last_pk = users[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0033_audienceuser_last_synced_at"),
+    ]
+
+    operations = [
+        migrations.RunPython(hash_emails, migrations.RunPython.noop),
+    ]
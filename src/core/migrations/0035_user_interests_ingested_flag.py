@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-19 18:56
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+# User interests used to be ingested up to an id position, guessing from the
+# rows' timestamps which ids had committed; rows whose transaction committed
+# late were skipped for good. Each history row now carries whether it has
+# been ingested. The column is added as true, which Postgres >= 11 records
+# without rewriting the table, and only the rows past the old position are
+# then flagged as not ingested.
+
+POSITION_NAME = "user_interest"
+
+PENDING_INDEX = "core_usercontenthistory_interests_pending"
+
+
+def flag_pending_rows(apps, schema_editor):
+    AggregationPosition = apps.get_model("core", "AggregationPosition")
+    UserContentHistory = apps.get_model("core", "UserContentHistory")
+
+    position = AggregationPosition.objects.filter(name=POSITION_NAME).first()
+    UserContentHistory.objects.filter(
+        id__gt=position.position if position else 0
+    ).update(interests_ingested=False)
+
+
+def restore_position(apps, schema_editor):
+    AggregationPosition = apps.get_model("core", "AggregationPosition")
+    UserContentHistory = apps.get_model("core", "UserContentHistory")
+
+    # the position can't skip a row that isn't ingested
+    pending = UserContentHistory.objects.filter(interests_ingested=False)
+    if pending.exists():
+        position = pending.order_by("id").values_list("id", flat=True)[0] - 1
+    else:
+        position = (
+            UserContentHistory.objects.order_by("-id")
+            .values_list("id", flat=True)
+            .first()
+            or 0
+        )
+    AggregationPosition.objects.update_or_create(
+        name=POSITION_NAME, defaults={"position": position}
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0034_audienceuser_email_hash_data"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="usercontenthistory",
+            name="interests_ingested",
+            field=models.BooleanField(default=True),
+        ),
+        migrations.RunPython(flag_pending_rows, restore_position),
+        migrations.AlterField(
+            model_name="usercontenthistory",
+            name="interests_ingested",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunSQL(
+            "CREATE INDEX {} ON core_usercontenthistory (id) "
+            "WHERE NOT interests_ingested".format(PENDING_INDEX),
+            "DROP INDEX {}".format(PENDING_INDEX),
+        ),
+        migrations.DeleteModel(
+            name="AggregationPosition",
+        ),
+    ]
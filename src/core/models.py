@@ -1,13 +1,17 @@
 import copy
 import datetime
-import hashlib
-from collections import defaultdict
+import gzip
+import json
+from collections import OrderedDict, defaultdict
 
 from django.conf import settings
 from django.contrib.postgres.fields import ArrayField, JSONField
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.core.files.base import ContentFile
+from django.db import connection, models, transaction
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.utils.formats import dateformat
 from django.utils.html import format_html, format_html_join
 from django.utils.safestring import mark_safe
@@ -15,7 +19,8 @@ from django.utils.timezone import localtime
 from django_extensions.db.models import TimeStampedModel
 from sailthru_sync import validators as st_validators
 
-from core import fields
+from core import db, fields
+from core.storage import ExportsStorage
 
 
 # querysets ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -36,6 +41,371 @@ class AudbBaseManager(models.Manager):
         return self.create(**kwargs)
 
 
+class AudienceUserManager(AudbBaseManager):
+    def upsert(self, records, now=None):
+        """
+        Creates or updates, by email, the users in `records` with one
+        INSERT ... ON CONFLICT, then writes what their post_save signals
+        would for the whole batch at once: vars history, new VarKeys and the
+        initial opt-in of new users, plus their new source signups. Sync with
+        Sailthru is left to the caller.
+
+        `records` are dicts of already validated values with unique emails:
+        "vars" are merged into the user's existing vars (with jsonb ||, as
+        the API's updates do), "omeda_id" replaces the user's unless None,
+        and "source_signups" are dicts with a "name" and an optional
+        "timestamp". Returns (email, pk, created, changed) for each record,
+        in the order of `records`, `changed` being whether the user row was
+        written.
+        """
+        if not records:
+            return []
+        now = now or timezone.now()
+        params = []
+        for n, record in enumerate(records):
+            params += [
+                record["email"],
+                fields.hash_email(record["email"]),
+                json.dumps(record.get("vars") or {}),
+                record.get("omeda_id"),
+                n,
+            ]
+        params += [now, now, AudienceUser.OPTOUT_NONE]
+
+        with connection.cursor() as cursor:
+            # `old` is read from the statement's snapshot, so it holds the
+            # users' vars from before the upsert
+            cursor.execute(
+                """
+                WITH input (email, email_hash, vars, omeda_id, n) AS (
+                    VALUES {values}
+                ),
+                old AS (
+                    SELECT u.id, u.email, u.vars FROM core_audienceuser u
+                    JOIN input ON input.email = u.email
+                    FOR UPDATE OF u
+                ),
+                upserted AS (
+                    INSERT INTO core_audienceuser AS u (
+                        email, email_hash, vars, omeda_id, created, modified,
+                        sailthru_optout
+                    )
+                    SELECT email, email_hash, vars, omeda_id, %s, %s, %s
+                    FROM input
+                    ON CONFLICT (email) DO UPDATE SET
+                        vars = u.vars || excluded.vars,
+                        omeda_id = coalesce(excluded.omeda_id, u.omeda_id),
+                        modified = excluded.modified
+                    WHERE u.vars || excluded.vars <> u.vars
+                        OR excluded.omeda_id <> coalesce(u.omeda_id, '')
+                    RETURNING u.id, u.email, u.vars, xmax = 0 AS created
+                )
+                SELECT input.email, coalesce(upserted.id, old.id),
+                    coalesce(upserted.created, false), upserted.id IS NOT NULL,
+                    coalesce(upserted.vars <> old.vars, upserted.id IS NOT NULL),
+                    upserted.vars
+                FROM input
+                LEFT JOIN old ON old.email = input.email
+                LEFT JOIN upserted ON upserted.email = input.email
+                ORDER BY input.n
+                """.format(
+                    values=", ".join(
+                        ["(%s, %s, %s::jsonb, %s, %s::integer)"] * len(records)
+                    )
+                ),
+                params,
+            )
+            rows = cursor.fetchall()
+
+        UserVarsHistory.objects.bulk_create(
+            UserVarsHistory(audience_user_id=pk, vars=vars)
+            for _, pk, created, _, vars_changed, vars in rows
+            if created or vars_changed
+        )
+        OptoutHistory.objects.bulk_create(
+            OptoutHistory(
+                audience_user_id=pk,
+                sailthru_optout=AudienceUser.OPTOUT_NONE,
+                comment="Initial opt in for new user",
+                effective_date=now,
+            )
+            for _, pk, created, _, _, _ in rows
+            if created
+        )
+        VarKey.objects.register(
+            key for record in records for key in (record.get("vars") or {})
+        )
+        pks = {email: pk for email, pk, _, _, _, _ in rows}
+        UserSource.objects.add_signups(
+            (pks[record["email"]], signup)
+            for record in records
+            for signup in record.get("source_signups") or ()
+        )
+        return [row[:4] for row in rows]
+
+    def find_by_email(self, emails):
+        """
+        Maps those of `emails` that belong to a user to the user's
+        (pk, sailthru_id), with one query however many emails there are.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT email, id, sailthru_id FROM core_audienceuser "
+                "WHERE email = ANY(%s::varchar[])",
+                [list(emails)],
+            )
+            return {email: (pk, sid) for email, pk, sid in cursor.fetchall()}
+
+    def change_emails(self, pairs):
+        """
+        Changes the email of the users with the old email of each (old, new)
+        pair, and their email hash, with one UPDATE; returns their pks.
+        """
+        pairs = list(pairs)
+        if not pairs:
+            return []
+        params = [
+            value for old, new in pairs for value in (old, new, fields.hash_email(new))
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE core_audienceuser u "
+                "SET email = v.new, email_hash = v.hash, modified = %s "
+                "FROM (VALUES {}) AS v (old, new, hash) "
+                "WHERE u.email = v.old RETURNING u.id".format(
+                    ", ".join(["(%s, %s, %s)"] * len(pairs))
+                ),
+                [timezone.now()] + params,
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def hash_emails(self, pks):
+        """
+        Sets the email_hash of the users of `pks` that have an email but no
+        hash yet, with one UPDATE; returns how many were hashed.
+        """
+        users = list(
+            self.filter(
+                pk__in=pks, email__isnull=False, email_hash__isnull=True
+            ).values_list("pk", "email")
+        )
+        if not users:
+            return 0
+        params = [
+            value for pk, email in users for value in (pk, fields.hash_email(email))
+        ]
+        # unlike save(), leaves `modified` and the sync signals alone
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE core_audienceuser u SET email_hash = v.hash "
+                "FROM (VALUES {}) AS v (id, hash) "
+                "WHERE u.id = v.id AND u.email_hash IS NULL".format(
+                    ", ".join(["(%s::integer, %s)"] * len(users))
+                ),
+                params,
+            )
+            return cursor.rowcount
+
+    def record_syncs(self, syncs):
+        """
+        Writes back the (pk, sailthru_id, synced_at) of users synced with
+        Sailthru with one UPDATE: the Sailthru ID of the users without one,
+        and when they were last synced. Returns the pks of those whose
+        Sailthru ID differed, mapped to their (existing, reported) IDs.
+        """
+        syncs = list(syncs)
+        if not syncs:
+            return {}
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE core_audienceuser u "
+                "SET sailthru_id = coalesce(u.sailthru_id, v.sid), "
+                "last_synced_at = greatest(u.last_synced_at, v.synced_at) "
+                "FROM (VALUES {}) AS v (id, sid, synced_at), core_audienceuser old "
+                "WHERE u.id = v.id AND old.id = v.id "
+                "RETURNING u.id, old.sailthru_id, v.sid".format(
+                    ", ".join(
+                        ["(%s::integer, %s::varchar, %s::timestamptz)"] * len(syncs)
+                    )
+                ),
+                [value for sync in syncs for value in sync],
+            )
+            return {
+                pk: (old, sid)
+                for pk, old, sid in cursor.fetchall()
+                if old is not None and old != sid
+            }
+
+    def reset_sailthru_optouts(self, pks):
+        """
+        reset_sailthru_optout() for many users at once: caches the latest
+        optout status of each of the users with `pks` with one UPDATE, and
+        returns (pk, sailthru_optout) for those whose status changed. Nothing
+        else that method does (saving, unsubscribing) is done here.
+        """
+        pks = list(pks)
+        if not pks:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE core_audienceuser u SET sailthru_optout = latest.sailthru_optout
+                FROM (
+                    SELECT DISTINCT ON (audience_user_id)
+                        audience_user_id, sailthru_optout
+                    FROM core_optouthistory
+                    WHERE audience_user_id = ANY(%s::integer[])
+                    ORDER BY audience_user_id, effective_date DESC, id DESC
+                ) latest
+                WHERE u.id = latest.audience_user_id
+                    AND u.sailthru_optout IS DISTINCT FROM latest.sailthru_optout
+                RETURNING u.id, u.sailthru_optout
+                """,
+                [pks],
+            )
+            return cursor.fetchall()
+
+    def delete_many(self, pks, count_only=False):
+        """
+        Deletes the users with `pks` and all their data with one DELETE per
+        table (see core.db.cascade_delete), taking their subscriptions off
+        the lists' subscriber counts; returns the rows deleted per model.
+        Content views and interests are kept by email rather than by user,
+        so those of the users' emails are deleted too. With `count_only`
+        nothing is deleted, the rows are only counted.
+        """
+        pks = list(pks)
+        if not pks:
+            return {}
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT email FROM core_audienceuser "
+                    "WHERE id = ANY(%s::integer[]) AND email IS NOT NULL",
+                    [pks],
+                )
+                emails = [row[0] for row in cursor.fetchall()]
+                by_email = OrderedDict()
+                for model in (UserContentHistory, UserContentRollup, UserInterest):
+                    cursor.execute(
+                        "{} FROM {} WHERE email = ANY(%s::varchar[])".format(
+                            "SELECT count(*)" if count_only else "DELETE",
+                            model._meta.db_table,
+                        ),
+                        [emails],
+                    )
+                    by_email[model._meta.label] = (
+                        cursor.fetchone()[0] if count_only else cursor.rowcount
+                    )
+            if not count_only:
+                # what count_deleted_subscription would do one at a time
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        """
+                        UPDATE core_listsubscribercount c SET
+                            active = c.active - d.active,
+                            inactive = c.inactive - d.inactive,
+                            modified = %s
+                        FROM (
+                            SELECT list_id,
+                                count(*) FILTER (WHERE active) AS active,
+                                count(*) FILTER (WHERE NOT active) AS inactive
+                            FROM core_subscription
+                            WHERE audience_user_id = ANY(%s::integer[])
+                            GROUP BY list_id
+                        ) d
+                        WHERE c.list_id = d.list_id
+                        """,
+                        [timezone.now(), pks],
+                    )
+            counts = db.cascade_delete(AudienceUser, pks, count_only=count_only)
+        counts.update(by_email)
+        return counts
+
+
+class UserSourceManager(AudbBaseManager):
+    def add_signups(self, signups):
+        """
+        Inserts (user pk, {"name", "timestamp"}) source signups with one
+        query; those without a timestamp are stamped now.
+        """
+        signups = list(signups)
+        if not signups:
+            return
+        now = timezone.now()
+        params = []
+        for pk, signup in signups:
+            params += [pk, signup["name"], signup.get("timestamp") or now]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO core_usersource (audience_user_id, name, timestamp) "
+                "VALUES {}".format(", ".join(["(%s, %s, %s)"] * len(signups))),
+                params,
+            )
+
+
+class OptoutHistoryManager(AudbBaseManager):
+    def set_initial_optins(self, optins, comment):
+        """
+        Records that each (user pk, effective date) of `optins` opted in
+        ("none") at that date, with one query: the user's existing entry
+        with `comment` is moved to the date, or one is added. Returns the
+        numbers of entries (added, moved). Cached optout statuses are left
+        to AudienceUser.objects.reset_sailthru_optouts().
+        """
+        optins = list(optins)
+        if not optins:
+            return 0, 0
+        params = [value for optin in optins for value in optin]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                WITH input (user_id, effective_date) AS (VALUES {values}),
+                moved AS (
+                    UPDATE core_optouthistory h
+                    SET effective_date = input.effective_date
+                    FROM input
+                    WHERE h.audience_user_id = input.user_id
+                        AND h.sailthru_optout = %s AND h.comment = %s
+                    RETURNING h.audience_user_id
+                ),
+                added AS (
+                    INSERT INTO core_optouthistory (
+                        audience_user_id, sailthru_optout, comment,
+                        created_date, effective_date
+                    )
+                    SELECT user_id, %s, %s, %s, effective_date FROM input
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM moved WHERE moved.audience_user_id = input.user_id
+                    )
+                    RETURNING id
+                )
+                SELECT (SELECT count(*) FROM added), (SELECT count(*) FROM moved)
+                """.format(
+                    values=", ".join(["(%s::integer, %s::timestamptz)"] * len(optins))
+                ),
+                params
+                + [AudienceUser.OPTOUT_NONE, comment]
+                + [AudienceUser.OPTOUT_NONE, comment, timezone.now()],
+            )
+            return cursor.fetchone()
+
+
+class VarKeyManager(AudbBaseManager):
+    def register(self, keys):
+        """Adds the `keys` that are not VarKeys yet, as "other" vars."""
+        keys = sorted({key.strip() for key in keys})
+        if not keys:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO core_varkey (key, type, sync_with_sailthru) "
+                "SELECT unnest(%s::varchar[]), 'other', true "
+                "ON CONFLICT (key) DO NOTHING",
+                [keys],
+            )
+
+
 class EmailChangeAudienceUserManager(AudbBaseManager):
     def get_queryset(self, *args, **kwargs):
         qs = super().get_queryset(*args, **kwargs)
@@ -50,9 +420,377 @@ class SubscriptionManager(AudbBaseManager):
             subscription.unsubscribe(comment)
 
 
+class ListSubscriberCountManager(models.Manager):
+    def adjust(self, list_id, active=0, inactive=0):
+        """
+        Moves a list's counters by the given deltas in a single UPDATE, so
+        concurrent subscription writes never lose each other's changes.
+        Lists without counters yet are left to `reconcile()`.
+        """
+        self.filter(list_id=list_id).update(
+            active=models.F("active") + active,
+            inactive=models.F("inactive") + inactive,
+            modified=timezone.now(),
+        )
+
+    def reconcile(self, list_ids=None):
+        """
+        Recounts the subscriptions of the given lists (all lists by default)
+        and overwrites their counters, creating any that are missing. Returns
+        the counters that had drifted, as {list_id: (old, new)} pairs of
+        (active, inactive).
+
+        The counters are locked before counting, so an `adjust()` racing the
+        recount waits for it and then applies its delta to the new value
+        instead of being overwritten.
+        """
+        ids = None if list_ids is None else list(list_ids)
+        now = timezone.now()
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO {table} "
+                "(list_id, active, inactive, modified, reconciled) "
+                "SELECT id, 0, 0, %s, %s FROM {lists} "
+                "WHERE %s::integer[] IS NULL OR id = ANY(%s::integer[]) "
+                "ON CONFLICT (list_id) DO NOTHING "
+                "RETURNING list_id".format(
+                    table=self.model._meta.db_table, lists=List._meta.db_table
+                ),
+                [now, now, ids, ids],
+            )
+            created = {row[0] for row in cursor.fetchall()}
+
+            counters = self.select_for_update().order_by("list_id")
+            subscriptions = Subscription.objects.all()
+            if ids is not None:
+                counters = counters.filter(list_id__in=ids)
+                subscriptions = subscriptions.filter(list_id__in=ids)
+            counters = list(counters)
+
+            counts = defaultdict(lambda: [0, 0])
+            for row in (
+                subscriptions.values("list_id", "active")
+                .annotate(n=models.Count("id"))
+                .order_by()
+            ):
+                counts[row["list_id"]][0 if row["active"] else 1] = row["n"]
+
+            drifted = {}
+            for counter in counters:
+                active, inactive = counts[counter.list_id]
+                old = (counter.active, counter.inactive)
+                if counter.list_id not in created and old != (active, inactive):
+                    drifted[counter.list_id] = (old, (active, inactive))
+                self.filter(list_id=counter.list_id).update(
+                    active=active, inactive=inactive, reconciled=now, modified=now
+                )
+        return drifted
+
+    def for_list(self, list_obj):
+        try:
+            return self.get(list=list_obj)
+        except self.model.DoesNotExist:
+            # reconcile() creates the counter with ON CONFLICT, so concurrent
+            # callers for the same list don't trip over each other.
+            self.reconcile(list_ids=[list_obj.pk])
+            return self.get(list=list_obj)
+
+
+class ListSubscriberCountHistoryManager(models.Manager):
+    def record(self, date=None):
+        """Snapshots every list's current counters as the counts for `date`."""
+        date = date or localtime(timezone.now()).date()
+        for counter in ListSubscriberCount.objects.all():
+            self.update_or_create(
+                list_id=counter.list_id,
+                date=date,
+                defaults={"active": counter.active, "inactive": counter.inactive},
+            )
+
+
 # models ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 
+class AthenaContentMetadataManager(AudbBaseManager):
+    def upsert(self, records):
+        """
+        Inserts or updates, by athena_content_id, the metadata in `records`
+        (dicts of already validated values by field attname, so the type is
+        "athena_content_type_id") with one INSERT ... ON CONFLICT per set of
+        fields the records have. New rows get the default of the fields
+        their record leaves out, while existing rows keep them, as with a
+        POST. The ids in `records` must be unique. Returns the number of
+        rows created and the number updated.
+        """
+        groups = OrderedDict()
+        for record in records:
+            groups.setdefault(frozenset(record), []).append(record)
+        created = sum(self._upsert(group, keys) for keys, group in groups.items())
+        return created, len(records) - created
+
+    def _upsert(self, records, keys):
+        """Upserts `records`, all with the fields `keys`; returns the created."""
+        fields = [
+            field for field in self.model._meta.concrete_fields if not field.primary_key
+        ]
+        columns = ", ".join('"{}"'.format(field.column) for field in fields)
+        placeholders = "({})".format(", ".join(["%s"] * len(fields)))
+        updates = ", ".join(
+            '"{0}" = excluded."{0}"'.format(field.column)
+            for field in fields
+            if field.attname in keys and field.name != "athena_content_id"
+        )
+
+        params = []
+        for record in records:
+            for field in fields:
+                if field.attname in record:
+                    value = record[field.attname]
+                else:
+                    value = field.get_default()
+                params.append(field.get_db_prep_save(value, connection))
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO {table} ({columns}) VALUES {values} "
+                "ON CONFLICT (athena_content_id) DO UPDATE SET {updates} "
+                # xmax is only set on rows that already existed
+                "RETURNING xmax = 0".format(
+                    table=self.model._meta.db_table,
+                    columns=columns,
+                    values=", ".join([placeholders] * len(records)),
+                    updates=updates or "athena_content_id = excluded.athena_content_id",
+                ),
+                params,
+            )
+            return sum(1 for (inserted,) in cursor.fetchall() if inserted)
+
+
+class UserContentHistoryManager(AudbBaseManager):
+    # the columns of a rolled-up event written to its archive file
+    archive_fields = (
+        "id",
+        "email",
+        "athena_content_metadata_id",
+        "timestamp",
+        "referrer",
+    )
+
+    archive_storage = ExportsStorage()
+
+    def compact(self, before, batch_size=5000, archive=True):
+        """
+        Rolls the events from before `before` up into UserContentRollup,
+        oldest first in batches of `batch_size`, and deletes them. Events
+        not yet added to the user interests are left for a later run. With
+        `archive` each batch is first written to a gzipped NDJSON file in the
+        exports storage. Returns the number of events compacted.
+        """
+        compacted = 0
+        while True:
+            with transaction.atomic():
+                ids = list(
+                    self.filter(timestamp__lt=before, interests_ingested=True)
+                    .order_by("id")
+                    .values_list("id", flat=True)[:batch_size]
+                )
+                if not ids:
+                    return compacted
+                if archive:
+                    self.archive(ids)
+                UserContentRollup.objects.add_events(ids)
+                self.filter(id__in=ids).delete()
+            compacted += len(ids)
+
+    def archive(self, ids):
+        """Writes the events `ids` to an archive file; returns its name."""
+        events = (
+            self.filter(id__in=ids).order_by("id").values_list(*self.archive_fields)
+        )
+        lines = []
+        for event in events:
+            event = dict(zip(self.archive_fields, event))
+            event["timestamp"] = event["timestamp"].isoformat()
+            lines.append(json.dumps(event, sort_keys=True))
+        content = gzip.compress(("\n".join(lines) + "\n").encode("utf-8"))
+
+        # named by id range, so a batch that is retried overwrites its file
+        storage = self.archive_storage
+        name = "user_content_history/{:%Y/%m}/{}-{}.ndjson.gz".format(
+            timezone.now(), ids[0], ids[-1]
+        )
+        if storage.exists(name):
+            storage.delete(name)
+        return storage.save(name, ContentFile(content))
+
+
+class UserContentRollupManager(models.Manager):
+    def add_events(self, ids):
+        """
+        Folds the UserContentHistory events `ids` into the rollups of their
+        (email, content) pairs with one upsert.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO core_usercontentrollup AS rollup (
+                    email, athena_content_metadata_id, first_seen, last_seen,
+                    count, last_referrer
+                )
+                SELECT email, athena_content_metadata_id, min("timestamp"),
+                    max("timestamp"), count(*),
+                    (array_agg(referrer ORDER BY "timestamp" DESC, id DESC))[1]
+                FROM core_usercontenthistory
+                WHERE id = ANY(%s)
+                GROUP BY email, athena_content_metadata_id
+                ON CONFLICT (email, athena_content_metadata_id) DO UPDATE SET
+                    first_seen = least(rollup.first_seen, excluded.first_seen),
+                    last_seen = greatest(rollup.last_seen, excluded.last_seen),
+                    count = rollup.count + excluded.count,
+                    last_referrer = CASE
+                        WHEN excluded.last_seen >= rollup.last_seen
+                        THEN excluded.last_referrer
+                        ELSE rollup.last_referrer
+                    END
+                """,
+                [list(ids)],
+            )
+
+
+class UserInterestManager(models.Manager):
+    # Scores are forward-decayed (see UserInterest): a view at time t weighs
+    # 2 ** ((t - score_epoch) / half-life), kept as its log2 so the weights
+    # of recent views never overflow.
+    score_epoch = datetime.datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+    def half_life(self):
+        return datetime.timedelta(days=settings.USER_INTEREST_HALF_LIFE_DAYS)
+
+    def decay(self, score, now=None):
+        """The weight of a `score`, decayed to `now`."""
+        elapsed = (now or timezone.now()) - self.score_epoch
+        return 2 ** (score - elapsed.total_seconds() / self.half_life().total_seconds())
+
+    def ingest(self, batch_size=10000):
+        """
+        Folds the user content history rows not ingested yet into the
+        interest scores of their emails, `batch_size` rows per transaction,
+        and flags them ingested. A row is only seen once its transaction has
+        committed, however late that is, and runs that overlap skip each
+        other's rows. Returns the number of history rows ingested.
+        """
+        ingested = 0
+        while True:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    """
+                    WITH batch AS (
+                        SELECT id FROM core_usercontenthistory
+                        WHERE NOT interests_ingested
+                        ORDER BY id LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    UPDATE core_usercontenthistory h
+                    SET interests_ingested = true
+                    FROM batch WHERE h.id = batch.id
+                    RETURNING h.id
+                    """,
+                    [batch_size],
+                )
+                ids = [row[0] for row in cursor.fetchall()]
+                if not ids:
+                    return ingested
+                self.add_views(ids)
+            ingested += len(ids)
+
+    def add_views(self, ids):
+        """
+        Adds the history rows `ids` to the scores of the topics, keywords,
+        interests, authors and categories of the content they viewed, with
+        one upsert.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                WITH views AS (
+                    SELECT h.email, t.kind, left(t.value, 255) AS value,
+                        extract(epoch FROM h."timestamp" - %(epoch)s)
+                            / %(half_life)s AS score
+                    FROM core_usercontenthistory h
+                    JOIN core_athenacontentmetadata c
+                        ON c.athena_content_id = h.athena_content_metadata_id
+                    CROSS JOIN LATERAL (
+                        SELECT 'topic', unnest(c.topics)
+                        UNION ALL SELECT 'keyword', unnest(c.keywords)
+                        UNION ALL SELECT 'interest', unnest(c.interests)
+                        UNION ALL SELECT 'author', unnest(c.authors)
+                        UNION ALL SELECT 'category', c.categories ->> 'primary'
+                        UNION ALL SELECT 'category', jsonb_array_elements_text(
+                            CASE jsonb_typeof(c.categories -> 'secondary')
+                                WHEN 'array' THEN c.categories -> 'secondary'
+                                ELSE '[]'::jsonb
+                            END
+                        )
+                    ) AS t(kind, value)
+                    WHERE h.id = ANY(%(ids)s)
+                        AND coalesce(t.value, '') <> ''
+                ), ranked AS (
+                    SELECT *, max(score) OVER (PARTITION BY email, kind, value) AS top
+                    FROM views
+                )
+                INSERT INTO core_userinterest AS interest
+                    (email, kind, value, score, updated)
+                SELECT email, kind, value,
+                    top + ln(sum(power(2, greatest(score - top, -60)))) / ln(2),
+                    now()
+                FROM ranked
+                GROUP BY email, kind, value, top
+                -- the same lock order as any concurrent ingest
+                ORDER BY email, kind, value
+                ON CONFLICT (email, kind, value) DO UPDATE SET
+                    score = greatest(interest.score, excluded.score) + ln(
+                        1 + power(2, -least(abs(interest.score - excluded.score), 60))
+                    ) / ln(2),
+                    updated = excluded.updated
+                """,
+                {
+                    "epoch": self.score_epoch,
+                    "half_life": self.half_life().total_seconds(),
+                    "ids": list(ids),
+                },
+            )
+
+    def top(self, email, limit, kind=None):
+        """An email's `limit` highest scoring interests, of `kind` if given."""
+        interests = self.filter(email=email)
+        if kind is not None:
+            interests = interests.filter(kind=kind)
+        return interests.order_by("-score")[:limit]
+
+    def top_by_kind(self, emails, limit):
+        """
+        The (email, kind, value) of the `limit` highest scoring interests of
+        each kind of each of `emails`, by email then descending score. They
+        are ranked in SQL, so an email's other interests are never loaded.
+        """
+        emails = list(emails)
+        if not emails or limit <= 0:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT email, kind, value FROM ("
+                "SELECT email, kind, value, score, id, row_number() OVER ("
+                "PARTITION BY email, kind ORDER BY score DESC, id) AS rank "
+                "FROM {table} WHERE email = ANY(%s::varchar[])"
+                ") ranked WHERE rank <= %s "
+                "ORDER BY email, score DESC, id".format(
+                    table=self.model._meta.db_table
+                ),
+                [emails, limit],
+            )
+            return cursor.fetchall()
+
+
 class AbstractValidationModel(models.Model):
 
     objects = AudbBaseManager()
@@ -160,7 +898,7 @@ class List(TimeStampedModel, AbstractValidationModel):
     def stats(self):
         return '<a href="/core/list/{}/stats/">User Stats</a>'.format(
             self.pk
-        ) + ' | <a href="/core/subscriptionlog/?list_id={}">Subscription Log</a>'.format(
+        ) + ' | <a href="/core/subscriptionlog/browse/?list_id={}">Subscription Log</a>'.format(
             self.pk
         )
 
@@ -232,6 +970,8 @@ class AudienceUser(TimeStampedModel, AbstractValidationModel):
         ordering = ["email"]
         verbose_name = "User"
 
+    objects = AudienceUserManager()
+
     email = fields.NormalizedEmailField(
         max_length=500,
         unique=True,
@@ -241,7 +981,7 @@ class AudienceUser(TimeStampedModel, AbstractValidationModel):
     )
 
     omeda_id = models.CharField(
-        max_length=255, null=True, blank=True, verbose_name="Omeda ID"
+        max_length=255, null=True, blank=True, verbose_name="Omeda ID", db_index=True
     )
 
     sailthru_id = models.CharField(
@@ -260,6 +1000,16 @@ class AudienceUser(TimeStampedModel, AbstractValidationModel):
         ],
     )
 
+    # when the user was last synced with Sailthru; see record_syncs()
+    last_synced_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    # md5 of the email, which is how partners identify users; set by save()
+    email_hash = models.CharField(
+        max_length=32, null=True, blank=True, editable=False, db_index=True
+    )
+
+    hash_email = staticmethod(fields.hash_email)
+
     def save(self, *args, **kwargs):
         is_new = self.pk is None
 
@@ -270,6 +1020,10 @@ class AudienceUser(TimeStampedModel, AbstractValidationModel):
             self.email = None
         if self.vars is None:
             self.vars = {}
+        self.email_hash = self.hash_email(self.email)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "email" in update_fields:
+            kwargs["update_fields"] = set(update_fields) | {"email_hash"}
         super(AudienceUser, self).save(*args, **kwargs)
 
         if is_new:
@@ -385,14 +1139,6 @@ class AudienceUser(TimeStampedModel, AbstractValidationModel):
                 self, comment="unsubscribe triggered by sailthru optout (all/basic)"
             )
 
-    @property
-    def email_hash(self):
-        if not self.email:
-            return None
-        hasher = hashlib.md5()
-        hasher.update(self.email.encode("utf-8"))
-        return hasher.hexdigest()
-
     def admin_view_created_date(self):
         # this is a work-around b/c Django admin does not want to display
         # fields with auto_now / auto_now_add
@@ -455,6 +1201,8 @@ class UserSource(AbstractValidationModel):
     class Meta:
         ordering = ["-timestamp"]
 
+    objects = UserSourceManager()
+
     audience_user = models.ForeignKey(
         AudienceUser,
         on_delete=models.CASCADE,
@@ -476,6 +1224,8 @@ class OptoutHistory(AbstractValidationModel):
     class Meta:
         ordering = ["-effective_date"]
 
+    objects = OptoutHistoryManager()
+
     audience_user = models.ForeignKey(
         AudienceUser,
         on_delete=models.CASCADE,
@@ -504,6 +1254,8 @@ class OptoutHistory(AbstractValidationModel):
 class UserVarsHistory(AbstractValidationModel):
     class Meta:
         ordering = ["-timestamp"]
+        # a user's latest snapshots are read newest-first
+        index_together = (("audience_user", "timestamp"),)
 
     audience_user = models.ForeignKey(
         AudienceUser, on_delete=models.CASCADE, null=False, related_name="vars_history"
@@ -522,6 +1274,8 @@ class VarKey(AbstractValidationModel):
         ]
         verbose_name = "Var"
 
+    objects = VarKeyManager()
+
     VARKEY_TYPE_CHOICES = (
         ("official", "Official"),
         ("other", "Other"),
@@ -582,6 +1336,14 @@ class Subscription(TimeStampedModel, AbstractValidationModel):
         "otherwise be used when creating the on-save SubscriptionLog entry",
     )
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # the list subscriber counters need to know whether a save flips `active`
+        if "active" in field_names:
+            instance._loaded_active = values[field_names.index("active")]
+        return instance
+
     def subscription_log_html(self):
         return format_html_join(
             mark_safe("<br/>"), "{}", ((str(x),) for x in self.log.all())
@@ -638,6 +1400,14 @@ class Subscription(TimeStampedModel, AbstractValidationModel):
 
 
 class SubscriptionLog(AbstractValidationModel):
+    class Meta:
+        # a list's log is browsed newest-first, keyset-paginated on (timestamp, id)
+        index_together = (("list", "timestamp", "id"),)
+
+    # The table is partitioned by month on timestamp (see core.partitions),
+    # with (id, timestamp) as its primary key in the database while the
+    # model (and the migration state) keep `id`; migrations that change the
+    # key have to be written by hand (see migration 0027).
 
     SUBSCRIPTION_ACTION_CHOICES = (
         ("subscribe", "subscribe"),
@@ -661,6 +1431,17 @@ class SubscriptionLog(AbstractValidationModel):
         db_index=True,
     )
 
+    # denormalized from the subscription so a list's log is read without
+    # joining through every subscription to the list
+    list = models.ForeignKey(
+        List,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="+",
+        db_index=False,  # covered by the index_together
+    )
+
     comment = models.TextField(
         blank=True, null=True, help_text="Explanatory supporting text."
     )
@@ -669,6 +1450,11 @@ class SubscriptionLog(AbstractValidationModel):
         auto_now_add=True, null=False, unique=False, db_index=True
     )
 
+    def save(self, *args, **kwargs):
+        if self.list_id is None and self.subscription_id is not None:
+            self.list_id = self.subscription.list_id
+        super().save(*args, **kwargs)
+
     def __str__(self):
         if self.action and self.subscription and self.timestamp:
             comment = " / {}".format(self.comment) if self.comment else ""
@@ -681,6 +1467,170 @@ class SubscriptionLog(AbstractValidationModel):
         return ""
 
 
+class SubscriptionLogExport(models.Model):
+    """
+    A CSV export of subscription log entries, written to a gzipped file in
+    the background by core.tasks.export_subscription_log.
+
+    `filters` holds what to export: any of "since" and "until" (ISO
+    timestamps), "action", "optout_type" and "ids" (specific log entries),
+    on top of `list`.
+    """
+
+    class Meta:
+        ordering = ["-created"]
+
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = (
+        (STATUS_PENDING, "pending"),
+        (STATUS_RUNNING, "running"),
+        (STATUS_DONE, "done"),
+        (STATUS_FAILED, "failed"),
+    )
+
+    # how long the progress of a running export is kept in the cache
+    PROGRESS_TIMEOUT = 60 * 60 * 24
+
+    list = models.ForeignKey(
+        List, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+
+    filters = JSONField(default=dict, blank=True)
+
+    requested_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+
+    status = models.CharField(
+        max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING, null=False
+    )
+
+    rows = models.IntegerField(default=0, null=False)
+
+    file = models.FileField(
+        storage=ExportsStorage(), upload_to="subscription_log", blank=True
+    )
+
+    error = models.TextField(blank=True)
+
+    created = models.DateTimeField(auto_now_add=True)
+
+    started = models.DateTimeField(null=True, blank=True)
+
+    finished = models.DateTimeField(null=True, blank=True)
+
+    def get_queryset(self):
+        """The log entries to export, newest first."""
+        entries = SubscriptionLog.objects.all()
+        if self.list_id is not None:
+            entries = entries.filter(list_id=self.list_id)
+        if "ids" in self.filters:
+            entries = entries.filter(pk__in=self.filters["ids"])
+        if self.filters.get("since"):
+            entries = entries.filter(
+                timestamp__gte=parse_datetime(self.filters["since"])
+            )
+        if self.filters.get("until"):
+            entries = entries.filter(
+                timestamp__lt=parse_datetime(self.filters["until"])
+            )
+        if self.filters.get("action"):
+            entries = entries.filter(action=self.filters["action"])
+        if self.filters.get("optout_type"):
+            entries = entries.filter(
+                subscription__audience_user__sailthru_optout=self.filters["optout_type"]
+            )
+        return entries.order_by("-timestamp", "-id")
+
+    @property
+    def progress_key(self):
+        return "core:subscription-log-export:{}:progress".format(self.pk)
+
+    def report_progress(self, rows):
+        """Records how many rows a running export has written so far."""
+        cache.set(self.progress_key, rows, self.PROGRESS_TIMEOUT)
+
+    @property
+    def progress(self):
+        """Rows written so far; kept in the cache while the export runs."""
+        if self.status == self.STATUS_RUNNING:
+            return cache.get(self.progress_key) or 0
+        return self.rows
+
+    @property
+    def in_progress(self):
+        return self.status in (self.STATUS_PENDING, self.STATUS_RUNNING)
+
+    def __str__(self):
+        return "Subscription log export {} ({})".format(self.pk, self.status)
+
+
+class ListSubscriberCount(models.Model):
+    """
+    Active and inactive subscription counts of a list, kept up to date by the
+    subscription signal receivers and corrected by a periodic reconciliation
+    (see core.tasks).
+    """
+
+    objects = ListSubscriberCountManager()
+
+    list = models.OneToOneField(
+        List,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="subscriber_count",
+    )
+
+    active = models.IntegerField(default=0, null=False)
+
+    inactive = models.IntegerField(default=0, null=False)
+
+    modified = models.DateTimeField(default=timezone.now, null=False)
+
+    reconciled = models.DateTimeField(
+        null=True, blank=True, help_text="When the counts were last recounted."
+    )
+
+    @property
+    def total(self):
+        return self.active + self.inactive
+
+    def __str__(self):
+        return "{}: {} active / {} inactive".format(
+            self.list_id, self.active, self.inactive
+        )
+
+
+class ListSubscriberCountHistory(models.Model):
+    class Meta:
+        ordering = ["-date"]
+        unique_together = ("list", "date")
+        verbose_name_plural = "List subscriber count history"
+
+    objects = ListSubscriberCountHistoryManager()
+
+    list = models.ForeignKey(
+        List, on_delete=models.CASCADE, related_name="subscriber_count_history"
+    )
+
+    date = models.DateField(null=False)
+
+    active = models.IntegerField(null=False)
+
+    inactive = models.IntegerField(null=False)
+
+    @property
+    def total(self):
+        return self.active + self.inactive
+
+
 class SubscriptionTrigger(AbstractValidationModel):
     class Meta:
         unique_together = ("primary_list", "related_list")
@@ -867,6 +1817,8 @@ class ProductAction(TimeStampedModel, AbstractValidationModel):
     class Meta:
         ordering = ["-timestamp"]
         unique_together = (("audience_user", "product", "type"),)
+        # a user's latest actions are read newest-first
+        index_together = (("audience_user", "timestamp"),)
 
     ACTION_TYPE_CHOICES = (
         ("consumed", "consumed"),
@@ -1007,6 +1959,11 @@ class AthenaContentMetadata(AbstractValidationModel):
     class Meta:
         verbose_name_plural = "Athena Content Metadata"
 
+    # topics, keywords, interests, authors and categories also have GIN
+    # indexes (migration 0030) for the searches of the API
+
+    objects = AthenaContentMetadataManager()
+
     athena_content_id = models.IntegerField(unique=True, null=False, db_index=True)
 
     athena_content_type = models.ForeignKey(
@@ -1022,11 +1979,13 @@ class AthenaContentMetadata(AbstractValidationModel):
         help_text="The date and time the post went live.",
         blank=True,
         null=True,
+        db_index=True,
     )
 
     date_created = models.DateTimeField(
         help_text="This date the original post was created in the govexec database.",
         null=False,
+        db_index=True,
     )
 
     title = models.CharField(max_length=255)
@@ -1041,7 +2000,7 @@ class AthenaContentMetadata(AbstractValidationModel):
         "Canonical URL", max_length=500, blank=True, null=True
     )
 
-    site_name = models.CharField(max_length=25)
+    site_name = models.CharField(max_length=25, db_index=True)
 
     organization = models.SlugField(
         max_length=255,
@@ -1091,9 +2050,17 @@ class AthenaContentMetadata(AbstractValidationModel):
 
 
 class UserContentHistory(AbstractValidationModel):
+    """
+    Content views by email. Views older than
+    settings.USER_CONTENT_HISTORY_RETENTION_DAYS are rolled up into
+    UserContentRollup (see core.tasks.compact_user_content_history).
+    """
+
     class Meta:
         verbose_name_plural = "User Content History"
 
+    objects = UserContentHistoryManager()
+
     email = models.EmailField(max_length=500, null=False, db_index=True)
 
     athena_content_metadata = models.ForeignKey(
@@ -1108,3 +2075,80 @@ class UserContentHistory(AbstractValidationModel):
     timestamp = models.DateTimeField(auto_now_add=True, null=False)
 
     referrer = fields.ReferrerField(blank=True, null=True, max_length=500)
+
+    # set once the view is in the user interests (see UserInterestManager.ingest);
+    # the rows not ingested yet are found through a partial index
+    interests_ingested = models.BooleanField(default=False, null=False)
+
+
+class UserContentRollup(models.Model):
+    """
+    Every compacted view of a piece of content by an email, in aggregate.
+    """
+
+    class Meta:
+        unique_together = ("email", "athena_content_metadata")
+
+    objects = UserContentRollupManager()
+
+    # looked up through the unique_together's index
+    email = models.EmailField(max_length=500, null=False, db_index=False)
+
+    athena_content_metadata = models.ForeignKey(
+        AthenaContentMetadata,
+        to_field="athena_content_id",
+        related_name="user_content_rollups",
+        on_delete=models.DO_NOTHING,
+        null=False,
+        db_index=False,  # covered by the unique_together
+    )
+
+    first_seen = models.DateTimeField(null=False)
+
+    last_seen = models.DateTimeField(null=False)
+
+    count = models.IntegerField(null=False)
+
+    last_referrer = fields.ReferrerField(blank=True, null=True, max_length=500)
+
+
+class UserInterest(models.Model):
+    """
+    How much an email reads about a topic, keyword, interest, author or
+    category, from its user content history (see UserInterestManager.ingest).
+
+    `score` is the log2 of the summed, forward-decayed weight of the views:
+    relative to a fixed epoch, so scores only grow as views arrive and still
+    rank an email's interests by their current decayed weight. The decayed
+    weight itself is `weight()`.
+    """
+
+    class Meta:
+        unique_together = ("email", "kind", "value")
+        index_together = (("email", "score"),)
+
+    KIND_CHOICES = (
+        ("topic", "topic"),
+        ("keyword", "keyword"),
+        ("interest", "interest"),
+        ("author", "author"),
+        ("category", "category"),
+    )
+
+    objects = UserInterestManager()
+
+    email = models.EmailField(max_length=500, null=False, db_index=False)
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, null=False)
+
+    value = models.CharField(max_length=255, null=False)
+
+    score = models.FloatField(null=False)
+
+    updated = models.DateTimeField(null=False)
+
+    def weight(self, now=None):
+        return UserInterest.objects.decay(self.score, now)
+
+    def __str__(self):
+        return "{} {}: {}".format(self.email, self.kind, self.value)
@@ -0,0 +1,256 @@
+"""
+Monthly partitions of the subscription log.
+
+core_subscriptionlog is range-partitioned on "timestamp" (since migration
+0027), so inserts and time-bounded reads only touch the months they need and
+old entries are retired by detaching whole partitions instead of DELETEs.
+The table is made of:
+
+- one partition per calendar month (UTC), core_subscriptionlog_pYYYY_MM,
+  created ahead of time by `ensure_partitions()` (run daily by
+  core.tasks.maintain_subscription_log_partitions and by the
+  subscription_log_partitions command);
+- core_subscriptionlog_legacy, every entry written before the table was
+  partitioned. It is a single partition, from MINVALUE to the month the
+  partitioning started at, so its history can only be retired all at once,
+  once that whole range is older than the retention;
+- core_subscriptionlog_default, which catches entries for a month that has
+  no partition yet. They are moved into their month's partition when it is
+  created.
+"""
+import collections
+import datetime
+import re
+
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+
+TABLE = "core_subscriptionlog"
+DEFAULT_PARTITION = TABLE + "_default"
+PARTITION_NAME = TABLE + "_p{:%Y_%m}"
+
+# months after the current one that should always have a partition
+MONTHS_AHEAD = 3
+
+# `start` and `end` are None for an unbounded side (MINVALUE / MAXVALUE)
+Partition = collections.namedtuple("Partition", ("name", "start", "end"))
+
+# what `prepare_table()` builds for migration 0027, which looks for these names
+UNIQUE_INDEX = TABLE + "_id_timestamp_uniq"
+RANGE_CHECK = TABLE + "_partition_range"
+
+# months, from the current one, that the prepared legacy range covers: the
+# migration has to run before they are over, or new entries break the check
+PREPARED_MONTHS = 2
+
+_BOUNDS = re.compile(r"FOR VALUES FROM \((.+)\) TO \((.+)\)")
+
+
+def month_start(value):
+    """The start (in UTC) of the month `value` falls in."""
+    value = timezone.localtime(value, timezone.utc)
+    return datetime.datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def _parse_bound(value):
+    if value in ("MINVALUE", "MAXVALUE"):
+        return None
+    return parse_datetime(value.strip("'"))
+
+
+def _literal(value):
+    # partition bounds have to be literals; they only ever come from datetimes
+    return "'{}'".format(value.isoformat())
+
+
+def list_partitions(using="default"):
+    """The ranged partitions of the subscription log, oldest first."""
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+            "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass",
+            [TABLE],
+        )
+        rows = cursor.fetchall()
+
+    partitions = []
+    for name, bounds in rows:
+        match = _BOUNDS.match(bounds)
+        if match is None:  # the default partition
+            continue
+        partitions.append(
+            Partition(name, _parse_bound(match.group(1)), _parse_bound(match.group(2)))
+        )
+    epoch = datetime.datetime.min.replace(tzinfo=timezone.utc)
+    return sorted(partitions, key=lambda partition: partition.start or epoch)
+
+
+def _covers(partition, moment):
+    return (partition.start is None or partition.start <= moment) and (
+        partition.end is None or moment < partition.end
+    )
+
+
+def missing_partitions(months_ahead=MONTHS_AHEAD, now=None, using="default"):
+    """The months, from the current one on, that have no partition yet."""
+    current = month_start(now or timezone.now())
+    partitions = list_partitions(using)
+    months = (add_months(current, n) for n in range(months_ahead + 1))
+    return [
+        month
+        for month in months
+        if not any(_covers(partition, month) for partition in partitions)
+    ]
+
+
+def create_partition(month, using="default"):
+    """
+    Creates the partition for the month starting at `month`, moving any of
+    its entries out of the default partition, and returns its name.
+    """
+    name = PARTITION_NAME.format(month)
+    start, end = _literal(month), _literal(add_months(month, 1))
+    with transaction.atomic(using), connections[using].cursor() as cursor:
+        # Postgres refuses a new partition while the default one holds rows
+        # in its range, so set them aside and put them back through the
+        # parent once the partition exists.
+        cursor.execute(
+            "CREATE TEMPORARY TABLE subscriptionlog_moving (LIKE {})".format(TABLE)
+        )
+        cursor.execute(
+            "WITH moved AS ("
+            'DELETE FROM {} WHERE "timestamp" >= {} AND "timestamp" < {} '
+            "RETURNING *"
+            ") INSERT INTO subscriptionlog_moving SELECT * FROM moved".format(
+                DEFAULT_PARTITION, start, end
+            )
+        )
+        cursor.execute(
+            "CREATE TABLE {} PARTITION OF {} FOR VALUES FROM ({}) TO ({})".format(
+                name, TABLE, start, end
+            )
+        )
+        cursor.execute(
+            "INSERT INTO {} SELECT * FROM subscriptionlog_moving".format(TABLE)
+        )
+        cursor.execute("DROP TABLE subscriptionlog_moving")
+    return name
+
+
+def ensure_partitions(months_ahead=MONTHS_AHEAD, now=None, using="default"):
+    """
+    Creates the partitions of the current month and the `months_ahead`
+    following ones where they are missing; returns the names created.
+    """
+    return [
+        create_partition(month, using)
+        for month in missing_partitions(months_ahead, now, using)
+    ]
+
+
+def expired_partitions(before, using="default"):
+    """The partitions that only hold entries from before `before`."""
+    return [
+        partition
+        for partition in list_partitions(using)
+        if partition.end is not None and partition.end <= before
+    ]
+
+
+def retire_partitions(before, archive_schema=None, drop=False, using="default"):
+    """
+    Detaches the partitions that only hold entries from before `before`, so
+    they no longer take part in any query, and returns their names.
+
+    Detached partitions are left as standalone tables; with `archive_schema`
+    they are moved into that schema, and with `drop` they are dropped.
+    """
+    retired = []
+    for partition in expired_partitions(before, using):
+        with transaction.atomic(using), connections[using].cursor() as cursor:
+            cursor.execute(
+                "ALTER TABLE {} DETACH PARTITION {}".format(TABLE, partition.name)
+            )
+            if drop:
+                cursor.execute("DROP TABLE {}".format(partition.name))
+            elif archive_schema:
+                schema = connections[using].ops.quote_name(archive_schema)
+                cursor.execute("CREATE SCHEMA IF NOT EXISTS {}".format(schema))
+                cursor.execute(
+                    "ALTER TABLE {} SET SCHEMA {}".format(partition.name, schema)
+                )
+        retired.append(partition.name)
+    return retired
+
+
+def prepare_table(now=None, using="default"):
+    """
+    Readies the still unpartitioned subscription log for migration 0027
+    without blocking writes, and returns the upper bound of its entries.
+
+    The (id, timestamp) unique index the partitioned table's key needs is
+    built CONCURRENTLY, and a CHECK that every entry is from before the
+    start of the month PREPARED_MONTHS from now is added NOT VALID and then
+    validated, which only takes a lock that lets writes through. The
+    migration then attaches the table as the legacy partition without
+    scanning or indexing it. Runs in autocommit; run it again to move the
+    bound forward.
+    """
+    connection = connections[using]
+    bound = add_months(month_start(now or timezone.now()), PREPARED_MONTHS)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = %s::regclass", [TABLE])
+        if cursor.fetchone()[0] == "p":
+            raise ValueError("{} is already partitioned.".format(TABLE))
+
+        cursor.execute(
+            "SELECT i.indisvalid FROM pg_index i "
+            "WHERE i.indexrelid = to_regclass(%s)",
+            [UNIQUE_INDEX],
+        )
+        row = cursor.fetchone()
+        if row is not None and not row[0]:
+            # left behind by an interrupted concurrent build
+            cursor.execute("DROP INDEX CONCURRENTLY {}".format(UNIQUE_INDEX))
+        if row is None or not row[0]:
+            cursor.execute(
+                "CREATE UNIQUE INDEX CONCURRENTLY {} "
+                'ON {} (id, "timestamp")'.format(UNIQUE_INDEX, TABLE)
+            )
+
+        replaced = RANGE_CHECK + "_old"
+        cursor.execute(
+            "ALTER TABLE {} DROP CONSTRAINT IF EXISTS {}".format(TABLE, replaced)
+        )
+        cursor.execute(
+            "SELECT 1 FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND conname = %s",
+            [TABLE, RANGE_CHECK],
+        )
+        if cursor.fetchone() is not None:
+            cursor.execute(
+                "ALTER TABLE {} RENAME CONSTRAINT {} TO {}".format(
+                    TABLE, RANGE_CHECK, replaced
+                )
+            )
+        cursor.execute(
+            "ALTER TABLE {} ADD CONSTRAINT {} "
+            'CHECK ("timestamp" < {}) NOT VALID'.format(
+                TABLE, RANGE_CHECK, _literal(bound)
+            )
+        )
+        cursor.execute(
+            "ALTER TABLE {} VALIDATE CONSTRAINT {}".format(TABLE, RANGE_CHECK)
+        )
+        cursor.execute(
+            "ALTER TABLE {} DROP CONSTRAINT IF EXISTS {}".format(TABLE, replaced)
+        )
+    return bound
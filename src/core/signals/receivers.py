@@ -1,5 +1,5 @@
 from django.core.exceptions import ValidationError
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.db.utils import IntegrityError
 from django.dispatch import receiver
 
@@ -104,3 +104,57 @@ def triggered_subscribes(sender, **kwargs):
             subscription.audience_user.list_subscribe(
                 related_list, log_comment=comment, log_action="trigger"
             )
+
+
+@receiver(
+    post_save,
+    sender=core_models.List,
+    dispatch_uid="core::signals::create_list_subscriber_count",
+)
+def create_list_subscriber_count(sender, **kwargs):
+    list_obj = kwargs.get("instance")
+    if list_obj and kwargs.get("created") and not kwargs.get("raw"):
+        core_models.ListSubscriberCount.objects.create(list=list_obj)
+
+
+@receiver(
+    post_save,
+    sender=core_models.Subscription,
+    dispatch_uid="core::signals::count_saved_subscription",
+)
+def count_saved_subscription(sender, **kwargs):
+    subscription = kwargs.get("instance")
+    if not subscription or kwargs.get("raw"):
+        return
+
+    counters = core_models.ListSubscriberCount.objects
+    if kwargs.get("created"):
+        if subscription.active:
+            counters.adjust(subscription.list_id, active=1)
+        else:
+            counters.adjust(subscription.list_id, inactive=1)
+    else:
+        # subscriptions that were not loaded from the db have an unknown
+        # previous state; the periodic reconciliation picks up after those
+        previous = getattr(subscription, "_loaded_active", None)
+        if previous is not None and previous != subscription.active:
+            delta = 1 if subscription.active else -1
+            counters.adjust(subscription.list_id, active=delta, inactive=-delta)
+    subscription._loaded_active = subscription.active
+
+
+@receiver(
+    post_delete,
+    sender=core_models.Subscription,
+    dispatch_uid="core::signals::count_deleted_subscription",
+)
+def count_deleted_subscription(sender, **kwargs):
+    subscription = kwargs.get("instance")
+    if not subscription:
+        return  # pragma: no cover
+
+    counters = core_models.ListSubscriberCount.objects
+    if subscription.active:
+        counters.adjust(subscription.list_id, active=-1)
+    else:
+        counters.adjust(subscription.list_id, inactive=-1)
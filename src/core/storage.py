@@ -0,0 +1,21 @@
+"""
+File storages for files the application writes itself.
+"""
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ExportsStorage(FileSystemStorage):
+    """
+    Storage for the files written by background exports, under
+    settings.EXPORTS_ROOT. The files are only ever served through the admin,
+    so they have no public URL: `url()` returns None.
+    """
+
+    def __init__(self, location=None, **kwargs):
+        super().__init__(location=location or settings.EXPORTS_ROOT, **kwargs)
+
+    def url(self, name):
+        return None
@@ -0,0 +1,162 @@
+import csv
+import gzip
+import io
+import datetime
+import tempfile
+
+from audb import celery_app
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
+import sentry_sdk
+
+from . import models as m
+from . import partitions
+from .db import stream_rows
+
+
+logger = get_task_logger(__name__)
+
+
+@celery_app.task
+def reconcile_list_subscriber_counts():
+    """
+    Recounts every list's subscriptions to correct any drift in the
+    incrementally maintained counters, then records the day's counts.
+    """
+    drifted = m.ListSubscriberCount.objects.reconcile()
+    for list_id, (old, new) in drifted.items():
+        logger.warning(
+            "List %s subscriber counts drifted: %s active / %s inactive, "
+            "recounted %s active / %s inactive.",
+            list_id,
+            old[0],
+            old[1],
+            new[0],
+            new[1],
+        )
+    m.ListSubscriberCountHistory.objects.record()
+    logger.info(
+        "Reconciled list subscriber counts; %s list(s) had drifted.", len(drifted)
+    )
+
+
+@celery_app.task
+def maintain_subscription_log_partitions():
+    """
+    Creates the subscription log partitions of the coming months ahead of
+    time, so new entries never land in the default partition.
+    """
+    created = partitions.ensure_partitions()
+    if created:
+        logger.info("Created subscription log partitions: %s.", ", ".join(created))
+
+
+@celery_app.task
+def compact_user_content_history():
+    """
+    Rolls the user content history from before the retention period up into
+    per-email, per-content totals.
+    """
+    before = timezone.now() - datetime.timedelta(
+        days=settings.USER_CONTENT_HISTORY_RETENTION_DAYS
+    )
+    compacted = m.UserContentHistory.objects.compact(
+        before, archive=settings.USER_CONTENT_HISTORY_ARCHIVE
+    )
+    logger.info("Rolled up %s user content history events.", compacted)
+
+
+@celery_app.task
+def ingest_user_interests():
+    """Adds the latest user content history to the users' interest scores."""
+    ingested = m.UserInterest.objects.ingest()
+    if ingested:
+        logger.info("Ingested %s user content history rows into interests.", ingested)
+
+
+# (CSV column, SubscriptionLog lookup) of a subscription log export
+SUBSCRIPTION_LOG_EXPORT_COLUMNS = (
+    ("list_name", "list__name"),
+    ("action", "action"),
+    ("email", "subscription__audience_user__email"),
+    ("optout_type", "subscription__audience_user__sailthru_optout"),
+    ("comment", "comment"),
+    ("timestamp", "timestamp"),
+)
+
+# rows written between progress reports of a running export
+EXPORT_PROGRESS_INTERVAL = 5000
+
+
+def write_subscription_log_csv(export, fileobj):
+    """
+    Writes the log entries selected by `export` to `fileobj` as gzipped CSV,
+    streamed from the database, and returns the number of rows written.
+    """
+    entries = export.get_queryset().values_list(
+        *(lookup for _, lookup in SUBSCRIPTION_LOG_EXPORT_COLUMNS)
+    )
+    timestamp_index = len(SUBSCRIPTION_LOG_EXPORT_COLUMNS) - 1
+
+    rows = 0
+    with gzip.GzipFile(fileobj=fileobj, mode="wb") as compressed:
+        text = io.TextIOWrapper(compressed, encoding="utf-8", newline="")
+        writer = csv.writer(text)
+        writer.writerow([column for column, _ in SUBSCRIPTION_LOG_EXPORT_COLUMNS])
+        for row in stream_rows(entries):
+            row = list(row)
+            row[timestamp_index] = timezone.localtime(row[timestamp_index]).isoformat()
+            writer.writerow(row)
+            rows += 1
+            if rows % EXPORT_PROGRESS_INTERVAL == 0:
+                export.report_progress(rows)
+        text.flush()
+        text.detach()
+    return rows
+
+
+@celery_app.task
+def export_subscription_log(export_pk):
+    """
+    Runs a SubscriptionLogExport: writes its rows to a gzipped CSV file in
+    the exports storage and records the outcome on the export.
+    """
+    export = m.SubscriptionLogExport.objects.get(pk=export_pk)
+    if export.status != m.SubscriptionLogExport.STATUS_PENDING:
+        logger.warning(
+            "Subscription log export %s already %s.", export.pk, export.status
+        )
+        return
+
+    export.status = m.SubscriptionLogExport.STATUS_RUNNING
+    export.started = timezone.now()
+    export.save(update_fields=["status", "started"])
+    export.report_progress(0)
+
+    try:
+        with tempfile.TemporaryFile() as fileobj:
+            rows = write_subscription_log_csv(export, fileobj)
+            fileobj.seek(0)
+            export.file.save(
+                "subscription-log-{}-{}.csv.gz".format(
+                    export.list.slug if export.list else "all", export.pk
+                ),
+                File(fileobj),
+                save=False,
+            )
+    except Exception as e:
+        sentry_sdk.capture_exception(e)
+        logger.exception("Subscription log export %s failed.", export.pk)
+        export.status = m.SubscriptionLogExport.STATUS_FAILED
+        export.error = str(e)
+        export.finished = timezone.now()
+        export.save(update_fields=["status", "error", "finished"])
+        return
+
+    export.status = m.SubscriptionLogExport.STATUS_DONE
+    export.rows = rows
+    export.finished = timezone.now()
+    export.save(update_fields=["status", "rows", "file", "finished"])
+    logger.info("Subscription log export %s wrote %s rows.", export.pk, rows)
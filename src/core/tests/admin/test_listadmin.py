@@ -80,3 +80,34 @@ class ListAdminTest(test.TestCase):
 
         fields = self.admin.get_readonly_fields(request, list_)
         self.assertIn("zephyr_optout_code", fields)
+
+
+@test.override_settings(SAILTHRU_SYNC_SIGNALS_ENABLED=False, RAVEN_CONFIG={"dsn": None})
+class ListAdminStatsTest(test.TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+
+        self.user = User.objects.create_superuser("admin", "admin@example.com", "pw")
+        self.client.force_login(self.user)
+        self.list = mommy.make("core.List", slug="foo", type="list")
+        for n in range(3):
+            user = mommy.make("core.AudienceUser", email="{}@example.com".format(n))
+            user.list_subscribe("foo")
+        user.list_unsubscribe("foo")
+
+    def test_stats_view_reads_counters(self):
+        core_models.ListSubscriberCountHistory.objects.record()
+        response = self.client.get("/core/list/{}/stats/".format(self.list.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["list_users_active"], 2)
+        self.assertEqual(response.context["list_users_inactive"], 1)
+        self.assertEqual(response.context["list_users_total"], 3)
+        self.assertEqual(len(response.context["history"]), 1)
+
+    def test_overview_view(self):
+        response = self.client.get(reverse("admin:core_list_overview"))
+        self.assertEqual(response.status_code, 200)
+        rows = response.context["rows"]
+        self.assertEqual([row["list"] for row in rows], [self.list])
+        self.assertEqual(rows[0]["counts"].active, 2)
+        self.assertContains(response, "/core/list/{}/stats/".format(self.list.pk))
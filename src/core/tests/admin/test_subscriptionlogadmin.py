@@ -0,0 +1,162 @@
+import gzip
+import shutil
+import tempfile
+from unittest import mock
+
+from django import test
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from model_mommy import mommy
+
+from ... import admin as core_admin, models as m, tasks
+
+
+@test.override_settings(SAILTHRU_SYNC_SIGNALS_ENABLED=False, RAVEN_CONFIG={"dsn": None})
+@mock.patch.object(core_admin.SubscriptionLogAdmin, "browse_page_size", 4)
+class SubscriptionLogBrowseTest(test.TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser("admin", "admin@example.com", "pw")
+        self.client.force_login(self.admin)
+        self.list = mommy.make("core.List", slug="foo", type="list")
+        other = mommy.make("core.List", slug="bar", type="list")
+        for n in range(5):
+            user = mommy.make("core.AudienceUser", email="{}@example.com".format(n))
+            user.list_subscribe("foo")
+            user.list_unsubscribe("foo")
+            user.list_subscribe(other.slug)
+        self.url = reverse("admin:core_subscriptionlog_browse")
+
+    def browse(self, query):
+        response = self.client.get(self.url + query)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_requires_list(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 404)
+
+    def test_pages_forward_and_back(self):
+        response = self.browse("?list_id={}".format(self.list.pk))
+        pages = [[entry.pk for entry in response.context["entries"]]]
+        self.assertIsNone(response.context["prev_url"])
+        while response.context["next_url"]:
+            response = self.browse(response.context["next_url"])
+            pages.append([entry.pk for entry in response.context["entries"]])
+
+        self.assertEqual([len(page) for page in pages], [4, 4, 2])
+        ids = [pk for page in pages for pk in page]
+        self.assertEqual(ids, sorted(ids, reverse=True))
+        self.assertEqual(
+            set(ids),
+            set(self.list.subscriptions.values_list("log__id", flat=True)),
+        )
+
+        response = self.browse(response.context["prev_url"])
+        self.assertEqual([entry.pk for entry in response.context["entries"]], pages[1])
+        response = self.browse(response.context["prev_url"])
+        self.assertEqual([entry.pk for entry in response.context["entries"]], pages[0])
+        self.assertIsNone(response.context["prev_url"])
+
+    def test_filter_by_action(self):
+        response = self.browse("?list_id={}&action=unsubscribe".format(self.list.pk))
+        self.assertEqual(
+            {entry.action for entry in response.context["entries"]}, {"unsubscribe"}
+        )
+        self.assertContains(response, "4@example.com")
+
+
+@test.override_settings(SAILTHRU_SYNC_SIGNALS_ENABLED=False, RAVEN_CONFIG={"dsn": None})
+class SubscriptionLogExportAdminTest(test.TestCase):
+    def setUp(self):
+        exports_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, exports_root)
+        storage = m.SubscriptionLogExport._meta.get_field("file").storage
+        patcher = mock.patch.object(storage, "location", exports_root)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.admin = User.objects.create_superuser("admin", "admin@example.com", "pw")
+        self.client.force_login(self.admin)
+        self.list = mommy.make("core.List", slug="foo", type="list")
+        for n in range(3):
+            user = mommy.make("core.AudienceUser", email="{}@example.com".format(n))
+            user.list_subscribe("foo")
+            user.list_unsubscribe("foo")
+
+    def test_export_from_browser(self):
+        with mock.patch.object(tasks.export_subscription_log, "apply_async"):
+            response = self.client.post(
+                reverse("admin:core_subscriptionlog_browse_export"),
+                {"list_id": self.list.pk, "days": 30, "action": "unsubscribe"},
+            )
+        export = m.SubscriptionLogExport.objects.get()
+        self.assertRedirects(
+            response, reverse("admin:core_subscriptionlog_export", args=[export.pk])
+        )
+        self.assertEqual(export.list, self.list)
+        self.assertEqual(export.requested_by, self.admin)
+        self.assertEqual(export.filters["action"], "unsubscribe")
+        self.assertNotIn("optout_type", export.filters)
+
+        response = self.client.get(response.url)
+        self.assertContains(response, "pending")
+        self.assertContains(response, 'http-equiv="refresh"')
+
+        tasks.export_subscription_log(export.pk)
+        response = self.client.get(
+            reverse("admin:core_subscriptionlog_export", args=[export.pk])
+        )
+        self.assertNotContains(response, 'http-equiv="refresh"')
+        download = reverse(
+            "admin:core_subscriptionlog_export_download", args=[export.pk]
+        )
+        self.assertContains(response, download)
+
+        response = self.client.get(download)
+        self.assertEqual(response.status_code, 200)
+        text = gzip.decompress(b"".join(response.streaming_content)).decode("utf-8")
+        self.assertEqual(len(text.splitlines()), 4)
+
+    def test_export_selected_action(self):
+        entries = m.SubscriptionLog.objects.filter(action="subscribe")
+        with mock.patch.object(tasks.export_subscription_log, "apply_async"):
+            response = self.client.post(
+                "/core/subscriptionlog/?list_id={}".format(self.list.pk),
+                {
+                    "action": "export_as_csv",
+                    "_selected_action": [entry.pk for entry in entries],
+                },
+            )
+        export = m.SubscriptionLogExport.objects.get()
+        self.assertRedirects(
+            response, reverse("admin:core_subscriptionlog_export", args=[export.pk])
+        )
+        self.assertEqual(
+            sorted(export.filters["ids"]), sorted(entry.pk for entry in entries)
+        )
+
+    def test_export_filtered_changelist(self):
+        with mock.patch.object(tasks.export_subscription_log, "apply_async"):
+            self.client.post(
+                "/core/subscriptionlog/?list_id={}&action__exact=unsubscribe"
+                "&optout_type=basic".format(self.list.pk),
+                {
+                    "action": "export_as_csv",
+                    "select_across": "1",
+                    "_selected_action": [
+                        m.SubscriptionLog.objects.filter(action="unsubscribe")[0].pk
+                    ],
+                },
+            )
+        export = m.SubscriptionLogExport.objects.get()
+        self.assertEqual(export.list, self.list)
+        self.assertEqual(export.filters["action"], "unsubscribe")
+        self.assertEqual(export.filters["optout_type"], "basic")
+        self.assertNotIn("ids", export.filters)
+
+    def test_download_unfinished_export(self):
+        export = m.SubscriptionLogExport.objects.create(list=self.list)
+        response = self.client.get(
+            reverse("admin:core_subscriptionlog_export_download", args=[export.pk])
+        )
+        self.assertEqual(response.status_code, 404)
@@ -266,6 +266,15 @@ class EmailChangeFormTest(test.TestCase):
         form.save()
         self.assertFalse(async.called)
 
+    @test.override_settings(SAILTHRU_SYNC_ENABLED=False)
+    def test_save_updates_email_hash(self):
+        user = mommy.make("core.EmailChangeAudienceUser", email="a@a.com")
+        form = self.EmailChangeForm({"email": "b@b.com"}, instance=user)
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        user.refresh_from_db()
+        self.assertEqual(user.email_hash, user.hash_email("b@b.com"))
+
     @test.override_settings(SAILTHRU_SYNC_ENABLED=True)
     @mock.patch("core.admin.sync_user_basic.apply_async")
     def test_save_sync(self, async):
@@ -0,0 +1,135 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django import test
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.utils import timezone
+from model_mommy import mommy
+
+from ... import bulk, models as core_models
+
+
+def metadata(athena_content_id, content_type="post_manager.post", **kwargs):
+    data = {
+        "athena_content_id": athena_content_id,
+        "athena_content_type": content_type,
+        "date_created": "2020-01-0{}T12:00:00Z".format(athena_content_id % 9 + 1),
+        "title": "Content {}".format(athena_content_id),
+        "slug": "content-{}".format(athena_content_id),
+        "absolute_url": "https://www.example.com/{}/".format(athena_content_id),
+        "site_name": "govexec",
+        "organization": "govexec",
+        "topics": ["topic-{}".format(athena_content_id)],
+    }
+    data.update(kwargs)
+    return json.dumps(data)
+
+
+class AthenaContentMetadataBulkTest(test.TestCase):
+    def setUp(self):
+        self.post = mommy.make("core.AthenaContentType", name="post_manager.post")
+        self.event = mommy.make("core.AthenaContentType", name="events.event")
+        self.existing = mommy.make(
+            "core.AthenaContentMetadata",
+            athena_content_id=1,
+            athena_content_type=self.post,
+            date_created=timezone.now(),
+            title="Old title",
+            categories={"primary": "old"},
+            is_sponsored_content=True,
+        )
+
+    def test_upsert(self):
+        lines = [
+            metadata(1, "events.event", title="New title"),
+            metadata(2, str(self.post.pk), categories={"primary": "news"}),
+            metadata(3, topics=[]),
+        ]
+        # the content types and one upsert per set of fields
+        with self.assertNumQueries(3):
+            loader = bulk.ContentMetadataLoader().load(lines)
+
+        self.assertEqual(loader.result, {"created": 2, "updated": 1, "errors": []})
+        self.assertEqual(core_models.AthenaContentMetadata.objects.count(), 3)
+
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.title, "New title")
+        self.assertEqual(self.existing.athena_content_type, self.event)
+        # fields left out are kept, as with a POST
+        self.assertEqual(self.existing.categories, {"primary": "old"})
+        self.assertTrue(self.existing.is_sponsored_content)
+
+        created = core_models.AthenaContentMetadata.objects.get(athena_content_id=2)
+        self.assertEqual(created.athena_content_type, self.post)
+        self.assertEqual(created.categories, {"primary": "news"})
+        self.assertEqual(created.topics, ["topic-2"])
+        self.assertEqual(created.date_created.day, 3)
+        self.assertEqual(
+            core_models.AthenaContentMetadata.objects.get(athena_content_id=3).topics,
+            [],
+        )
+
+    def test_invalid_lines_are_skipped(self):
+        lines = [
+            metadata(2),
+            "{not json",
+            "",
+            "[1, 2]",
+            metadata(3, absolute_url="not a url"),
+            metadata(4, "missing.type"),
+            metadata(2, title="Second"),
+        ]
+        loader = bulk.ContentMetadataLoader(batch_size=2).load(lines)
+
+        self.assertEqual((loader.created, loader.updated), (1, 1))
+        self.assertEqual([e["line"] for e in loader.errors], [2, 4, 5, 6])
+        self.assertIn("absolute_url", loader.errors[2]["errors"])
+        self.assertIn("athena_content_type", loader.errors[3]["errors"])
+        self.assertEqual(
+            core_models.AthenaContentMetadata.objects.get(athena_content_id=2).title,
+            "Second",
+        )
+
+    def test_duplicate_ids_in_a_batch(self):
+        loader = bulk.ContentMetadataLoader().load(
+            [metadata(5, title="First"), metadata(5, title="Last")]
+        )
+        self.assertEqual((loader.created, loader.updated), (1, 0))
+        self.assertEqual(
+            core_models.AthenaContentMetadata.objects.get(athena_content_id=5).title,
+            "Last",
+        )
+
+    def test_command(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "content.ndjson.gz")
+        with gzip.open(path, "wt") as f:
+            f.write("\n".join([metadata(1), metadata(2), metadata(3, "nope")]))
+
+        stdout, stderr = StringIO(), StringIO()
+        call_command(
+            "load_athena_content_metadata",
+            path,
+            batch_size=1,
+            stdout=stdout,
+            stderr=stderr,
+        )
+        self.assertIn("Created 1, updated 1, skipped 1.", stdout.getvalue())
+        self.assertIn("Line 3:", stderr.getvalue())
+
+    def test_validate_and_create(self):
+        with self.assertRaises(ValidationError):
+            core_models.AthenaContentMetadata.objects.validate_and_create(
+                athena_content_id=6, athena_content_type=self.post, title="No date"
+            )
+        self.assertFalse(
+            core_models.AthenaContentMetadata.objects.filter(
+                athena_content_id=6
+            ).exists()
+        )
@@ -1,12 +1,34 @@
+import datetime
+import gzip
 import hashlib
+import json
+import os
+import shutil
+import tempfile
 import time
+from io import StringIO
+from unittest import mock
 
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from model_mommy import mommy
 
-from ...models import AudienceUser, List, Product, ProductAction, Subscription
+from ... import bulk
+from ...models import (
+    AudienceUser,
+    List,
+    OptoutHistory,
+    Product,
+    ProductAction,
+    Subscription,
+    UserSource,
+    UserVarsHistory,
+    VarKey,
+)
 
 
 class UserTestCase(TestCase):
@@ -402,3 +424,258 @@ class UserTestCase(TestCase):
         email_address = None
         au = AudienceUser.objects.validate_and_create(email=email_address)
         self.assertEqual(au.email_hash, None)
+
+    def test_email_hash_follows_email(self):
+        au = AudienceUser.objects.validate_and_create(email="foo@bar.com")
+        au.email = "baz@bar.com"
+        au.save(update_fields=["email"])
+        au.refresh_from_db()
+        self.assertEqual(au.email_hash, AudienceUser.hash_email("baz@bar.com"))
+        self.assertEqual(AudienceUser.objects.get(email_hash=au.email_hash).pk, au.pk)
+
+        au.email = None
+        au.save()
+        au.refresh_from_db()
+        self.assertIsNone(au.email_hash)
+
+    def test_backfill_email_hashes(self):
+        users = [
+            AudienceUser.objects.validate_and_create(email=email)
+            for email in ("a@a.com", "b@b.com", "c@c.com")
+        ]
+        AudienceUser.objects.validate_and_create(email=None)
+        AudienceUser.objects.update(email_hash=None)
+
+        stdout = StringIO()
+        call_command("backfill_email_hashes", batch_size=2, stdout=stdout)
+        self.assertIn("Hashed 3 users.", stdout.getvalue())
+        for user in users:
+            user_hash = user.email_hash
+            user.refresh_from_db()
+            self.assertEqual(user.email_hash, user_hash)
+        self.assertEqual(AudienceUser.objects.filter(email_hash=None).count(), 1)
+
+
+def user_line(email, **kwargs):
+    kwargs["email"] = email
+    return json.dumps(kwargs)
+
+
+class AudienceUserBulkTest(TestCase):
+    def setUp(self):
+        self.existing = AudienceUser.objects.validate_and_create(
+            email="old@example.com", vars={"a": "1", "b": "2"}, omeda_id="om-1"
+        )
+        on_commit = mock.patch.object(bulk.transaction, "on_commit")
+        self.on_commit = on_commit.start()
+        self.addCleanup(on_commit.stop)
+
+    def test_upsert(self):
+        now = timezone.now()
+        results = AudienceUser.objects.upsert(
+            [
+                {"email": "old@example.com", "vars": {"b": "3", "c": "4"}},
+                {
+                    "email": "new@example.com",
+                    "vars": {"d": "5"},
+                    "omeda_id": "om-2",
+                    "source_signups": [{"name": "import"}],
+                },
+            ],
+            now=now,
+        )
+        new = AudienceUser.objects.get(email="new@example.com")
+        self.assertEqual(
+            results,
+            [
+                ("old@example.com", self.existing.pk, False, True),
+                ("new@example.com", new.pk, True, True),
+            ],
+        )
+
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.vars, {"a": "1", "b": "3", "c": "4"})
+        self.assertEqual(self.existing.omeda_id, "om-1")
+        self.assertEqual(self.existing.modified, now)
+        self.assertEqual(new.vars, {"d": "5"})
+        self.assertEqual(new.omeda_id, "om-2")
+        self.assertEqual(new.email_hash, AudienceUser.hash_email("new@example.com"))
+        self.assertEqual(new.sailthru_optout, AudienceUser.OPTOUT_NONE)
+
+        self.assertEqual(
+            [
+                h.vars
+                for h in UserVarsHistory.objects.filter(
+                    audience_user=self.existing
+                ).order_by("pk")
+            ],
+            [{"a": "1", "b": "2"}, {"a": "1", "b": "3", "c": "4"}],
+        )
+        self.assertEqual(
+            list(
+                UserVarsHistory.objects.filter(audience_user=new).values_list(
+                    "vars", flat=True
+                )
+            ),
+            [{"d": "5"}],
+        )
+        optin = OptoutHistory.objects.get(audience_user=new)
+        self.assertEqual(optin.sailthru_optout, AudienceUser.OPTOUT_NONE)
+        self.assertEqual(optin.comment, "Initial opt in for new user")
+        self.assertEqual(
+            VarKey.objects.filter(key__in=["a", "b", "c", "d"], type="other").count(),
+            4,
+        )
+        self.assertEqual(
+            list(new.source_signups.values_list("name", flat=True)), ["import"]
+        )
+
+    def test_upsert_results_in_input_order(self):
+        emails = ["user{}@example.com".format(i) for i in reversed(range(50))]
+        emails.insert(25, "old@example.com")
+        results = AudienceUser.objects.upsert(
+            [{"email": email, "source_signups": [{"name": email}]} for email in emails]
+        )
+        self.assertEqual([email for email, _, _, _ in results], emails)
+        pks = dict(AudienceUser.objects.values_list("email", "pk"))
+        self.assertEqual([pk for _, pk, _, _ in results], [pks[e] for e in emails])
+        self.assertEqual(
+            set(UserSource.objects.values_list("name", "audience_user__email")),
+            {(email, email) for email in emails},
+        )
+
+    def test_upsert_unchanged(self):
+        modified = self.existing.modified
+        results = AudienceUser.objects.upsert(
+            [{"email": "old@example.com", "vars": {"a": "1"}, "omeda_id": "om-1"}]
+        )
+        self.assertEqual(results, [("old@example.com", self.existing.pk, False, False)])
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.modified, modified)
+        self.assertEqual(
+            UserVarsHistory.objects.filter(audience_user=self.existing).count(), 1
+        )
+
+    def test_upsert_omeda_id_only(self):
+        results = AudienceUser.objects.upsert(
+            [{"email": "old@example.com", "omeda_id": "om-3"}]
+        )
+        self.assertEqual(results, [("old@example.com", self.existing.pk, False, True)])
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.omeda_id, "om-3")
+        # the vars did not change, so neither did their history
+        self.assertEqual(
+            UserVarsHistory.objects.filter(audience_user=self.existing).count(), 1
+        )
+
+    def test_source_signup_timestamps(self):
+        timestamp = datetime.datetime(2020, 1, 2, 12, tzinfo=timezone.utc)
+        AudienceUser.objects.upsert(
+            [
+                {
+                    "email": "old@example.com",
+                    "source_signups": [
+                        {"name": "first", "timestamp": timestamp},
+                        {"name": "second"},
+                    ],
+                }
+            ]
+        )
+        sources = dict(
+            UserSource.objects.filter(audience_user=self.existing).values_list(
+                "name", "timestamp"
+            )
+        )
+        self.assertEqual(sources["first"], timestamp)
+        self.assertGreater(sources["second"], timestamp)
+
+    def test_loader(self):
+        lines = [
+            user_line("old@example.com", vars={"b": "3"}),
+            user_line("new@example.com", vars={"c": "4"}, omeda_id="om-2"),
+            user_line("new@example.com", vars={"c": "5", "d": "6"}),
+            user_line("Upper@example.com"),
+            user_line("bad@example.com", vars={"source": "reserved"}),
+            user_line("old@example.com", vars={"e": "1 2"}, omeda_id=None),
+            "not json",
+            user_line("same@example.com", vars={"a": "1"}),
+            "",
+            json.dumps(["not", "an", "object"]),
+        ]
+        loader = bulk.AudienceUserLoader(batch_size=4).load(lines)
+        self.assertEqual([error["line"] for error in loader.errors], [4, 5, 7, 10])
+        self.assertIn("email", loader.errors[0]["errors"])
+        self.assertIn("vars", loader.errors[1]["errors"])
+        self.assertEqual((loader.created, loader.updated, loader.unchanged), (2, 2, 0))
+
+        new = AudienceUser.objects.get(email="new@example.com")
+        self.assertEqual(new.vars, {"c": "5", "d": "6"})
+        self.assertEqual(new.omeda_id, "om-2")
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.vars, {"a": "1", "b": "3", "e": "1 2"})
+        self.assertEqual(self.existing.omeda_id, "om-1")
+
+        # one sync task for each batch that changed users
+        self.assertEqual(self.on_commit.call_count, 2)
+
+    def test_loader_queues_sync_once_per_batch(self):
+        lines = [
+            user_line("one@example.com"),
+            user_line("old@example.com", vars={"a": "1"}),
+            user_line("old@example.com", source_signups=[{"name": "import"}]),
+            user_line("two@example.com"),
+        ]
+        with mock.patch("sailthru_sync.tasks.sync_users_basic.apply_async") as sync:
+            loader = bulk.AudienceUserLoader().load(lines)
+            self.assertEqual(self.on_commit.call_count, 1)
+            self.on_commit.call_args[0][0]()
+        self.assertEqual((loader.created, loader.updated, loader.unchanged), (2, 0, 1))
+        (pks,), _ = sync.call_args
+        self.assertEqual(
+            set(pks[0]),
+            set(
+                AudienceUser.objects.filter(
+                    email__in=["one@example.com", "old@example.com", "two@example.com"]
+                ).values_list("pk", flat=True)
+            ),
+        )
+
+    def test_loader_queries(self):
+        lines = [
+            user_line(
+                "user{}@example.com".format(n),
+                vars={"key{}".format(n % 3): str(n)},
+                source_signups=[{"name": "import"}],
+            )
+            for n in range(50)
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            loader = bulk.AudienceUserLoader().load(lines)
+        self.assertEqual(loader.created, 50)
+        # upsert, vars history, opt-in history, var keys and sources
+        self.assertEqual(len([q for q in queries if "SAVEPOINT" not in q["sql"]]), 5)
+
+    def test_command(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "users.ndjson.gz")
+        with gzip.open(path, "wt") as f:
+            f.write(
+                "\n".join(
+                    [
+                        user_line("old@example.com", vars={"b": "3"}),
+                        user_line("old@example.com", vars={"a": "1"}),
+                        user_line("new@example.com"),
+                        user_line("Bad@example.com"),
+                    ]
+                )
+            )
+
+        stdout, stderr = StringIO(), StringIO()
+        call_command(
+            "load_audience_users", path, batch_size=1, stdout=stdout, stderr=stderr
+        )
+        self.assertIn(
+            "Created 1, updated 1, unchanged 1, skipped 1.", stdout.getvalue()
+        )
+        self.assertIn("Line 4:", stderr.getvalue())
@@ -0,0 +1,111 @@
+import datetime
+
+from django import db, test
+from django.test.utils import CaptureQueriesContext
+from model_mommy import mommy
+
+from ... import models as core_models, tasks
+
+
+@test.override_settings(SAILTHRU_SYNC_SIGNALS_ENABLED=False, RAVEN_CONFIG={"dsn": None})
+class ListSubscriberCountTest(test.TestCase):
+    def setUp(self):
+        self.list = mommy.make("core.List", slug="foo", type="list")
+        self.users = [
+            mommy.make("core.AudienceUser", email="{}@example.com".format(n))
+            for n in range(3)
+        ]
+
+    def counts(self):
+        counter = core_models.ListSubscriberCount.objects.get(list=self.list)
+        return counter.active, counter.inactive
+
+    def test_new_list_starts_at_zero(self):
+        self.assertEqual(self.counts(), (0, 0))
+
+    def test_subscribe_and_unsubscribe(self):
+        for user in self.users:
+            user.list_subscribe("foo")
+        self.assertEqual(self.counts(), (3, 0))
+
+        self.users[0].list_unsubscribe("foo")
+        self.assertEqual(self.counts(), (2, 1))
+
+        self.users[0].list_subscribe("foo")
+        self.assertEqual(self.counts(), (3, 0))
+
+    def test_resave_without_change(self):
+        self.users[0].list_subscribe("foo")
+        subscription = core_models.Subscription.objects.get(list=self.list)
+        subscription.save()
+        subscription.save()
+        self.assertEqual(self.counts(), (1, 0))
+
+    def test_subscription_created_inactive(self):
+        mommy.make(
+            "core.Subscription",
+            audience_user=self.users[0],
+            list=self.list,
+            active=False,
+        )
+        self.assertEqual(self.counts(), (0, 1))
+
+    def test_delete(self):
+        for user in self.users:
+            user.list_subscribe("foo")
+        self.users[1].list_unsubscribe("foo")
+        self.users[0].delete()
+        self.users[1].delete()
+        self.assertEqual(self.counts(), (1, 0))
+
+    def test_reconcile_corrects_drift(self):
+        for user in self.users:
+            user.list_subscribe("foo")
+        core_models.ListSubscriberCount.objects.filter(list=self.list).update(
+            active=10, inactive=5
+        )
+        other = mommy.make("core.List", slug="bar", type="list")
+        core_models.ListSubscriberCount.objects.filter(list=other).delete()
+
+        drifted = core_models.ListSubscriberCount.objects.reconcile()
+        self.assertEqual(drifted, {self.list.pk: ((10, 5), (3, 0))})
+        self.assertEqual(self.counts(), (3, 0))
+        counter = core_models.ListSubscriberCount.objects.get(list=other)
+        self.assertEqual((counter.active, counter.inactive), (0, 0))
+        self.assertIsNotNone(counter.reconciled)
+
+    def test_reconcile_locks_counters_before_counting(self):
+        self.users[0].list_subscribe("foo")
+        with CaptureQueriesContext(db.connection) as queries:
+            core_models.ListSubscriberCount.objects.reconcile(list_ids=[self.list.pk])
+        sql = [q["sql"] for q in queries.captured_queries]
+        locks = [n for n, s in enumerate(sql) if s.endswith("FOR UPDATE")]
+        counts = [n for n, s in enumerate(sql) if "COUNT(" in s]
+        self.assertEqual(len(locks), 1)
+        self.assertLess(locks[0], counts[0])
+        self.assertEqual(self.counts(), (1, 0))
+
+    def test_for_list_counts_missing_counters(self):
+        self.users[0].list_subscribe("foo")
+        core_models.ListSubscriberCount.objects.all().delete()
+        counter = core_models.ListSubscriberCount.objects.for_list(self.list)
+        self.assertEqual((counter.active, counter.inactive), (1, 0))
+
+    def test_record_history(self):
+        self.users[0].list_subscribe("foo")
+        day = datetime.date(2020, 1, 1)
+        core_models.ListSubscriberCountHistory.objects.record(day)
+        self.users[1].list_subscribe("foo")
+        core_models.ListSubscriberCountHistory.objects.record(day)
+
+        history = core_models.ListSubscriberCountHistory.objects.get(list=self.list)
+        self.assertEqual((history.date, history.active, history.inactive), (day, 2, 0))
+
+    def test_reconcile_task(self):
+        self.users[0].list_subscribe("foo")
+        core_models.ListSubscriberCount.objects.update(active=0)
+        tasks.reconcile_list_subscriber_counts()
+        self.assertEqual(self.counts(), (1, 0))
+        self.assertEqual(
+            core_models.ListSubscriberCountHistory.objects.get(list=self.list).active, 1
+        )
@@ -0,0 +1,47 @@
+from io import StringIO
+
+from django import test
+from django.core.management import call_command
+from model_mommy import mommy
+
+from ... import models as core_models
+
+
+@test.override_settings(SAILTHRU_SYNC_SIGNALS_ENABLED=False, RAVEN_CONFIG={"dsn": None})
+class SubscriptionLogTest(test.TestCase):
+    def test_list_copied_from_subscription(self):
+        list_ = mommy.make("core.List", slug="foo", type="list")
+        user = mommy.make("core.AudienceUser", email="a@a.com")
+        user.list_subscribe("foo")
+        user.list_unsubscribe("foo")
+
+        log = core_models.SubscriptionLog.objects.filter(subscription__list=list_)
+        self.assertEqual(log.count(), 2)
+        self.assertEqual(set(log.values_list("list_id", flat=True)), {list_.pk})
+
+    def test_list_set_on_direct_create(self):
+        subscription = mommy.make(
+            "core.Subscription",
+            list=mommy.make("core.List", slug="foo", type="list"),
+            log_override={"action": "update"},
+        )
+        entry = core_models.SubscriptionLog.objects.create(
+            subscription=subscription, action="update"
+        )
+        self.assertEqual(entry.list_id, subscription.list_id)
+
+    def test_backfill_subscription_log_lists(self):
+        list_ = mommy.make("core.List", slug="foo", type="list")
+        user = mommy.make("core.AudienceUser", email="a@a.com")
+        for _ in range(3):
+            user.list_subscribe("foo")
+            user.list_unsubscribe("foo")
+        core_models.SubscriptionLog.objects.update(list=None)
+
+        stdout = StringIO()
+        call_command("backfill_subscription_log_lists", batch_size=2, stdout=stdout)
+        self.assertIn("Copied 6 lists.", stdout.getvalue())
+        self.assertEqual(
+            set(core_models.SubscriptionLog.objects.values_list("list_id", flat=True)),
+            {list_.pk},
+        )
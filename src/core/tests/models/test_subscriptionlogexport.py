@@ -0,0 +1,116 @@
+import csv
+import gzip
+import io
+import shutil
+import tempfile
+from unittest import mock
+
+from django import test
+from django.utils import timezone
+from model_mommy import mommy
+
+from ... import models as core_models, tasks
+from ...db import stream_rows
+
+
+@test.override_settings(SAILTHRU_SYNC_SIGNALS_ENABLED=False, RAVEN_CONFIG={"dsn": None})
+class SubscriptionLogExportTest(test.TestCase):
+    def setUp(self):
+        exports_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, exports_root)
+        storage = core_models.SubscriptionLogExport._meta.get_field("file").storage
+        patcher = mock.patch.object(storage, "location", exports_root)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.list = mommy.make("core.List", name="Foo", slug="foo", type="list")
+        other = mommy.make("core.List", slug="bar", type="list")
+        for n in range(3):
+            user = mommy.make("core.AudienceUser", email="{}@example.com".format(n))
+            user.list_subscribe("foo")
+            user.list_unsubscribe("foo")
+            user.list_subscribe(other.slug)
+
+    def read(self, export):
+        with export.file.storage.open(export.file.name) as f:
+            text = gzip.GzipFile(fileobj=f).read().decode("utf-8")
+        return list(csv.DictReader(io.StringIO(text)))
+
+    def run_export(self, **filters):
+        export = core_models.SubscriptionLogExport.objects.create(
+            list=self.list, filters=filters
+        )
+        tasks.export_subscription_log(export.pk)
+        export.refresh_from_db()
+        return export
+
+    def test_exports_list_log(self):
+        export = self.run_export()
+        self.assertEqual(export.status, core_models.SubscriptionLogExport.STATUS_DONE)
+        self.assertEqual(export.rows, 6)
+        self.assertEqual(export.progress, 6)
+        self.assertIsNotNone(export.finished)
+        # downloaded through the admin, not from a public URL
+        self.assertIsNone(export.file.url)
+
+        rows = self.read(export)
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(
+            list(rows[0]),
+            ["list_name", "action", "email", "optout_type", "comment", "timestamp"],
+        )
+        self.assertEqual({row["list_name"] for row in rows}, {"Foo"})
+        self.assertEqual(rows[0]["action"], "unsubscribe")
+        self.assertEqual(rows[0]["email"], "2@example.com")
+        self.assertEqual(rows[-1]["email"], "0@example.com")
+
+    def test_filters(self):
+        export = self.run_export(action="subscribe")
+        self.assertEqual({row["action"] for row in self.read(export)}, {"subscribe"})
+
+        ids = list(
+            core_models.SubscriptionLog.objects.filter(
+                list=self.list, subscription__audience_user__email="1@example.com"
+            ).values_list("pk", flat=True)
+        )
+        export = self.run_export(ids=ids)
+        self.assertEqual(
+            [row["email"] for row in self.read(export)], ["1@example.com"] * 2
+        )
+
+        export = self.run_export(since=timezone.now().isoformat())
+        self.assertEqual(export.rows, 0)
+        self.assertEqual(self.read(export), [])
+
+    def test_stream_rows(self):
+        entries = core_models.SubscriptionLog.objects.order_by("id").values_list(
+            "id", "action"
+        )
+        self.assertEqual(list(stream_rows(entries, chunk_size=4)), list(entries))
+
+    def test_reports_progress(self):
+        export = core_models.SubscriptionLogExport.objects.create(list=self.list)
+        with mock.patch.object(tasks, "EXPORT_PROGRESS_INTERVAL", 2), mock.patch.object(
+            core_models.SubscriptionLogExport, "report_progress"
+        ) as report_progress:
+            tasks.export_subscription_log(export.pk)
+        self.assertEqual(
+            [args[0] for args, kwargs in report_progress.call_args_list], [0, 2, 4, 6]
+        )
+
+    def test_failure_is_recorded(self):
+        export = core_models.SubscriptionLogExport.objects.create(list=self.list)
+        with mock.patch.object(
+            tasks, "stream_rows", side_effect=RuntimeError("boom")
+        ), mock.patch("sentry_sdk.capture_exception"):
+            tasks.export_subscription_log(export.pk)
+        export.refresh_from_db()
+        self.assertEqual(export.status, core_models.SubscriptionLogExport.STATUS_FAILED)
+        self.assertEqual(export.error, "boom")
+        self.assertFalse(export.file)
+
+    def test_runs_once(self):
+        export = self.run_export()
+        with mock.patch.object(tasks, "write_subscription_log_csv") as write:
+            tasks.export_subscription_log(export.pk)
+        write.assert_not_called()
@@ -0,0 +1,136 @@
+import datetime
+import gzip
+import json
+import shutil
+import tempfile
+from unittest import mock
+
+from django import test
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+from model_mommy import mommy
+
+from ... import models as core_models, tasks
+
+
+class UserContentHistoryCompactTest(test.TestCase):
+    def setUp(self):
+        archive_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_root)
+        patcher = mock.patch.object(
+            core_models.UserContentHistory.objects.archive_storage,
+            "location",
+            archive_root,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        content_type = mommy.make("core.AthenaContentType", name="post_manager.post")
+        self.content = [
+            mommy.make(
+                "core.AthenaContentMetadata",
+                athena_content_id=n,
+                athena_content_type=content_type,
+                date_created=timezone.now(),
+                categories={},
+            )
+            for n in (1, 2)
+        ]
+        self.now = timezone.now()
+
+    def view(self, email, content, days_ago, referrer=None, ingested=True):
+        event = core_models.UserContentHistory.objects.create(
+            email=email, athena_content_metadata=content, referrer=referrer
+        )
+        core_models.UserContentHistory.objects.filter(pk=event.pk).update(
+            timestamp=self.now - datetime.timedelta(days=days_ago),
+            interests_ingested=ingested,
+        )
+        return event
+
+    def test_validate_and_create(self):
+        event = core_models.UserContentHistory.objects.validate_and_create(
+            email="a@example.com", athena_content_metadata=self.content[0]
+        )
+        self.assertEqual(event.athena_content_metadata_id, 1)
+        with self.assertRaises(ValidationError):
+            core_models.UserContentHistory.objects.validate_and_create(
+                email="not an email", athena_content_metadata=self.content[0]
+            )
+
+    def test_compact(self):
+        self.view("a@example.com", self.content[0], 30, "https://a.example.com/")
+        self.view("a@example.com", self.content[0], 20, "https://b.example.com/")
+        self.view("a@example.com", self.content[1], 25)
+        self.view("b@example.com", self.content[0], 15)
+        recent = self.view("a@example.com", self.content[0], 1)
+
+        compacted = core_models.UserContentHistory.objects.compact(
+            self.now - datetime.timedelta(days=10), batch_size=2
+        )
+        self.assertEqual(compacted, 4)
+        self.assertEqual(
+            list(core_models.UserContentHistory.objects.values_list("pk", flat=True)),
+            [recent.pk],
+        )
+
+        rollup = core_models.UserContentRollup.objects.get(
+            email="a@example.com", athena_content_metadata=self.content[0]
+        )
+        self.assertEqual(rollup.count, 2)
+        self.assertEqual(rollup.first_seen, self.now - datetime.timedelta(days=30))
+        self.assertEqual(rollup.last_seen, self.now - datetime.timedelta(days=20))
+        self.assertEqual(rollup.last_referrer, "https://b.example.com/")
+        self.assertEqual(core_models.UserContentRollup.objects.count(), 3)
+
+        # compacting more of a pair's views adds to its rollup
+        self.view("a@example.com", self.content[0], 40, "https://c.example.com/")
+        core_models.UserContentHistory.objects.compact(
+            self.now - datetime.timedelta(days=10)
+        )
+        rollup.refresh_from_db()
+        self.assertEqual(rollup.count, 3)
+        self.assertEqual(rollup.first_seen, self.now - datetime.timedelta(days=40))
+        self.assertEqual(rollup.last_referrer, "https://b.example.com/")
+
+    def test_compact_leaves_views_not_in_interests(self):
+        pending = self.view("a@example.com", self.content[0], 30, ingested=False)
+        compacted = core_models.UserContentHistory.objects.compact(
+            self.now - datetime.timedelta(days=10)
+        )
+        self.assertEqual(compacted, 0)
+        self.assertTrue(
+            core_models.UserContentHistory.objects.filter(pk=pending.pk).exists()
+        )
+
+    def test_archive(self):
+        old = self.view("a@example.com", self.content[0], 30, "https://a.example.com/")
+        core_models.UserContentHistory.objects.compact(
+            self.now - datetime.timedelta(days=10)
+        )
+
+        storage = core_models.UserContentHistory.objects.archive_storage
+        name = "user_content_history/{:%Y/%m}/{}-{}.ndjson.gz".format(
+            timezone.now(), old.pk, old.pk
+        )
+        with storage.open(name) as f:
+            lines = gzip.decompress(f.read()).decode("utf-8").splitlines()
+        self.assertEqual(len(lines), 1)
+        event = json.loads(lines[0])
+        self.assertEqual(event["id"], old.pk)
+        self.assertEqual(event["athena_content_metadata_id"], 1)
+        self.assertEqual(event["referrer"], "https://a.example.com/")
+
+    @test.override_settings(
+        USER_CONTENT_HISTORY_RETENTION_DAYS=10, USER_CONTENT_HISTORY_ARCHIVE=False
+    )
+    def test_task(self):
+        self.view("a@example.com", self.content[0], 30)
+        self.view("a@example.com", self.content[0], 1)
+        with mock.patch.object(
+            core_models.UserContentHistoryManager, "archive"
+        ) as archive:
+            tasks.compact_user_content_history()
+        archive.assert_not_called()
+        self.assertEqual(core_models.UserContentHistory.objects.count(), 1)
+        self.assertEqual(core_models.UserContentRollup.objects.get().count, 1)
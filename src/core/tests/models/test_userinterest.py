@@ -0,0 +1,144 @@
+import datetime
+
+from django import test
+from django.utils import timezone
+from model_mommy import mommy
+
+from ... import models as core_models, tasks
+
+
+@test.override_settings(USER_INTEREST_HALF_LIFE_DAYS=30)
+class UserInterestTest(test.TestCase):
+    def setUp(self):
+        content_type = mommy.make("core.AthenaContentType", name="post_manager.post")
+        self.now = timezone.now()
+        self.defense = self.content(
+            1,
+            topics=["defense", "budget"],
+            authors=["Jane Doe"],
+            categories={"primary": "defense", "secondary": ["management"]},
+            content_type=content_type,
+        )
+        self.tech = self.content(
+            2,
+            topics=["technology"],
+            keywords=["cloud"],
+            interests=["IT"],
+            categories={"primary": "technology"},
+            content_type=content_type,
+        )
+
+    def content(self, content_id, content_type, **kwargs):
+        return mommy.make(
+            "core.AthenaContentMetadata",
+            athena_content_id=content_id,
+            athena_content_type=content_type,
+            date_created=self.now,
+            **kwargs
+        )
+
+    def view(self, email, content, days_ago):
+        event = core_models.UserContentHistory.objects.create(
+            email=email, athena_content_metadata=content
+        )
+        core_models.UserContentHistory.objects.filter(pk=event.pk).update(
+            timestamp=self.now - datetime.timedelta(days=days_ago)
+        )
+
+    def interests(self, email, kind=None):
+        return [
+            (interest.kind, interest.value, round(interest.weight(self.now), 3))
+            for interest in core_models.UserInterest.objects.top(email, 10, kind)
+        ]
+
+    def test_ingest(self):
+        self.view("a@example.com", self.defense, 0)
+        self.view("a@example.com", self.defense, 30)
+        self.view("a@example.com", self.tech, 60)
+        self.view("b@example.com", self.tech, 0)
+
+        self.assertEqual(core_models.UserInterest.objects.ingest(batch_size=3), 4)
+        self.assertEqual(core_models.UserInterest.objects.ingest(), 0)
+
+        # one view now weighs 1, one 30 days (a half-life) ago weighs 0.5
+        topics = self.interests("a@example.com", "topic")
+        self.assertEqual(topics[-1], ("topic", "technology", 0.25))
+        self.assertEqual(
+            sorted(topics[:2]), [("topic", "budget", 1.5), ("topic", "defense", 1.5)]
+        )
+        self.assertEqual(
+            sorted(self.interests("a@example.com", "category")),
+            [
+                ("category", "defense", 1.5),
+                ("category", "management", 1.5),
+                ("category", "technology", 0.25),
+            ],
+        )
+        self.assertEqual(
+            self.interests("a@example.com", "author"), [("author", "Jane Doe", 1.5)]
+        )
+        self.assertEqual(
+            sorted(self.interests("b@example.com")),
+            [
+                ("category", "technology", 1.0),
+                ("interest", "IT", 1.0),
+                ("keyword", "cloud", 1.0),
+                ("topic", "technology", 1.0),
+            ],
+        )
+
+    def test_ingest_adds_to_scores(self):
+        self.view("a@example.com", self.tech, 30)
+        core_models.UserInterest.objects.ingest()
+        self.view("a@example.com", self.tech, 0)
+        self.view("a@example.com", self.tech, 0)
+        core_models.UserInterest.objects.ingest()
+        self.assertEqual(
+            self.interests("a@example.com", "topic"), [("topic", "technology", 2.5)]
+        )
+
+    def test_ingest_late_commits(self):
+        self.view("a@example.com", self.tech, 0)
+        late = core_models.UserContentHistory.objects.get()
+        late.delete()
+        self.view("a@example.com", self.tech, 0)
+        core_models.UserInterest.objects.ingest()
+
+        # a row committed after a higher id was ingested is still ingested
+        late.save(force_insert=True)
+        self.assertEqual(core_models.UserInterest.objects.ingest(), 1)
+        self.assertEqual(
+            self.interests("a@example.com", "topic"), [("topic", "technology", 2.0)]
+        )
+        self.assertFalse(
+            core_models.UserContentHistory.objects.filter(
+                interests_ingested=False
+            ).exists()
+        )
+
+    def test_task(self):
+        self.view("a@example.com", self.tech, 0)
+        self.assertEqual(tasks.ingest_user_interests(), None)
+        self.assertTrue(core_models.UserInterest.objects.exists())
+
+    def test_top_by_kind(self):
+        for email in ("a@example.com", "b@example.com"):
+            for score, (kind, value) in enumerate(
+                [("topic", "a"), ("topic", "b"), ("topic", "c"), ("author", "d")]
+            ):
+                core_models.UserInterest.objects.create(
+                    email=email, kind=kind, value=value, score=score, updated=self.now
+                )
+        self.assertEqual(
+            core_models.UserInterest.objects.top_by_kind(
+                ["a@example.com", "c@example.com"], 2
+            ),
+            [
+                ("a@example.com", "author", "d"),
+                ("a@example.com", "topic", "c"),
+                ("a@example.com", "topic", "b"),
+            ],
+        )
+        self.assertEqual(
+            core_models.UserInterest.objects.top_by_kind(["a@example.com"], 0), []
+        )
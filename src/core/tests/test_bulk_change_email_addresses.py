@@ -0,0 +1,190 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django import test
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from model_mommy import mommy
+
+from sailthru_sync.models import SyncLock
+
+from ..management.commands import bulk_change_email_addresses as command
+from ..models import AudienceUser
+from .forms.mock_sailthru import MockedSailthruClient
+
+
+class SailthruStub(object):
+    """Answers email changes as Sailthru does, failing for `failing` emails."""
+
+    def __init__(self, users, failing=()):
+        self.sids = {user.email: user.sailthru_id for user in users}
+        self.failing = set(failing)
+        self.posted = []
+
+    def __call__(self):
+        return self
+
+    def api_post(self, endpoint_name, data):
+        self.posted.append(data["id"])
+        response = MockedSailthruClient.MockedResponse()
+        if data["id"] in self.failing:
+            response.ok = False
+            response.body = {"error": 99, "errormsg": "nope"}
+        else:
+            response.body = {
+                "keys": {"email": data["keys"]["email"], "sid": self.sids[data["id"]]}
+            }
+        return response
+
+
+@test.override_settings(SAILTHRU_SYNC_SIGNALS_ENABLED=False, RAVEN_CONFIG={"dsn": None})
+class BulkChangeEmailAddressesTest(test.TestCase):
+    def setUp(self):
+        self.users = [
+            mommy.make(
+                "core.AudienceUser",
+                email="user{}@old.com".format(n),
+                sailthru_id="sid{}".format(n),
+            )
+            for n in range(5)
+        ]
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, "pairs.csv")
+        self.write_pairs(
+            ["user{0}@old.com,user{0}@new.com".format(n) for n in range(5)]
+        )
+
+    def write_pairs(self, lines):
+        with open(self.path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def run_command(self, sailthru, **options):
+        stdout = StringIO()
+        with mock.patch.object(command, "sailthru_client", sailthru):
+            call_command(
+                "bulk_change_email_addresses",
+                file=[self.path],
+                batch_size=2,
+                rate=1000,
+                stdout=stdout,
+                **options
+            )
+        return stdout.getvalue()
+
+    def report(self):
+        with open(self.path + ".report.jsonl") as f:
+            return [json.loads(line) for line in f]
+
+    def test_change(self):
+        sailthru = SailthruStub(self.users, failing={"user3@old.com"})
+        output = self.run_command(sailthru)
+        self.assertIn("5 of 5 pairs done: 4 changed, 1 failed.", output)
+        self.assertIn("[ERROR] user3@old.com > user3@new.com", output)
+
+        for n, user in enumerate(self.users):
+            user.refresh_from_db()
+            email = "user{}@{}.com".format(n, "old" if n == 3 else "new")
+            self.assertEqual(user.email, email)
+            self.assertEqual(user.email_hash, AudienceUser.hash_email(email))
+        self.assertFalse(SyncLock.objects.exists())
+
+        statuses = {}
+        for entry in self.report():
+            statuses.setdefault(entry["old_email"], []).append(entry["status"])
+        self.assertEqual(statuses["user0@old.com"], ["sailthru_changed", "changed"])
+        self.assertEqual(statuses["user3@old.com"], ["failed"])
+
+        # a rerun only retries the failed pair
+        sailthru = SailthruStub(self.users)
+        output = self.run_command(sailthru)
+        self.assertIn("5 pairs, 4 already changed.", output)
+        self.assertEqual(sailthru.posted, ["user3@old.com"])
+        self.users[3].refresh_from_db()
+        self.assertEqual(self.users[3].email, "user3@new.com")
+
+    def test_resume_after_sailthru_change(self):
+        # a run that stopped after Sailthru changed the email, but before
+        # audb did
+        with open(self.path + ".report.jsonl", "w") as f:
+            f.write(
+                json.dumps(
+                    {
+                        "old_email": "user0@old.com",
+                        "new_email": "user0@new.com",
+                        "status": "sailthru_changed",
+                        "error": None,
+                    }
+                )
+                + '\n{"old_email": "user1'
+            )
+        sailthru = SailthruStub(self.users)
+        self.run_command(sailthru)
+        self.assertNotIn("user0@old.com", sailthru.posted)
+        self.assertEqual(len(sailthru.posted), 4)
+        self.assertEqual(
+            AudienceUser.objects.filter(email__endswith="@new.com").count(), 5
+        )
+
+    def test_resume_after_audb_change(self):
+        # a run that stopped after audb changed the email, but before it was
+        # reported
+        self.run_command(SailthruStub(self.users))
+        with open(self.path + ".report.jsonl") as f:
+            lines = [
+                line for line in f if '"user0@new.com", "status": "changed"' not in line
+            ]
+        with open(self.path + ".report.jsonl", "w") as f:
+            f.writelines(lines)
+
+        sailthru = SailthruStub(self.users)
+        output = self.run_command(sailthru)
+        self.assertIn("5 pairs, 5 already changed.", output)
+        self.assertEqual(sailthru.posted, [])
+        self.assertEqual(self.report()[-1]["status"], "changed")
+        self.assertEqual(self.report()[-1]["old_email"], "user0@old.com")
+
+    def test_locked_user(self):
+        SyncLock.objects.create(locked_instance=self.users[1])
+        sailthru = SailthruStub(self.users)
+        output = self.run_command(sailthru)
+        self.assertIn("4 changed, 1 failed.", output)
+        self.assertNotIn("user1@old.com", sailthru.posted)
+        self.assertEqual(SyncLock.objects.get().object_id, self.users[1].pk)
+
+    def test_sanity_checks(self):
+        mommy.make("core.AudienceUser", email="taken@new.com")
+        for lines, message in (
+            (["a@old.com"], "one comma-separated pair"),
+            (["user0@old.com,"], "empty emails"),
+            (
+                ["user0@old.com,a@new.com", "user0@old.com,b@new.com"],
+                "Same old email found in multiple pairs: user0@old.com",
+            ),
+            (
+                ["user0@old.com,a@new.com", "user1@old.com,a@new.com"],
+                "Same new email found in multiple pairs: a@new.com",
+            ),
+            (
+                ["user0@old.com,user1@old.com", "user1@old.com,a@new.com"],
+                "both an old and a new email: user1@old.com",
+            ),
+            (["user0@old.com,A@new.com"], "Invalid new email: A@new.com"),
+            (["nobody@old.com,a@new.com"], "does not exist in audb: nobody@old.com"),
+            (["user0@old.com,taken@new.com"], "already exists: taken@new.com"),
+        ):
+            self.write_pairs(lines)
+            with self.assertRaisesMessage(CommandError, message):
+                self.run_command(SailthruStub(self.users))
+
+    def test_sanity_check_queries(self):
+        pairs = [
+            ["user{}@old.com".format(n), "user{}@new.com".format(n)] for n in range(5)
+        ]
+        with self.assertNumQueries(1):
+            users = command.Command._sanity_check_pairs(pairs)
+        self.assertEqual(users["user2@old.com"], (self.users[2].pk, "sid2"))
@@ -0,0 +1,101 @@
+import datetime
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django import test
+from django.core.management import call_command
+from django.utils import timezone
+
+from ..management.commands import import_first_optin_from_sailthru as command
+from ..models import AudienceUser, OptoutHistory
+
+
+@test.override_settings(SAILTHRU_SYNC_SIGNALS_ENABLED=False, RAVEN_CONFIG={"dsn": None})
+class ImportFirstOptinTest(test.TestCase):
+    def setUp(self):
+        self.users = [
+            AudienceUser.objects.validate_and_create(
+                email="user{}@example.com".format(n)
+            )
+            for n in range(3)
+        ]
+        # user 2 has opted out since
+        self.users[2].record_optout(
+            AudienceUser.OPTOUT_BASIC, "Opted out", effective_date=timezone.now()
+        )
+        # user 1's cached status is stale
+        AudienceUser.objects.filter(pk=self.users[1].pk).update(sailthru_optout=None)
+
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, "profiles.csv")
+
+    def write_rows(self, rows):
+        with open(self.path, "w") as f:
+            f.write("Profile Id,Email,Profile Created Date\n")
+            for n, (email, date) in enumerate(rows):
+                f.write("{},{},{}\n".format(n, email, date))
+
+    def run_command(self, **options):
+        stdout = StringIO()
+        call_command(
+            "import_first_optin_from_sailthru",
+            file=[self.path],
+            batch_size=2,
+            stdout=stdout,
+            **options
+        )
+        return stdout.getvalue()
+
+    def imported(self, user):
+        return OptoutHistory.objects.filter(audience_user=user, comment=command.COMMENT)
+
+    def test_import(self):
+        self.write_rows(
+            [
+                ("user0@example.com", "2015/06/01 12:00:00"),
+                ("nobody@example.com", "2015/06/01 12:00:00"),
+                ("user1@example.com", "2015/06/02 12:00:00"),
+                ("user2@example.com", "2015/06/03 12:00:00"),
+                ("user0@example.com", "2015/05/01 12:00:00"),
+            ]
+        )
+        with test.override_settings(
+            SAILTHRU_SYNC_SIGNALS_ENABLED=True
+        ), mock.patch.object(command.sync_users_basic, "apply_async") as sync:
+            output = self.run_command()
+        self.assertIn("5 total rows; 4 emails found; 1 not found", output)
+
+        expected = timezone.make_aware(datetime.datetime(2015, 5, 1, 12))
+        self.assertEqual(
+            [h.effective_date for h in self.imported(self.users[0])], [expected]
+        )
+        for user in self.users:
+            user.refresh_from_db()
+        self.assertEqual(self.users[0].sailthru_optout, AudienceUser.OPTOUT_NONE)
+        self.assertEqual(self.users[1].sailthru_optout, AudienceUser.OPTOUT_NONE)
+        self.assertEqual(self.users[2].sailthru_optout, AudienceUser.OPTOUT_BASIC)
+        self.assertEqual(self.imported(self.users[2]).count(), 1)
+
+        # only the user whose cached status changed is synced, once
+        sync.assert_called_once_with([[self.users[1].pk]])
+
+    def test_rerun_moves_the_import(self):
+        self.write_rows([("user0@example.com", "2015/06/01 12:00:00")])
+        self.run_command()
+        self.write_rows([("user0@example.com", "2014/06/01 12:00:00")])
+        self.run_command()
+        self.assertEqual(
+            [h.effective_date.year for h in self.imported(self.users[0])], [2014]
+        )
+
+    def test_limit(self):
+        self.write_rows(
+            [("user{}@example.com".format(n), "2015/06/01 12:00:00") for n in range(3)]
+        )
+        output = self.run_command(limit=["2"])
+        self.assertIn("2 total rows", output)
+        self.assertFalse(self.imported(self.users[2]).exists())
@@ -0,0 +1,159 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django import test
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from model_mommy import mommy
+
+from sailthru_sync.models import SyncLock
+
+from ..management.commands import mass_delete_users as command
+from ..models import (
+    AudienceUser,
+    ListSubscriberCount,
+    Subscription,
+    SubscriptionLog,
+    UserContentHistory,
+    UserContentRollup,
+    UserInterest,
+    UserVarsHistory,
+)
+from .forms.mock_sailthru import MockedSailthruClient
+
+
+class SailthruStub(object):
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.posted = []
+
+    def __call__(self):
+        return self
+
+    def api_post(self, endpoint_name, data):
+        self.posted.append(data)
+        response = MockedSailthruClient.MockedResponse()
+        response.ok = data["id"] not in self.failing
+        return response
+
+
+@test.override_settings(SAILTHRU_SYNC_SIGNALS_ENABLED=False, RAVEN_CONFIG={"dsn": None})
+class MassDeleteUsersTest(test.TestCase):
+    def setUp(self):
+        mommy.make("core.List", slug="foo", type="list")
+        self.users = []
+        for n in range(4):
+            user = AudienceUser.objects.validate_and_create(
+                email="user{}@example.com".format(n), vars={"n": str(n)}
+            )
+            user.list_subscribe("foo")
+            self.users.append(user)
+        self.users[1].list_unsubscribe("foo")
+
+        content = mommy.make("core.AthenaContentMetadata", athena_content_id=1)
+        for user in self.users[:2]:
+            mommy.make(
+                "core.UserContentHistory",
+                email=user.email,
+                athena_content_metadata=content,
+            )
+            mommy.make(
+                "core.UserContentRollup",
+                email=user.email,
+                athena_content_metadata=content,
+                count=1,
+            )
+            mommy.make(
+                "core.UserInterest", email=user.email, kind="topic", value="defense"
+            )
+
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, "emails.csv")
+        with open(self.path, "w") as f:
+            f.write(
+                "email\nuser0@example.com\nuser1@example.com\n"
+                "nobody@example.com\nuser2@example.com\nuser0@example.com\n"
+            )
+
+    def run_command(self, sailthru, **options):
+        stdout = StringIO()
+        with mock.patch.object(command, "sailthru_client", sailthru):
+            call_command(
+                "mass_delete_users",
+                file=[self.path],
+                batch_size=2,
+                rate=1000,
+                stdout=stdout,
+                **options
+            )
+        return stdout.getvalue()
+
+    def test_delete(self):
+        sailthru = SailthruStub(failing={"user2@example.com"})
+        output = self.run_command(sailthru)
+        self.assertIn("Deleted 2 users (1 missing, 1 failed).", output)
+        self.assertIn("core.SubscriptionLog: 3", output)
+        self.assertEqual(
+            {data["id"] for data in sailthru.posted},
+            {"user0@example.com", "user1@example.com", "user2@example.com"},
+        )
+        self.assertEqual(
+            set(AudienceUser.objects.values_list("email", flat=True)),
+            {"user2@example.com", "user3@example.com"},
+        )
+        self.assertFalse(
+            UserVarsHistory.objects.filter(
+                audience_user_id__in=[self.users[0].pk, self.users[1].pk]
+            ).exists()
+        )
+        self.assertEqual(Subscription.objects.count(), 2)
+        self.assertEqual(SubscriptionLog.objects.count(), 2)
+        self.assertFalse(SyncLock.objects.exists())
+        for model in (UserContentHistory, UserContentRollup, UserInterest):
+            self.assertFalse(model.objects.exists())
+
+        counts = ListSubscriberCount.objects.get(list__slug="foo")
+        self.assertEqual((counts.active, counts.inactive), (2, 0))
+
+        with open(self.path + ".audit.jsonl") as f:
+            audit = {entry["email"]: entry for entry in map(json.loads, f)}
+        self.assertEqual(audit["user0@example.com"]["status"], "deleted")
+        self.assertEqual(audit["user0@example.com"]["user_id"], self.users[0].pk)
+        self.assertEqual(audit["nobody@example.com"]["status"], "missing")
+        self.assertEqual(audit["user2@example.com"]["status"], "failed")
+
+    def test_dry_run(self):
+        sailthru = SailthruStub()
+        output = self.run_command(sailthru, dry_run=True)
+        self.assertIn("Would delete 3 users (1 missing, 0 failed).", output)
+        self.assertIn("core.AudienceUser: 3", output)
+        self.assertIn("core.Subscription: 3", output)
+        self.assertIn("core.UserInterest: 2", output)
+        self.assertIn("core.UserContentHistory: 2", output)
+        self.assertEqual(sailthru.posted, [])
+        self.assertEqual(AudienceUser.objects.count(), 4)
+        self.assertFalse(os.path.exists(self.path + ".audit.jsonl"))
+
+    def test_locked_user(self):
+        SyncLock.objects.create(locked_instance=self.users[0])
+        output = self.run_command(SailthruStub())
+        self.assertIn("Deleted 2 users (1 missing, 1 failed).", output)
+        self.assertTrue(AudienceUser.objects.filter(pk=self.users[0].pk).exists())
+        self.assertEqual(SyncLock.objects.get().object_id, self.users[0].pk)
+
+    def test_delete_many_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            counts = AudienceUser.objects.delete_many(user.pk for user in self.users)
+        # the users' emails, one DELETE per table keyed by email, one UPDATE
+        # of the subscriber counts, then one DELETE per table
+        self.assertEqual(len([q for q in queries if "SAVEPOINT" not in q["sql"]]), 13)
+        self.assertEqual(counts["core.AudienceUser"], 4)
+        self.assertEqual(counts["core.UserContentRollup"], 2)
+        self.assertEqual(counts["core.OptoutHistory"], 4)
+        self.assertFalse(AudienceUser.objects.exists())
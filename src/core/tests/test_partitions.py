@@ -0,0 +1,134 @@
+import datetime
+from io import StringIO
+
+from django import test
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.utils import timezone
+from model_mommy import mommy
+
+from .. import models as core_models, partitions
+
+
+def month(year, month):
+    return datetime.datetime(year, month, 1, tzinfo=timezone.utc)
+
+
+@test.override_settings(SAILTHRU_SYNC_SIGNALS_ENABLED=False, RAVEN_CONFIG={"dsn": None})
+class SubscriptionLogPartitionsTest(test.TestCase):
+    def setUp(self):
+        self.list = mommy.make("core.List", slug="foo", type="list")
+        self.user = mommy.make("core.AudienceUser", email="a@example.com")
+        self.user.list_subscribe("foo")
+        # the log's foreign keys are deferred; partitions can't be changed
+        # while their checks are pending
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+    def partition_of(self, entry):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT tableoid::regclass::text FROM core_subscriptionlog "
+                "WHERE id = %s",
+                [entry.pk],
+            )
+            return cursor.fetchone()[0]
+
+    def test_migrated_layout(self):
+        names = [partition.name for partition in partitions.list_partitions()]
+        self.assertEqual(names[0], "core_subscriptionlog_legacy")
+        self.assertEqual(len(names), partitions.MONTHS_AHEAD + 1)
+
+        legacy = partitions.list_partitions()[0]
+        self.assertIsNone(legacy.start)
+        self.assertEqual(
+            legacy.end, partitions.add_months(partitions.month_start(timezone.now()), 1)
+        )
+        self.assertEqual(partitions.missing_partitions(), [])
+
+        entry = core_models.SubscriptionLog.objects.get()
+        self.assertEqual(self.partition_of(entry), "core_subscriptionlog_legacy")
+
+    def test_ensure_partitions(self):
+        now = month(2100, 1)
+        self.assertEqual(
+            partitions.ensure_partitions(months_ahead=1, now=now),
+            ["core_subscriptionlog_p2100_01", "core_subscriptionlog_p2100_02"],
+        )
+        self.assertEqual(partitions.ensure_partitions(months_ahead=1, now=now), [])
+
+        entry = core_models.SubscriptionLog.objects.get()
+        core_models.SubscriptionLog.objects.filter(pk=entry.pk).update(
+            timestamp=month(2100, 2) + datetime.timedelta(days=3)
+        )
+        self.assertEqual(self.partition_of(entry), "core_subscriptionlog_p2100_02")
+
+    def test_new_partition_takes_rows_from_default(self):
+        entry = core_models.SubscriptionLog.objects.get()
+        core_models.SubscriptionLog.objects.filter(pk=entry.pk).update(
+            timestamp=month(2100, 5) + datetime.timedelta(hours=1)
+        )
+        self.assertEqual(self.partition_of(entry), "core_subscriptionlog_default")
+
+        partitions.create_partition(month(2100, 5))
+        self.assertEqual(self.partition_of(entry), "core_subscriptionlog_p2100_05")
+        self.assertEqual(
+            list(self.user.subscription_log.values_list("pk", flat=True)), [entry.pk]
+        )
+
+    def test_retire_partitions(self):
+        partitions.create_partition(month(2100, 5))
+        partitions.create_partition(month(2100, 6))
+        expired = [
+            partition.name
+            for partition in partitions.expired_partitions(month(2100, 6))
+        ]
+        self.assertEqual(expired[0], "core_subscriptionlog_legacy")
+        self.assertEqual(expired[-1], "core_subscriptionlog_p2100_05")
+
+        retired = partitions.retire_partitions(
+            month(2100, 6), archive_schema="subscription_log_archive"
+        )
+        self.assertEqual(retired, expired)
+        self.assertEqual(
+            [partition.name for partition in partitions.list_partitions()],
+            ["core_subscriptionlog_p2100_06"],
+        )
+        self.assertFalse(core_models.SubscriptionLog.objects.exists())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM subscription_log_archive.core_subscriptionlog_legacy"
+            )
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_command(self):
+        out = StringIO()
+        call_command(
+            "subscription_log_partitions",
+            months_ahead=partitions.MONTHS_AHEAD + 1,
+            retain_months=1,
+            dry_run=True,
+            stdout=out,
+        )
+        last = partitions.add_months(
+            partitions.month_start(timezone.now()), partitions.MONTHS_AHEAD + 1
+        )
+        self.assertEqual(
+            out.getvalue(),
+            "Would create core_subscriptionlog_p{:%Y_%m}\n".format(last),
+        )
+
+        out = StringIO()
+        call_command(
+            "subscription_log_partitions",
+            months_ahead=partitions.MONTHS_AHEAD + 1,
+            stdout=out,
+        )
+        self.assertEqual(
+            out.getvalue(), "Created core_subscriptionlog_p{:%Y_%m}\n".format(last)
+        )
+        self.assertEqual(len(partitions.list_partitions()), partitions.MONTHS_AHEAD + 2)
+
+    def test_prepare_partitioned_table(self):
+        with self.assertRaises(CommandError):
+            call_command("subscription_log_partitions", prepare=True)
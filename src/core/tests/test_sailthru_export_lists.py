@@ -0,0 +1,120 @@
+import csv
+import gzip
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django import test
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from model_mommy import mommy
+
+from ..management.commands import sailthru_export_lists as command
+from .forms.mock_sailthru import MockedSailthruClient
+
+
+class SailthruStub(object):
+    def __init__(self, lists, counts=None, ok=True):
+        self.lists = lists
+        self.counts = counts or {}
+        self.ok = ok
+        self.requested = []
+
+    def __call__(self):
+        return self
+
+    def api_get(self, endpoint_name, params):
+        self.requested.append(params)
+        response = MockedSailthruClient.MockedResponse()
+        response.ok = self.ok
+        if "list" in params:
+            email_count, valid_count = self.counts[params["list"]]
+            response.body = {"email_count": email_count, "valid_count": valid_count}
+        else:
+            response.body = {"lists": self.lists}
+        return response
+
+
+def sailthru_list(name, email_count, valid_count=None):
+    return {
+        "name": name,
+        "list_id": "id-" + name,
+        "type": "normal",
+        "email_count": email_count,
+        "valid_count": email_count if valid_count is None else valid_count,
+        "create_time": "Tue, 01 Mar 2016 10:00:00 -0500",
+    }
+
+
+@test.override_settings(SAILTHRU_SYNC_SIGNALS_ENABLED=False, RAVEN_CONFIG={"dsn": None})
+class SailthruExportListsTest(test.TestCase):
+    def setUp(self):
+        for slug in ("alpha", "beta", "gamma"):
+            mommy.make("core.List", slug=slug, type="list")
+        mommy.make("core.List", slug="old", type="list", archived=True)
+        for n in range(3):
+            user = mommy.make("core.AudienceUser", email="user{}@example.com".format(n))
+            user.list_subscribe("alpha")
+            if n:
+                user.list_subscribe("beta")
+        user.list_unsubscribe("beta")
+        mommy.make("core.AudienceUser", email=None).list_subscribe("alpha")
+
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.output = os.path.join(self.directory, "lists.csv.gz")
+        self.sailthru = SailthruStub(
+            [
+                sailthru_list("alpha", 3),
+                sailthru_list("beta", 2),
+                sailthru_list("old", 0),
+                sailthru_list("stray", 7),
+            ],
+            counts={"alpha": (3, 3), "beta": (1, 1), "old": (0, 0), "stray": (7, 6)},
+        )
+
+    def run_command(self, **options):
+        stdout = StringIO()
+        with mock.patch.object(command, "sailthru_client", self.sailthru):
+            call_command(
+                "sailthru_export_lists", output=self.output, stdout=stdout, **options
+            )
+        with gzip.open(self.output, "rt") as f:
+            return {row["name"]: row for row in csv.DictReader(f)}, stdout.getvalue()
+
+    def test_export(self):
+        with self.assertNumQueries(3):
+            rows, output = self.run_command()
+        self.assertIn("Wrote 5 lists", output)
+        self.assertEqual(
+            {name: row["status"] for name, row in rows.items()},
+            {
+                "alpha": "match",
+                "beta": "drift",
+                "old": "match",
+                "stray": "missing_in_audb",
+                "gamma": "missing_in_sailthru",
+            },
+        )
+        self.assertEqual(
+            (rows["beta"]["email_count"], rows["beta"]["audb_active"]), ("2", "1")
+        )
+        self.assertEqual(rows["beta"]["difference"], "1")
+        self.assertEqual(rows["alpha"]["create_time"], "2016-03-01 10:00:00-05:00")
+        self.assertEqual(len(self.sailthru.requested), 1)
+
+    def test_counts_and_drift_only(self):
+        rows, output = self.run_command(counts=True, drift_only=True, rate=1000)
+        self.assertEqual(set(rows), {"stray", "gamma"})
+        self.assertEqual(rows["stray"]["valid_count"], "6")
+        self.assertEqual(
+            sorted(params["list"] for params in self.sailthru.requested[1:]),
+            ["alpha", "beta", "old", "stray"],
+        )
+
+    def test_sailthru_error(self):
+        self.sailthru.ok = False
+        with self.assertRaises(CommandError):
+            self.run_command()
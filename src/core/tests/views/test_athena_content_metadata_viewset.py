@@ -0,0 +1,195 @@
+import datetime
+import json
+
+from django.db import connection
+from django.utils import timezone
+from model_mommy import mommy
+from rest_framework import status
+from rest_framework import test as rest_test
+
+from ... import models as core_models
+
+
+class AthenaContentMetadataViewsetTests(rest_test.APITestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from rest_framework.authtoken.models import Token
+
+        u = User.objects.create(username="test")
+        t = Token.objects.create(user=u)
+        self.client.force_authenticate(user=u, token=t)
+
+        self.content_type = mommy.make(
+            "core.AthenaContentType", name="post_manager.post"
+        )
+        mommy.make(
+            "core.AthenaContentMetadata",
+            athena_content_id=1,
+            athena_content_type=self.content_type,
+            date_created=timezone.now(),
+            categories={},
+        )
+
+    def line(self, athena_content_id, **kwargs):
+        data = {
+            "athena_content_id": athena_content_id,
+            "athena_content_type": "post_manager.post",
+            "date_created": "2020-01-01T00:00:00Z",
+            "title": "Content",
+            "slug": "content",
+            "absolute_url": "https://www.example.com/",
+            "site_name": "govexec",
+            "organization": "govexec",
+        }
+        data.update(kwargs)
+        return json.dumps(data)
+
+    def test_bulk(self):
+        body = "\n".join([self.line(1), self.line(2), self.line(3, slug="not a slug")])
+        r = self.client.post(
+            "/api/athena-content-metadata/bulk",
+            body,
+            content_type="application/x-ndjson",
+        )
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        data = r.json()
+        self.assertEqual((data["created"], data["updated"]), (1, 1))
+        self.assertEqual(len(data["errors"]), 1)
+        self.assertEqual(data["errors"][0]["line"], 3)
+        self.assertIn("slug", data["errors"][0]["errors"])
+        self.assertEqual(
+            set(
+                core_models.AthenaContentMetadata.objects.values_list(
+                    "athena_content_id", flat=True
+                )
+            ),
+            {1, 2},
+        )
+
+    def test_bulk_invalid_utf8(self):
+        latin1 = self.line(3).replace("Content", "Caf\xe9").encode("latin-1")
+        body = b"\n".join([self.line(2).encode("utf-8"), latin1])
+        r = self.client.post(
+            "/api/athena-content-metadata/bulk",
+            body,
+            content_type="application/x-ndjson",
+        )
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        data = r.json()
+        self.assertEqual(data["created"], 1)
+        self.assertEqual(data["errors"][0]["line"], 2)
+        self.assertIn("Invalid UTF-8", data["errors"][0]["errors"][0])
+
+    def test_bulk_requires_authentication(self):
+        self.client.force_authenticate(user=None)
+        r = self.client.post(
+            "/api/athena-content-metadata/bulk",
+            self.line(2),
+            content_type="application/x-ndjson",
+        )
+        self.assertIn(
+            r.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN)
+        )
+
+
+class AthenaContentMetadataSearchTests(rest_test.APITestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from rest_framework.authtoken.models import Token
+
+        u = User.objects.create(username="test")
+        t = Token.objects.create(user=u)
+        self.client.force_authenticate(user=u, token=t)
+
+        content_type = mommy.make("core.AthenaContentType", name="post_manager.post")
+        now = timezone.now()
+        self.content = {}
+        for n, (site, topics, authors, categories) in enumerate(
+            (
+                ("govexec", ["budget", "defense"], ["Ann"], {"primary": "news"}),
+                ("govexec", ["budget"], ["Bob"], {"primary": "oversight"}),
+                (
+                    "nextgov",
+                    ["defense", "cyber"],
+                    ["Ann", "Bob"],
+                    {"primary": "cyber", "secondary": ["news"]},
+                ),
+                ("nextgov", [], None, {}),
+            )
+        ):
+            self.content[n] = mommy.make(
+                "core.AthenaContentMetadata",
+                athena_content_id=n,
+                athena_content_type=content_type,
+                date_created=now - datetime.timedelta(days=n),
+                date_published=datetime.datetime(
+                    2020, 1, 10 + n, 12, tzinfo=timezone.utc
+                ),
+                site_name=site,
+                topics=topics,
+                authors=authors,
+                categories=categories,
+            )
+
+    def search(self, query):
+        r = self.client.get("/api/athena-content-metadata/search?" + query)
+        self.assertEqual(r.status_code, status.HTTP_200_OK, r.content)
+        return [item["athena_content_id"] for item in r.json()["results"]]
+
+    def test_array_containment_and_overlap(self):
+        self.assertEqual(self.search("topics=budget"), [0, 1])
+        self.assertEqual(self.search("topics=budget,defense"), [0])
+        self.assertEqual(self.search("topics__overlap=budget,cyber"), [0, 1, 2])
+        self.assertEqual(self.search("authors=Ann&topics=defense"), [0, 2])
+        self.assertEqual(self.search("authors__overlap=Bob&site_name=nextgov"), [2])
+
+    def test_categories(self):
+        self.assertEqual(self.search("category=news"), [0, 2])
+        self.assertEqual(self.search("primary_category=news"), [0])
+
+    def test_publish_dates(self):
+        self.assertEqual(
+            self.search("published_after=2020-01-11&published_before=2020-01-13"),
+            [1, 2],
+        )
+        r = self.client.get(
+            "/api/athena-content-metadata/search?published_after=2020-13-01"
+        )
+        self.assertEqual(r.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("published_after", r.json())
+
+    def test_pages(self):
+        url = "/api/athena-content-metadata/search?page_size=3"
+        seen = []
+        while url:
+            r = self.client.get(url)
+            seen.extend(item["athena_content_id"] for item in r.json()["results"])
+            url = r.json()["next"]
+        self.assertEqual(seen, [0, 1, 2, 3])
+
+    def test_list_filters(self):
+        r = self.client.get("/api/athena-content-metadata?topics=defense")
+        self.assertEqual(r.json()["count"], 2)
+
+    def assertUsesIndex(self, queryset, index):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute("EXPLAIN " + sql, params)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        self.assertIn(index, plan)
+
+    def test_searches_use_the_gin_indexes(self):
+        metadata = core_models.AthenaContentMetadata.objects
+        self.assertUsesIndex(
+            metadata.filter(topics__overlap=["budget"]),
+            "core_athenacontentmetadata_topics_gin",
+        )
+        self.assertUsesIndex(
+            metadata.filter(authors__contains=["Ann"]),
+            "core_athenacontentmetadata_authors_gin",
+        )
+        self.assertUsesIndex(
+            metadata.filter(categories__contains={"primary": "news"}),
+            "core_athenacontentmetadata_categories_gin",
+        )
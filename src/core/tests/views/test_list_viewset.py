@@ -162,3 +162,15 @@ class ListViewsetTests(rest_test.APITestCase):
 
         r = self.client.delete("/api/lists/{}".format(r.json().get("id")))
         self.assertEqual(r.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_list_subscriber_counts(self):
+        list_ = mommy.make("core.List", slug="foo", type="list")
+        user = mommy.make("core.AudienceUser", email="a@a.com")
+        user.list_subscribe("foo")
+
+        r = self.client.get("/api/lists/{}".format(list_.pk))
+        self.assertNotIn("subscribers_active", r.json())
+
+        r = self.client.get("/api/lists?counts=true")
+        self.assertEqual(r.json()["results"][0]["subscribers_active"], 1)
+        self.assertEqual(r.json()["results"][0]["subscribers_inactive"], 0)
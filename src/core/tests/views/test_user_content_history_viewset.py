@@ -0,0 +1,53 @@
+import datetime
+
+from django.utils import timezone
+from model_mommy import mommy
+from rest_framework import status
+from rest_framework import test as rest_test
+
+from ... import models as core_models
+
+
+class UserContentHistoryViewsetTests(rest_test.APITestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from rest_framework.authtoken.models import Token
+
+        u = User.objects.create(username="test")
+        t = Token.objects.create(user=u)
+        self.client.force_authenticate(user=u, token=t)
+
+        content_type = mommy.make("core.AthenaContentType", name="post_manager.post")
+        self.content = mommy.make(
+            "core.AthenaContentMetadata",
+            athena_content_id=1,
+            athena_content_type=content_type,
+            date_created=timezone.now(),
+            categories={},
+        )
+
+    def test_list_by_email_includes_rollups(self):
+        old = core_models.UserContentHistory.objects.create(
+            email="a@example.com", athena_content_metadata=self.content
+        )
+        core_models.UserContentHistory.objects.filter(pk=old.pk).update(
+            timestamp=timezone.now() - datetime.timedelta(days=365),
+            interests_ingested=True,
+        )
+        core_models.UserContentHistory.objects.compact(
+            timezone.now() - datetime.timedelta(days=30), archive=False
+        )
+        recent = core_models.UserContentHistory.objects.create(
+            email="a@example.com", athena_content_metadata=self.content
+        )
+
+        r = self.client.get("/api/user-content-history?email=a@example.com")
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        data = r.json()
+        self.assertEqual([event["id"] for event in data["results"]], [recent.pk])
+        self.assertEqual(len(data["rollups"]), 1)
+        self.assertEqual(data["rollups"][0]["athena_content_metadata"], 1)
+        self.assertEqual(data["rollups"][0]["count"], 1)
+
+        r = self.client.get("/api/user-content-history")
+        self.assertNotIn("rollups", r.json())
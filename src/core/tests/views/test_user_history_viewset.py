@@ -0,0 +1,166 @@
+from datetime import timedelta
+
+from django import test
+from django.utils import timezone
+from model_mommy import mommy
+from rest_framework import status
+from rest_framework import test as rest_test
+
+
+@test.override_settings(AUDIENCE_USER_NESTED_LIMIT=3)
+class UserHistoryViewsetTests(rest_test.APITestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from rest_framework.authtoken.models import Token
+
+        u = User.objects.create(username="test")
+        t = Token.objects.create(user=u)
+        self.client.force_authenticate(user=u, token=t)
+
+    def make_user(self, email, history=5):
+        user = mommy.make("core.AudienceUser", email=email, vars={"n": "0"})
+        for n in range(1, history):
+            user.vars = {"n": str(n)}
+            user.save()
+
+        now = timezone.now()
+        for n in range(history):
+            product = mommy.make(
+                "core.Product",
+                slug="{}{}".format(email.split("@")[0], n),
+                brand="Govexec",
+                type="event",
+            )
+            mommy.make(
+                "core.ProductAction",
+                audience_user=user,
+                product=product,
+                type="registered",
+                timestamp=now - timedelta(days=n),
+            )
+
+        list_ = mommy.make("core.List", slug=email.split("@")[0], type="list")
+        user.list_subscribe(list_.slug)
+        for n in range(history - 1):
+            if n % 2:
+                user.list_subscribe(list_.slug)
+            else:
+                user.list_unsubscribe(list_.slug)
+        return user
+
+    def test_user_embeds_latest_history(self):
+        user = self.make_user("a@a.com")
+        r = self.client.get("/api/audience-users/{}".format(user.pk))
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        data = r.json()
+
+        self.assertEqual(
+            [h["vars"]["n"] for h in data["vars_history"]], ["4", "3", "2"]
+        )
+        self.assertEqual(
+            [a["product"]["slug"] for a in data["product_actions"]], ["a0", "a1", "a2"]
+        )
+        self.assertEqual(
+            data["subscription_log"],
+            [str(entry) for entry in user.subscription_log.order_by("timestamp", "id")][
+                -3:
+            ],
+        )
+        self.assertTrue(
+            data["vars_history_url"].endswith(
+                "/api/audience-users/{}/vars-history".format(user.pk)
+            )
+        )
+        self.assertTrue(
+            data["subscription_log_url"].endswith(
+                "/api/audience-users/{}/subscription-log".format(user.pk)
+            )
+        )
+        self.assertTrue(
+            data["product_actions_url"].endswith(
+                "/api/audience-users/{}/product-actions?page_size=3".format(user.pk)
+            )
+        )
+
+    def test_user_list_embeds_latest_history_per_user(self):
+        users = [self.make_user("a@a.com"), self.make_user("b@b.com", history=2)]
+        # users, the COUNT(*), source signups, subscriptions, and the latest
+        # vars history, subscription log and product actions (with details,
+        # product subtypes and topics) for the whole page
+        with self.assertNumQueries(10):
+            r = self.client.get("/api/audience-users")
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        results = {user["id"]: user for user in r.json()["results"]}
+
+        self.assertEqual(len(results[users[0].pk]["vars_history"]), 3)
+        self.assertEqual(len(results[users[0].pk]["product_actions"]), 3)
+        self.assertEqual(len(results[users[0].pk]["subscription_log"]), 3)
+        self.assertEqual(len(results[users[1].pk]["vars_history"]), 2)
+        self.assertEqual(len(results[users[1].pk]["product_actions"]), 2)
+        self.assertEqual(len(results[users[1].pk]["subscription_log"]), 2)
+
+    def test_vars_history_pages(self):
+        user = self.make_user("a@a.com")
+        self.make_user("b@b.com")
+        url = "/api/audience-users/{}/vars-history?page_size=2".format(user.pk)
+
+        seen = []
+        while url:
+            r = self.client.get(url)
+            self.assertEqual(r.status_code, status.HTTP_200_OK)
+            seen.extend(h["vars"]["n"] for h in r.json()["results"])
+            url = r.json()["next"]
+        self.assertEqual(seen, ["4", "3", "2", "1", "0"])
+
+    def test_subscription_log_pages(self):
+        user = self.make_user("a@a.com")
+        r = self.client.get(
+            "/api/audience-users/{}/subscription-log?page_size=10".format(user.pk)
+        )
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        entries = r.json()["results"]
+        self.assertEqual(len(entries), 5)
+        self.assertEqual({entry["list"] for entry in entries}, {"a"})
+        self.assertEqual(entries[-1]["action"], "subscribe")
+
+    def test_subscription_log_pages_match_embedded_entries(self):
+        user = self.make_user("a@a.com")
+        # the newest entries by timestamp are not the newest by id, and two tie
+        entries = list(user.subscription_log.order_by("id"))
+        now = timezone.now()
+        for entry, days_ago in zip(entries, [0, 0, 3, 2, 1]):
+            type(entry).objects.filter(pk=entry.pk).update(
+                timestamp=now - timedelta(days=days_ago)
+            )
+
+        r = self.client.get("/api/audience-users/{}".format(user.pk))
+        embedded = r.json()["subscription_log"]
+        r = self.client.get(
+            "/api/audience-users/{}/subscription-log?page_size=3".format(user.pk)
+        )
+        page = [entry["id"] for entry in r.json()["results"]]
+        self.assertEqual(page, [entries[1].pk, entries[0].pk, entries[4].pk])
+        self.assertEqual(
+            embedded,
+            [str(user.subscription_log.get(pk=pk)) for pk in reversed(page)],
+        )
+
+    def test_history_of_missing_user(self):
+        r = self.client.get("/api/audience-users/999999/vars-history")
+        self.assertEqual(r.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_product_actions_page_on_request(self):
+        user = self.make_user("a@a.com")
+        r = self.client.get("/api/audience-users/{}/product-actions".format(user.pk))
+        self.assertEqual(len(r.json()), 5)
+
+        r = self.client.get(
+            "/api/audience-users/{}/product-actions?page_size=3".format(user.pk)
+        )
+        self.assertEqual(
+            [a["product"]["slug"] for a in r.json()["results"]], ["a0", "a1", "a2"]
+        )
+        r = self.client.get(r.json()["next"])
+        self.assertEqual(
+            [a["product"]["slug"] for a in r.json()["results"]], ["a3", "a4"]
+        )
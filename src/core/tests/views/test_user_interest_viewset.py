@@ -0,0 +1,51 @@
+from django.utils import timezone
+from rest_framework import status
+from rest_framework import test as rest_test
+
+from ... import models as core_models
+
+
+class UserInterestViewsetTests(rest_test.APITestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from rest_framework.authtoken.models import Token
+
+        u = User.objects.create(username="test")
+        t = Token.objects.create(user=u)
+        self.client.force_authenticate(user=u, token=t)
+
+        now = timezone.now()
+        # scores as if viewed now: log2 of one view's weight, plus a bit
+        base = (
+            now - core_models.UserInterest.objects.score_epoch
+        ).total_seconds() / core_models.UserInterest.objects.half_life().total_seconds()
+        for n, (kind, value) in enumerate(
+            [("topic", "defense"), ("topic", "budget"), ("author", "Jane Doe")]
+        ):
+            core_models.UserInterest.objects.create(
+                email="a@example.com",
+                kind=kind,
+                value=value,
+                score=base + n,
+                updated=now,
+            )
+        core_models.UserInterest.objects.create(
+            email="b@example.com", kind="topic", value="other", score=base, updated=now
+        )
+
+    def test_top_interests(self):
+        with self.assertNumQueries(1):
+            r = self.client.get("/api/user-interests?email=a@example.com&limit=2")
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(i["kind"], i["value"]) for i in r.json()],
+            [("author", "Jane Doe"), ("topic", "budget")],
+        )
+        self.assertAlmostEqual(r.json()[0]["weight"], 4, places=2)
+
+        r = self.client.get("/api/user-interests?email=a@example.com&kind=topic")
+        self.assertEqual([i["value"] for i in r.json()], ["budget", "defense"])
+
+    def test_email_required(self):
+        r = self.client.get("/api/user-interests")
+        self.assertEqual(r.status_code, status.HTTP_400_BAD_REQUEST)
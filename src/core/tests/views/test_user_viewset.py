@@ -1,7 +1,9 @@
+import json
 from datetime import datetime
 
 
 import isodate
+from django import test
 from django.utils.timezone import localtime, now
 from model_mommy import mommy
 from rest_framework import status
@@ -151,10 +153,13 @@ class UserViewsetTests(rest_test.APITestCase):
             "sailthru_id",
             "vars",
             "vars_history",
+            "vars_history_url",
             "source_signups",
             "subscriptions",
             "subscription_log",
+            "subscription_log_url",
             "product_actions",
+            "product_actions_url",
             "sailthru_optout",
         ]
         self.assertCountEqual(user.keys(), expected_keys)
@@ -307,3 +312,205 @@ class UserViewsetTests(rest_test.APITestCase):
         user = mommy.make("core.AudienceUser", email="a@a.com")
         r = self.client.delete("/api/audience-users/{}".format(user.pk), format="json")
         self.assertEqual(r.status_code, status.HTTP_501_NOT_IMPLEMENTED)
+
+    def test_list_users_filter_no_match(self):
+        mommy.make("core.AudienceUser", email="a@a.com")
+        r = self.client.get("/api/audience-users?email=b@b.com")
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            r.json(), {"count": 0, "next": None, "previous": None, "results": []}
+        )
+
+    def test_user_sparse_fields(self):
+        user = mommy.make("core.AudienceUser", email="a@a.com")
+        with self.assertNumQueries(1):
+            r = self.client.get("/api/audience-users?email=a@a.com&fields=id,email")
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        self.assertEqual(r.json()["results"], [{"id": user.pk, "email": "a@a.com"}])
+
+    def test_user_sparse_nested_fields(self):
+        user = mommy.make("core.AudienceUser", email="a@a.com")
+        user.list_subscribe(mommy.make("core.List", slug="foo", type="list").slug)
+        product = mommy.make("core.Product", slug="foo", brand="Govexec", type="event")
+        mommy.make(
+            "core.ProductAction", audience_user=user, product=product, type="registered"
+        )
+        # the user, their subscriptions joined to their lists
+        with self.assertNumQueries(2):
+            r = self.client.get(
+                "/api/audience-users/{}?fields=id,subscriptions.list.slug".format(
+                    user.pk
+                )
+            )
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            r.json(), {"id": user.pk, "subscriptions": [{"list": {"slug": "foo"}}]}
+        )
+
+    def test_user_subscription_log(self):
+        user = mommy.make("core.AudienceUser", email="a@a.com")
+        for slug in ("foo", "bar"):
+            user.list_subscribe(mommy.make("core.List", slug=slug, type="list").slug)
+        user.list_unsubscribe("foo")
+        expected = [str(entry) for entry in user.subscription_log.order_by("id")]
+
+        # the user, and their latest log entries with subscriptions and lists
+        with self.assertNumQueries(2):
+            r = self.client.get(
+                "/api/audience-users/{}?fields=subscription_log".format(user.pk)
+            )
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        self.assertEqual(r.json(), {"subscription_log": expected})
+
+        r = self.client.get("/api/audience-users/{}".format(user.pk))
+        self.assertEqual(r.json()["subscription_log"], expected)
+
+    def test_list_users_filter_email_hash(self):
+        user = mommy.make("core.AudienceUser", email="a@a.com")
+        mommy.make("core.AudienceUser", email="b@b.com")
+        r = self.client.get(
+            "/api/audience-users?email_hash={}".format(user.email_hash.upper())
+        )
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        self.assertEqual(r.json()["count"], 1)
+        self.assertEqual(r.json()["results"][0]["email"], "a@a.com")
+
+        r = self.client.get("/api/audience-users?email_hash=" + "0" * 32)
+        self.assertEqual(r.json()["count"], 0)
+
+    def test_resolve_hashes(self):
+        users = [
+            mommy.make("core.AudienceUser", email=email)
+            for email in ("a@a.com", "b@b.com", "c@c.com")
+        ]
+        unknown = AudienceUser.hash_email("nobody@example.com")
+        with self.assertNumQueries(1):
+            r = self.client.post(
+                "/api/audience-users/resolve-hashes",
+                {"email_hashes": [users[0].email_hash, users[2].email_hash, unknown]},
+                format="json",
+            )
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            {(u["email_hash"], u["id"], u["email"]) for u in r.json()["results"]},
+            {(user.email_hash, user.pk, user.email) for user in (users[0], users[2])},
+        )
+        self.assertEqual(r.json()["unresolved"], [unknown])
+
+    def test_resolve_hashes_invalid(self):
+        for payload in ({}, {"email_hashes": "abc"}, {"email_hashes": [1]}, ["abc"]):
+            r = self.client.post(
+                "/api/audience-users/resolve-hashes", payload, format="json"
+            )
+            self.assertEqual(r.status_code, status.HTTP_400_BAD_REQUEST, payload)
+
+        r = self.client.post(
+            "/api/audience-users/resolve-hashes",
+            {"email_hashes": ["0" * 32] * 1001},
+            format="json",
+        )
+        self.assertEqual(r.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk(self):
+        user = AudienceUser.objects.validate_and_create(
+            email="a@a.com", vars={"a": "1"}
+        )
+        body = "\n".join(
+            [
+                json.dumps({"email": "a@a.com", "vars": {"b": "2"}}),
+                json.dumps(
+                    {
+                        "email": "b@b.com",
+                        "omeda_id": "123",
+                        "source_signups": [{"name": "import"}],
+                    }
+                ),
+                json.dumps({"email": "C@c.com"}),
+            ]
+        )
+        r = self.client.post(
+            "/api/audience-users/bulk", body, content_type="application/x-ndjson"
+        )
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        data = r.json()
+        self.assertEqual(
+            (data["created"], data["updated"], data["unchanged"]), (1, 1, 0)
+        )
+        self.assertEqual([error["line"] for error in data["errors"]], [3])
+        user.refresh_from_db()
+        self.assertEqual(user.vars, {"a": "1", "b": "2"})
+        created = AudienceUser.objects.get(email="b@b.com")
+        self.assertEqual(created.omeda_id, "123")
+        self.assertEqual(
+            list(created.source_signups.values_list("name", flat=True)), ["import"]
+        )
+
+    def test_lookup_by_email(self):
+        users = [
+            mommy.make("core.AudienceUser", email=email, omeda_id=str(n))
+            for n, email in enumerate(("a@a.com", "b@b.com", "c@c.com"))
+        ]
+        with self.assertNumQueries(1):
+            r = self.client.post(
+                "/api/audience-users/lookup",
+                {"emails": ["c@c.com", " A@a.com", "x@x.com", "x@x.com"]},
+                format="json",
+            )
+        self.assertEqual(r.status_code, status.HTTP_200_OK)
+        results = r.json()["results"]
+        self.assertEqual([u["id"] for u in results], [users[0].pk, users[2].pk])
+        self.assertEqual(
+            set(results[0]),
+            {
+                "id",
+                "email",
+                "email_hash",
+                "omeda_id",
+                "sailthru_id",
+                "sailthru_optout",
+                "vars",
+            },
+        )
+        self.assertEqual(r.json()["not_found"], ["x@x.com"])
+
+    def test_lookup_by_id_and_omeda_id_with_fields(self):
+        user = mommy.make("core.AudienceUser", email="a@a.com", omeda_id="42")
+        user.list_subscribe(mommy.make("core.List", slug="foo", type="list").slug)
+
+        r = self.client.post(
+            "/api/audience-users/lookup",
+            {
+                "ids": [user.pk, user.pk + 1000],
+                "fields": "email,subscriptions.list.slug",
+            },
+            format="json",
+        )
+        self.assertEqual(
+            r.json(),
+            {
+                "results": [
+                    {"email": "a@a.com", "subscriptions": [{"list": {"slug": "foo"}}]}
+                ],
+                "not_found": [user.pk + 1000],
+            },
+        )
+
+        r = self.client.post(
+            "/api/audience-users/lookup?fields=id",
+            {"omeda_ids": ["42", "43"]},
+            format="json",
+        )
+        self.assertEqual(r.json(), {"results": [{"id": user.pk}], "not_found": ["43"]})
+
+    @test.override_settings(AUDIENCE_USER_LOOKUP_LIMIT=2)
+    def test_lookup_invalid(self):
+        for payload in (
+            {},
+            {"emails": ["a@a.com"], "ids": [1]},
+            {"emails": "a@a.com"},
+            {"ids": ["one"]},
+            {"ids": [1, 2, 3]},
+            ["a@a.com"],
+        ):
+            r = self.client.post("/api/audience-users/lookup", payload, format="json")
+            self.assertEqual(r.status_code, status.HTTP_400_BAD_REQUEST, payload)
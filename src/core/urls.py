@@ -14,6 +14,9 @@ user_content_history_router.register(
     "user-content-history", api_views.UserContentHistoryViewSet
 )
 
+user_interests_router = nested_routers.SimpleRouter(trailing_slash=False)
+user_interests_router.register("user-interests", api_views.UserInterestViewSet)
+
 
 audienceusers_router = nested_routers.SimpleRouter(trailing_slash=False)
 audienceusers_router.register(r"audience-users", api_views.AudienceUserViewSet)
@@ -31,6 +34,18 @@ product_actions_router = nested_routers.NestedSimpleRouter(
 product_actions_router.register("product-actions", api_views.ProductActionsViewset)
 
 
+vars_history_router = nested_routers.NestedSimpleRouter(
+    audienceusers_router, "audience-users", lookup="audienceuser", trailing_slash=False
+)
+vars_history_router.register("vars-history", api_views.UserVarsHistoryViewset)
+
+
+subscription_log_router = nested_routers.NestedSimpleRouter(
+    audienceusers_router, "audience-users", lookup="audienceuser", trailing_slash=False
+)
+subscription_log_router.register("subscription-log", api_views.SubscriptionLogViewset)
+
+
 optouthistory_router = nested_routers.NestedSimpleRouter(
     audienceusers_router, "audience-users", lookup="audienceuser", trailing_slash=False
 )
@@ -68,9 +83,12 @@ varkey_router.register(r"vars", api_views.VarKeyViewSet)
 urlpatterns = (
     athena_content_metadata_router.urls
     + user_content_history_router.urls
+    + user_interests_router.urls
     + audienceusers_router.urls
     + product_actions_router.urls
     + subscriptions_router.urls
+    + vars_history_router.urls
+    + subscription_log_router.urls
     + optouthistory_router.urls
     + lists_router.urls
     + subscription_triggers_router.urls
@@ -1,10 +1,14 @@
 import json
 from django import forms
+from django.conf.urls import url
+from django.core.exceptions import PermissionDenied
 from django.core.urlresolvers import reverse
 from django.contrib import admin
+from django.http import HttpResponse
+from django.template.loader import render_to_string as django_render_to_string
 from django.utils.safestring import mark_safe
 
-from . import models as m
+from . import metrics, models as m
 
 
 class SyncFailureAdmin(admin.ModelAdmin):
@@ -13,7 +17,9 @@ class SyncFailureAdmin(admin.ModelAdmin):
         "message",
         "get_failed_instance",
         "resolved",
+        "occurrences",
         "created",
+        "last_seen",
     )
 
     exclude = (
@@ -30,7 +36,9 @@ class SyncFailureAdmin(admin.ModelAdmin):
         "sailthru_error_description",
         "sailthru_error_status_code",
         "get_sailthru_body",
+        "occurrences",
         "created",
+        "last_seen",
         "modified",
     )
 
@@ -43,7 +51,9 @@ class SyncFailureAdmin(admin.ModelAdmin):
                 "fields": (
                     "get_failed_instance",
                     "message",
+                    "occurrences",
                     "created",
+                    "last_seen",
                     "modified",
                 ),
             },
@@ -106,6 +116,47 @@ class SyncFailureAdmin(admin.ModelAdmin):
     def resolve_sync_failures(self, request, queryset):
         queryset.update(resolved=True)
 
+    def get_urls(self):
+        urls = super().get_urls()
+        metrics_urls = [
+            url(
+                r"^metrics/$",
+                self.admin_site.admin_view(self.metrics_view),
+                name="sailthru_sync_syncfailure_metrics",
+            ),
+            url(
+                r"^metrics/summary/$",
+                self.admin_site.admin_view(self.metrics_summary_view),
+                name="sailthru_sync_syncfailure_metrics_summary",
+            ),
+        ]
+        return metrics_urls + urls
+
+    def metrics_view(self, request):
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        return HttpResponse(
+            metrics.render_prometheus(), content_type="text/plain; version=0.0.4"
+        )
+
+    def metrics_summary_view(self, request):
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        context = {
+            "has_permission": True,
+            "opts": self.model._meta,
+            "title": "Sailthru sync metrics",
+            "metrics_enabled": metrics.enabled(),
+            "metrics": metrics.summary(),
+        }
+        return HttpResponse(
+            django_render_to_string(
+                "admin/sailthru_sync/syncfailure/metrics.html",
+                context,
+                request=request,
+            )
+        )
+
 
 class SyncLockAdmin(admin.ModelAdmin):
     list_display = ("locked_instance",)
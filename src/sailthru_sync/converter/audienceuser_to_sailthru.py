@@ -1,12 +1,37 @@
+from collections import defaultdict
 from datetime import datetime
+from functools import lru_cache
 
 import core.models as core_models
+from django.conf import settings
 from django.utils.timezone import localtime
 from nameparser import HumanName
 
 from .errors import ConversionError
 
 
+# users are synced again and again with the same names and subjects, and
+# share them: the vars derived from them are memoized by their inputs, in
+# each process, for this many distinct inputs at most (least recently used
+# evicted first)
+DERIVED_VARS_CACHE_SIZE = 10000
+
+
+@lru_cache(maxsize=DERIVED_VARS_CACHE_SIZE)
+def format_name(first, last):
+    name = HumanName()
+    if first is not None:
+        name.first = first
+    if last is not None:
+        name.last = last
+    return str(name)
+
+
+@lru_cache(maxsize=DERIVED_VARS_CACHE_SIZE)
+def format_procurement_subject(subject):
+    return ",".join(subject.split("::"))
+
+
 class AudienceUserToSailthru(object):
     source_signup_date_format = "%Y-%m-%d %H:%M"
 
@@ -14,11 +39,30 @@ class AudienceUserToSailthru(object):
         "procurement_subject",
     ]
 
-    def __init__(self, user):
+    # var holding the user's top interests of each UserInterest kind
+    interest_vars = {
+        "topic": "top_topics",
+        "keyword": "top_keywords",
+        "interest": "top_interests",
+        "author": "top_authors",
+        "category": "top_categories",
+    }
+
+    def __init__(self, user, synced_keys=None, interests=None):
+        """
+        Bulk conversions (see `sailthru_sync.export`) pass the keys of all
+        the VarKeys that sync with Sailthru as `synced_keys`, and the user's
+        (kind, value) interests, by descending score, as `interests`; both
+        are otherwise queried for the user.
+        """
         self.user = user
-        self.vars_to_sync = core_models.VarKey.objects.filter(
-            key__in=self.user.vars.keys(), sync_with_sailthru=True
-        ).values_list("key", flat=True)
+        if synced_keys is None:
+            self.vars_to_sync = core_models.VarKey.objects.filter(
+                key__in=self.user.vars.keys(), sync_with_sailthru=True
+            ).values_list("key", flat=True)
+        else:
+            self.vars_to_sync = [key for key in self.user.vars if key in synced_keys]
+        self.interests = interests
 
     def __str__(self):
         return "<{} converter for audience user: {}>".format(
@@ -33,12 +77,16 @@ class AudienceUserToSailthru(object):
         return data
 
     def get_name(self):
-        name = HumanName()
+        first = last = None
         if "first_name" in self.vars_to_sync:
-            name.first = self.user.vars["first_name"]
+            first = self.user.vars["first_name"]
         if "last_name" in self.vars_to_sync:
-            name.last = self.user.vars["last_name"]
-        return str(name)
+            last = self.user.vars["last_name"]
+        try:
+            return format_name(first, last)
+        except TypeError:
+            # unhashable vars cannot be memoized
+            return format_name.__wrapped__(first, last)
 
     def get_source(self):
         signups = list(self.user.source_signups.all())
@@ -64,8 +112,7 @@ class AudienceUserToSailthru(object):
         return domain
 
     def get_procurement_subject(self):
-        subject = self.user.vars.get("procurement_subject", "")
-        return ",".join(subject.split("::"))
+        return format_procurement_subject(self.user.vars.get("procurement_subject", ""))
 
     def get_modified_time(self):
         return int(self.user.modified.timestamp())
@@ -98,6 +145,14 @@ class AudienceUserToSailthru(object):
         return data
 
     def _get_aggregated_action_product_vars(self, registered_actions, consumed_actions):
+        # the slugs of each type, with one pass over the actions
+        registered = defaultdict(list)
+        for action in registered_actions:
+            registered[action.product.type].append(action.product.slug)
+        consumed = defaultdict(list)
+        for action in consumed_actions:
+            consumed[action.product.type].append(action.product.slug)
+
         data = {}
         product_var = "{}s_{}"
         for product_type in core_models.Product.product_types():
@@ -107,27 +162,8 @@ class AudienceUserToSailthru(object):
             consumed_product_var = product_var.format(product_type, consumed_verb)
             registered_product_var = product_var.format(product_type, registered_verb)
 
-            data[consumed_product_var] = (
-                sorted(
-                    [
-                        action.product.slug
-                        for action in consumed_actions
-                        if action.product.type == product_type
-                    ]
-                )
-                or 0
-            )
-
-            data[registered_product_var] = (
-                sorted(
-                    [
-                        action.product.slug
-                        for action in registered_actions
-                        if action.product.type == product_type
-                    ]
-                )
-                or 0
-            )
+            data[consumed_product_var] = sorted(consumed[product_type]) or 0
+            data[registered_product_var] = sorted(registered[product_type]) or 0
 
         return data
 
@@ -151,9 +187,9 @@ class AudienceUserToSailthru(object):
 
     def get_product_vars(self):
         data = {}
-        product_actions = self.user.product_actions.prefetch_related(
-            "product__topics"
-        ).all()
+        product_actions = self.user.product_actions.all()
+        if "product_actions" not in getattr(self.user, "_prefetched_objects_cache", {}):
+            product_actions = product_actions.prefetch_related("product__topics")
 
         registered_actions = [pa for pa in product_actions if pa.type == "registered"]
         consumed_actions = [pa for pa in product_actions if pa.type == "consumed"]
@@ -168,6 +204,22 @@ class AudienceUserToSailthru(object):
 
         return data
 
+    def get_interest_vars(self):
+        limit = settings.USER_INTEREST_SYNC_LIMIT
+        top = defaultdict(list)
+        interests = self.interests
+        if interests is None:
+            interests = [
+                (kind, value)
+                for _, kind, value in core_models.UserInterest.objects.top_by_kind(
+                    [self.user.email], limit
+                )
+            ]
+        for kind, value in interests:
+            if len(top[kind]) < limit:
+                top[kind].append(value)
+        return dict((var, top[kind] or 0) for kind, var in self.interest_vars.items())
+
     def get_fields(self):
         """
         TODO: This isn't part of reformating data for syncing with sailthru.  It
@@ -220,4 +272,7 @@ class AudienceUserToSailthru(object):
         data["vars"].update(self.get_var_subscriptions())
         data["vars"].update(self.get_product_vars())
 
+        if settings.USER_INTEREST_SYNC_LIMIT > 0:
+            data["vars"].update(self.get_interest_vars())
+
         return data
@@ -0,0 +1,119 @@
+"""
+Bulk conversion of audience users to Sailthru payloads.
+
+`convert_users` converts a batch of users loaded by `load_users` with a
+fixed number of queries, whatever the batch's size; `export_partition`
+converts the users of a range of pks into a shard for a Sailthru "update"
+import job, and is what the worker processes of the
+`export_users_to_sailthru` command run.
+"""
+import json
+import os
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Max, Min, Prefetch
+
+from core import models as core_models
+from .converter import AudienceUserToSailthru
+
+
+# the payload keys that are specific to the API request, not the user
+REQUEST_ONLY_KEYS = ("fields",)
+
+
+def load_users(queryset):
+    """Prefetches everything the converter reads of the users of `queryset`."""
+    return queryset.prefetch_related(
+        "source_signups",
+        "subscriptions__list",
+        Prefetch(
+            "product_actions",
+            queryset=core_models.ProductAction.objects.select_related(
+                "product"
+            ).prefetch_related("product__topics", "details"),
+        ),
+    )
+
+
+def load_interests(emails):
+    """
+    The (kind, value) interests of each of `emails` that are synced (the
+    USER_INTEREST_SYNC_LIMIT top ones of each kind), by descending score.
+    """
+    interests = defaultdict(list)
+    for email, kind, value in core_models.UserInterest.objects.top_by_kind(
+        emails, settings.USER_INTEREST_SYNC_LIMIT
+    ):
+        interests[email].append((kind, value))
+    return interests
+
+
+def convert_users(users):
+    """
+    Yields (user, payload, error) for each of `users`, loaded by
+    `load_users`; `error` is None unless the user could not be converted.
+    """
+    users = list(users)
+    synced_keys = set(
+        core_models.VarKey.objects.filter(sync_with_sailthru=True).values_list(
+            "key", flat=True
+        )
+    )
+    interests = load_interests([user.email for user in users if user.email])
+    for user in users:
+        converter = AudienceUserToSailthru(
+            user, synced_keys=synced_keys, interests=interests.get(user.email, [])
+        )
+        try:
+            yield user, converter.convert(), None
+        except Exception as e:
+            yield user, None, str(e)
+
+
+def id_partitions(queryset, size):
+    """Splits the pk space of `queryset` into [first, last] ranges of `size`."""
+    bounds = queryset.aggregate(first=Min("pk"), last=Max("pk"))
+    if bounds["first"] is None:
+        return []
+    return [
+        (first, min(first + size - 1, bounds["last"]))
+        for first in range(bounds["first"], bounds["last"] + 1, size)
+    ]
+
+
+def shard_path(directory, first, last):
+    return os.path.join(directory, "users-{:010d}-{:010d}.json".format(first, last))
+
+
+def export_partition(directory, first, last, batch_size=1000):
+    """
+    Writes the payloads of the users (with an email) whose pk is between
+    `first` and `last` to their shard in `directory`, one JSON object per
+    line, and returns (exported, errors), `errors` being (pk, message) pairs.
+
+    The shard only appears once complete.
+    """
+    users = core_models.AudienceUser.objects.filter(
+        email__isnull=False, pk__gte=first, pk__lte=last
+    ).order_by("pk")
+    exported = 0
+    errors = []
+    path = shard_path(directory, first, last)
+    with open(path + ".partial", "w") as shard:
+        after = first - 1
+        while True:
+            batch = list(load_users(users.filter(pk__gt=after)[:batch_size]))
+            if not batch:
+                break
+            after = batch[-1].pk
+            for user, payload, error in convert_users(batch):
+                if error is not None:
+                    errors.append((user.pk, error))
+                    continue
+                for key in REQUEST_ONLY_KEYS:
+                    payload.pop(key, None)
+                shard.write(json.dumps(payload, sort_keys=True) + "\n")
+                exported += 1
+    os.replace(path + ".partial", path)
+    return exported, errors
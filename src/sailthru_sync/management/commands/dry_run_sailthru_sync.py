@@ -0,0 +1,208 @@
+import gzip
+import json
+import multiprocessing
+import os
+from argparse import RawTextHelpFormatter
+from collections import Counter
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core.models import AudienceUser
+from ... import export
+
+
+# vars that differ on every conversion, left out of the snapshots
+VOLATILE_VARS = ("last_synced_time",)
+
+# the payload dicts compared key by key; other keys are compared whole
+KEYED_PARTS = (("lists", "list"), ("vars", "var"))
+
+
+def convert_users(pks):
+    """
+    Converts the users `pks` as `sync_user_basic` would, returning a snapshot
+    record, in pk order, for each of them.
+    """
+    users = export.load_users(AudienceUser.objects.filter(pk__in=pks).order_by("pk"))
+    records = []
+    for user, payload, error in export.convert_users(users):
+        if error is not None:
+            records.append({"user_id": user.pk, "error": error})
+            continue
+        for var in VOLATILE_VARS:
+            payload["vars"].pop(var, None)
+        records.append({"user_id": user.pk, "payload": payload})
+    return records
+
+
+def read_snapshot(path):
+    with gzip.open(path, "rt") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def join_snapshots(old_records, new_records):
+    """
+    Yields (user_id, old, new) for the users of either snapshot, in pk order;
+    either record is None for users missing from its snapshot.
+    """
+    old_records = iter(old_records)
+    new_records = iter(new_records)
+    old = next(old_records, None)
+    new = next(new_records, None)
+    while old is not None or new is not None:
+        if new is None or (old is not None and old["user_id"] < new["user_id"]):
+            yield old["user_id"], old, None
+            old = next(old_records, None)
+        elif old is None or new["user_id"] < old["user_id"]:
+            yield new["user_id"], None, new
+            new = next(new_records, None)
+        else:
+            yield new["user_id"], old, new
+            old = next(old_records, None)
+            new = next(new_records, None)
+
+
+def diff_payloads(old, new):
+    """Yields the (part, key, change) differences between two payloads."""
+    for part, name in KEYED_PARTS:
+        old_part = old.get(part, {})
+        new_part = new.get(part, {})
+        for key in sorted(set(old_part) | set(new_part)):
+            if key not in old_part:
+                yield name, key, "added"
+            elif key not in new_part:
+                yield name, key, "removed"
+            elif old_part[key] != new_part[key]:
+                yield name, key, "changed"
+
+    keyed = {part for part, _ in KEYED_PARTS}
+    for key in sorted((set(old) | set(new)) - keyed):
+        if old.get(key) != new.get(key):
+            yield "field", key, "changed"
+
+
+class Command(BaseCommand):
+    help = """
+    Converts users as the Sailthru sync would, without syncing anything, and
+    writes the payloads to a gzipped NDJSON snapshot, one
+    {"user_id", "payload"} (or {"user_id", "error"}) object per line, in pk
+    order:
+        manage.py dry_run_sailthru_sync --output payloads.ndjson.gz
+
+    Convert the first 500 users (with an email) when ordered by ascending pk:
+        manage.py dry_run_sailthru_sync --range 0:500 --output ...
+
+    Compare with the snapshot of a previous run, summarizing what syncing
+    would change at Sailthru, e.g. "list foo changed for 12000 users":
+        manage.py dry_run_sailthru_sync --previous old.ndjson.gz --output ...
+
+    Users are converted ``--chunk-size`` at a time by ``--workers``
+    processes; snapshots are streamed, never held in memory.
+    """
+
+    def add_arguments(self, parser):
+        # monkey-patch so that we do not lose the line-breaks in the help text
+        parser.formatter_class = RawTextHelpFormatter
+
+        parser.add_argument("--range", type=str, default="all")
+        parser.add_argument("--output", type=str)
+        parser.add_argument("--previous", type=str)
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def _validate_options(self, options):
+        if not options["output"]:
+            raise CommandError("--output must be specified")
+        if options["previous"] and not os.path.exists(options["previous"]):
+            raise CommandError("Could not find {}.".format(options["previous"]))
+        if options["workers"] <= 0 or options["chunk_size"] <= 0:
+            raise CommandError("--workers and --chunk-size must be positive")
+
+        if options["range"] != "all":
+            bounds = options["range"].split(":")
+            if len(bounds) != 2 or not all(x.isdigit() for x in bounds):
+                raise CommandError(
+                    '--range must specify either "all" or a slice like "0:500".'
+                )
+
+    def _chunks(self, range_option, chunk_size):
+        qs = AudienceUser.objects.filter(email__isnull=False).order_by("pk")
+        if range_option != "all":
+            start, end = [int(x) for x in range_option.split(":")]
+            qs = qs[start:end]
+        pks = qs.values_list("pk", flat=True).iterator()
+        while True:
+            chunk = list(islice(pks, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def _records(self, chunks, workers):
+        if workers == 1:
+            for chunk in chunks:
+                yield from convert_users(chunk)
+            return
+
+        # forked workers must open connections of their own
+        connections.close_all()
+        with multiprocessing.Pool(workers) as pool:
+            # chunks come back in order, so the snapshot stays sorted
+            for records in pool.imap(convert_users, chunks):
+                yield from records
+
+    def handle(self, *args, **options):
+        self._validate_options(options)
+
+        records = self._records(
+            self._chunks(options["range"], options["chunk_size"]), options["workers"]
+        )
+        if options["previous"]:
+            old_records = read_snapshot(options["previous"])
+        else:
+            old_records = ()
+
+        counts = Counter()
+        changes = Counter()
+        # the previous snapshot may be the output, only replaced once complete
+        partial = options["output"] + ".partial"
+        with gzip.open(partial, "wt") as output:
+            for user_id, old, new in join_snapshots(old_records, records):
+                if new is not None:
+                    output.write(json.dumps(new, sort_keys=True) + "\n")
+                    counts["converted"] += 1
+                    if "error" in new:
+                        counts["errors"] += 1
+                        continue
+                if not options["previous"] or (old is not None and "error" in old):
+                    continue
+                if old is None:
+                    counts["new"] += 1
+                elif new is None:
+                    counts["gone"] += 1
+                else:
+                    user_changes = set(diff_payloads(old["payload"], new["payload"]))
+                    counts["changed"] += bool(user_changes)
+                    changes.update(user_changes)
+        os.replace(partial, options["output"])
+
+        self.stdout.write(
+            "Converted {} users ({} errors) to {}.".format(
+                counts["converted"], counts["errors"], options["output"]
+            )
+        )
+        if not options["previous"]:
+            return
+        self.stdout.write(
+            "{} users would change; {} are new and {} no longer in the snapshot.".format(
+                counts["changed"], counts["new"], counts["gone"]
+            )
+        )
+        for (part, key, change), count in sorted(
+            changes.items(), key=lambda item: (-item[1], item[0])
+        ):
+            self.stdout.write(
+                "  {} {} {} for {} users".format(part, key, change, count)
+            )
@@ -0,0 +1,92 @@
+import json
+import multiprocessing
+import os
+from argparse import RawTextHelpFormatter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core.models import AudienceUser
+from ... import export
+
+
+def _export_partition(args):
+    return args[1:3], export.export_partition(*args)
+
+
+class Command(BaseCommand):
+    help = """
+    Converts every user with an email to a Sailthru payload, for a Sailthru
+    "update" import job:
+        manage.py export_users_to_sailthru --output-dir /tmp/sailthru-export
+
+    The pk space is split into ``--partition-size`` ranges, each converted
+    by one of ``--workers`` processes, with its own database connection,
+    into a shard of one JSON object per line: users-<first>-<last>.json.
+    Shards already in the directory are kept, so an interrupted export
+    resumes where it stopped. Users that cannot be converted are listed in
+    errors.jsonl.
+    """
+
+    def add_arguments(self, parser):
+        # monkey-patch so that we do not lose the line-breaks in the help text
+        parser.formatter_class = RawTextHelpFormatter
+
+        parser.add_argument("--output-dir", type=str)
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--partition-size", type=int, default=10000)
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        directory = options["output_dir"]
+        if not directory:
+            raise CommandError("--output-dir must be specified")
+        for option in ("workers", "partition_size", "batch_size"):
+            if options[option] <= 0:
+                raise CommandError(
+                    "--{} must be positive".format(option.replace("_", "-"))
+                )
+        os.makedirs(directory, exist_ok=True)
+
+        partitions = [
+            (first, last)
+            for first, last in export.id_partitions(
+                AudienceUser.objects.filter(email__isnull=False),
+                options["partition_size"],
+            )
+            if not os.path.exists(export.shard_path(directory, first, last))
+        ]
+        self.stdout.write("Exporting {} partitions.".format(len(partitions)))
+        tasks = [
+            (directory, first, last, options["batch_size"])
+            for first, last in partitions
+        ]
+
+        if options["workers"] == 1:
+            results = map(_export_partition, tasks)
+            self._collect(directory, results)
+        else:
+            # forked workers must open connections of their own
+            connections.close_all()
+            with multiprocessing.Pool(options["workers"]) as pool:
+                self._collect(directory, pool.imap_unordered(_export_partition, tasks))
+
+    def _collect(self, directory, results):
+        exported = 0
+        failed = 0
+        with open(os.path.join(directory, "errors.jsonl"), "a") as errors_file:
+            for (first, last), (count, errors) in results:
+                exported += count
+                failed += len(errors)
+                for pk, error in errors:
+                    errors_file.write(
+                        json.dumps({"user_id": pk, "error": error}) + "\n"
+                    )
+                self.stdout.write(
+                    "Users {}-{}: {} exported, {} errors.".format(
+                        first, last, count, len(errors)
+                    )
+                )
+        self.stdout.write(
+            "Exported {} users ({} errors) to {}.".format(exported, failed, directory)
+        )
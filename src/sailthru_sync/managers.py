@@ -1,5 +1,6 @@
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.db import connection, models
+from django.utils import timezone
 
 
 class SyncLockManager(models.Manager):
@@ -9,3 +10,29 @@ class SyncLockManager(models.Manager):
             content_type=ContentType.objects.get_for_model(locked_instance),
         )
         return obj
+
+    def lock_many(self, model, pks):
+        """
+        Locks the instances of `model` with `pks` with one query, skipping
+        those already locked; returns the set of pks that were locked.
+        """
+        pks = sorted(set(pks))
+        if not pks:
+            return set()
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO {} (content_type_id, object_id, created, modified) "
+                "SELECT %s, unnest(%s::integer[]), %s, %s "
+                "ON CONFLICT (content_type_id, object_id) DO NOTHING "
+                "RETURNING object_id".format(self.model._meta.db_table),
+                [ContentType.objects.get_for_model(model).pk, pks, now, now],
+            )
+            return {row[0] for row in cursor.fetchall()}
+
+    def release_many(self, model, pks):
+        """Frees the locks of the instances of `model` with `pks`."""
+        self.filter(
+            content_type=ContentType.objects.get_for_model(model),
+            object_id__in=list(pks),
+        ).delete()
@@ -0,0 +1,344 @@
+"""
+Lightweight counters and histograms for the Sailthru sync pipeline.
+
+Values are kept in the Django cache so that every celery worker contributes to
+the same series. They are exposed in the Prometheus text format by the sync
+failure admin (see `SyncFailureAdmin.metrics_view`).
+"""
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import hashlib
+import json
+import logging
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+
+logger = logging.getLogger(__name__)
+
+REGISTRY = OrderedDict()
+
+
+def enabled():
+    return getattr(settings, "SAILTHRU_SYNC_METRICS_ENABLED", True)
+
+
+class Metric(object):
+    metric_type = None
+    key_prefix = "sailthru_sync::metrics::"
+    index_refresh_seconds = 60
+
+    def __init__(self, name, documentation, labelnames=()):
+        assert name not in REGISTRY, "Metric {} already registered.".format(name)
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._indexed = {}
+        REGISTRY[name] = self
+
+    def label_values(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                "Metric {} expects labels {}, got {}.".format(
+                    self.name, self.labelnames, tuple(sorted(labels))
+                )
+            )
+        return [str(labels[name]) for name in self.labelnames]
+
+    @property
+    def index_key(self):
+        return "{}{}::index".format(self.key_prefix, self.name)
+
+    def value_key(self, values, suffix):
+        digest = hashlib.md5(json.dumps(values).encode("utf-8")).hexdigest()
+        return "{}{}::{}::{}".format(self.key_prefix, self.name, digest, suffix)
+
+    def add_to_index(self, values):
+        """
+        Records the label values in the metric's index so they can be found at
+        exposition time. Each process only rewrites the index once a minute
+        per series, so the hot path stays a couple of cache increments.
+        """
+        serialized = json.dumps(values)
+        now = time.monotonic()
+        if now - self._indexed.get(serialized, -math.inf) < self.index_refresh_seconds:
+            return
+        index = cache.get(self.index_key) or []
+        if values not in index:
+            index.append(values)
+            cache.set(self.index_key, index, None)
+        self._indexed[serialized] = now
+
+    def series(self):
+        return cache.get(self.index_key) or []
+
+    def increment(self, key, amount):
+        try:
+            cache.incr(key, amount)
+        except ValueError:
+            # The key does not exist yet (or was evicted).
+            cache.add(key, 0, None)
+            cache.incr(key, amount)
+
+    def reset(self):
+        keys = [self.index_key]
+        for values in self.series():
+            keys.extend(self.value_key(values, suffix) for suffix in self.suffixes())
+        cache.delete_many(keys)
+        self._indexed = {}
+
+    def suffixes(self):
+        raise NotImplementedError
+
+    def samples(self):
+        """Yields (sample name, label dict, value) tuples."""
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def inc(self, amount=1, **labels):
+        if not enabled():
+            return
+        values = self.label_values(labels)
+        try:
+            self.add_to_index(values)
+            self.increment(self.value_key(values, "total"), amount)
+        except Exception:
+            logger.warning("Unable to record metric %s.", self.name, exc_info=True)
+
+    def suffixes(self):
+        return ["total"]
+
+    def samples(self):
+        for values in self.series():
+            value = cache.get(self.value_key(values, "total")) or 0
+            yield self.name, OrderedDict(zip(self.labelnames, values)), value
+
+    def get(self, **labels):
+        return cache.get(self.value_key(self.label_values(labels), "total")) or 0
+
+
+class Histogram(Metric):
+    metric_type = "histogram"
+    # Sums are stored as integers so they can be incremented atomically.
+    sum_scale = 1000000
+
+    def __init__(self, name, documentation, labelnames=(), buckets=()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def bucket_suffix(self, upper_bound):
+        return "bucket::{}".format(format_value(upper_bound))
+
+    def observe(self, value, **labels):
+        if not enabled():
+            return
+        values = self.label_values(labels)
+        try:
+            self.add_to_index(values)
+            upper_bound = next(bound for bound in self.buckets if value <= bound)
+            self.increment(self.value_key(values, self.bucket_suffix(upper_bound)), 1)
+            self.increment(self.value_key(values, "count"), 1)
+            self.increment(
+                self.value_key(values, "sum"), int(round(value * self.sum_scale))
+            )
+        except Exception:
+            logger.warning("Unable to record metric %s.", self.name, exc_info=True)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def suffixes(self):
+        return ["count", "sum"] + [self.bucket_suffix(bound) for bound in self.buckets]
+
+    def snapshot(self, values):
+        keys = OrderedDict(
+            (suffix, self.value_key(values, suffix)) for suffix in self.suffixes()
+        )
+        stored = cache.get_many(keys.values())
+        snapshot = {suffix: stored.get(key) or 0 for suffix, key in keys.items()}
+        cumulative, running = OrderedDict(), 0
+        for bound in self.buckets:
+            running += snapshot[self.bucket_suffix(bound)]
+            cumulative[bound] = running
+        return {
+            "buckets": cumulative,
+            "count": snapshot["count"],
+            "sum": snapshot["sum"] / self.sum_scale,
+        }
+
+    def samples(self):
+        for values in self.series():
+            labels = OrderedDict(zip(self.labelnames, values))
+            snapshot = self.snapshot(values)
+            for bound, count in snapshot["buckets"].items():
+                bucket_labels = OrderedDict(labels, le=format_value(bound))
+                yield self.name + "_bucket", bucket_labels, count
+            yield self.name + "_count", labels, snapshot["count"]
+            yield self.name + "_sum", labels, snapshot["sum"]
+
+    def quantile(self, snapshot, q):
+        """Estimates a quantile the way Prometheus' histogram_quantile does."""
+        count = snapshot["count"]
+        if not count:
+            return None
+        rank = q * count
+        lower_bound, lower_count = 0, 0
+        for bound, cumulative in snapshot["buckets"].items():
+            if cumulative >= rank:
+                if bound == math.inf:
+                    return lower_bound
+                in_bucket = cumulative - lower_count
+                return lower_bound + (bound - lower_bound) * (
+                    (rank - lower_count) / in_bucket
+                )
+            lower_bound, lower_count = bound, cumulative
+        return lower_bound
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def escape_label_value(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render_prometheus():
+    lines = []
+    for metric in REGISTRY.values():
+        lines.append("# HELP {} {}".format(metric.name, metric.documentation))
+        lines.append("# TYPE {} {}".format(metric.name, metric.metric_type))
+        for name, labels, value in metric.samples():
+            if labels:
+                pairs = ",".join(
+                    '{}="{}"'.format(key, escape_label_value(val))
+                    for key, val in labels.items()
+                )
+                name = "{}{{{}}}".format(name, pairs)
+            lines.append("{} {}".format(name, format_value(value)))
+    return "\n".join(lines) + "\n"
+
+
+def summary():
+    """Human readable overview of every series, used by the admin page."""
+    rows = []
+    for metric in REGISTRY.values():
+        series = []
+        for values in metric.series():
+            labels = ", ".join(
+                "{}={}".format(name, value)
+                for name, value in zip(metric.labelnames, values)
+            )
+            if isinstance(metric, Histogram):
+                snapshot = metric.snapshot(values)
+                count = snapshot["count"]
+                series.append(
+                    {
+                        "labels": labels,
+                        "count": count,
+                        "mean": snapshot["sum"] / count if count else None,
+                        "p50": metric.quantile(snapshot, 0.5),
+                        "p95": metric.quantile(snapshot, 0.95),
+                    }
+                )
+            else:
+                series.append(
+                    {
+                        "labels": labels,
+                        "count": cache.get(metric.value_key(values, "total")) or 0,
+                    }
+                )
+        rows.append({"metric": metric, "series": series})
+    return rows
+
+
+def reset():
+    for metric in REGISTRY.values():
+        metric.reset()
+
+
+class count_queries(object):
+    """
+    Counts the database queries run inside the block.
+
+    Swaps in a private query log instead of measuring the shared one, whose
+    length stops growing once it reaches its maximum size.
+    """
+
+    def __enter__(self):
+        self.count = 0
+        self.force_debug_cursor = connection.force_debug_cursor
+        self.queries_log = connection.queries_log
+        connection.force_debug_cursor = True
+        connection.queries_log = deque(maxlen=connection.queries_limit)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.count = len(connection.queries_log)
+        self.queries_log.extend(connection.queries_log)
+        connection.queries_log = self.queries_log
+        connection.force_debug_cursor = self.force_debug_cursor
+
+
+SYNC_LAG_SECONDS = Histogram(
+    "audb_sailthru_sync_lag_seconds",
+    "Seconds between a user being modified and the sync reaching Sailthru.",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 21600, 86400),
+)
+SYNC_TASKS = Counter(
+    "audb_sailthru_sync_tasks_total",
+    "Completed user sync tasks by outcome.",
+    labelnames=("outcome",),
+)
+API_REQUEST_SECONDS = Histogram(
+    "audb_sailthru_api_request_seconds",
+    "Latency of Sailthru API calls.",
+    labelnames=("endpoint", "outcome"),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+CONVERSION_SECONDS = Histogram(
+    "audb_sailthru_sync_conversion_seconds",
+    "Time spent converting an AudienceUser into a Sailthru payload.",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+CONVERSION_QUERIES = Histogram(
+    "audb_sailthru_sync_conversion_queries",
+    "Database queries run while converting an AudienceUser.",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200),
+)
+THROTTLED_TASKS = Counter(
+    "audb_sailthru_sync_throttled_total",
+    "Tasks that hit the throttle lock, by whether they were requeued.",
+    labelnames=("task", "outcome"),
+)
+LOCK_CONTENTION = Counter(
+    "audb_sailthru_sync_lock_contention_total",
+    "Syncs that found the user locked, by how the lock was handled.",
+    labelnames=("outcome",),
+)
+RETRIES = Counter(
+    "audb_sailthru_sync_retries_total",
+    "Sync task retries by reason.",
+    labelnames=("reason",),
+)
+FAILURES = Counter(
+    "audb_sailthru_sync_failures_total",
+    "Recorded sync failures by Sailthru error code.",
+    labelnames=("error_code",),
+)
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-19 18:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sailthru_sync", "0005_auto_20160420_1410"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="syncfailure",
+            name="last_seen",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name="syncfailure",
+            name="occurrences",
+            field=models.PositiveIntegerField(default=1),
+        ),
+        # existing failures were last seen when they were recorded
+        migrations.RunSQL(
+            "UPDATE sailthru_sync_syncfailure SET last_seen = created",
+            migrations.RunSQL.noop,
+        ),
+        migrations.AlterIndexTogether(
+            name="syncfailure",
+            index_together=set([("content_type", "object_id")]),
+        ),
+    ]
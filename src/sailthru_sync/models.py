@@ -1,11 +1,10 @@
-from datetime import datetime
-
 from django.conf import settings
 from django.db import models
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.postgres.fields import ArrayField, JSONField
 from django.core.urlresolvers import reverse
+from django.utils import timezone
 from django.utils.safestring import mark_safe
 from django_extensions.db.models import TimeStampedModel
 
@@ -51,9 +50,16 @@ class SyncFailure(SyncModel):
     sailthru_error_status_code = models.IntegerField(null=True, blank=True)
     resolved = models.BooleanField(default=False)
     acknowledged = models.BooleanField(default=False)
+    # repeats of an unresolved failure (same instance and error code) are
+    # counted here rather than recorded again; see SyncFailureQuerySet.record
+    occurrences = models.PositiveIntegerField(default=1)
+    last_seen = models.DateTimeField(default=timezone.now)
 
     objects = SyncFailureQuerySet.as_manager()
 
+    class Meta:
+        index_together = (("content_type", "object_id"),)
+
     def __str__(self):
         return self.message
 
@@ -93,7 +99,7 @@ class SyncLock(SyncModel):
 
     @property
     def age(self):
-        return datetime.now() - self.timestamp
+        return timezone.now() - self.created
 
     def __str__(self):
         return str(self.locked_instance)
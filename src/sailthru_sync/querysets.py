@@ -1,6 +1,13 @@
-from django.db import models
+import json
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import connection, models
+from django.utils import timezone
 import sentry_sdk
 
+from . import metrics
 from .errors import SailthruErrors
 
 
@@ -8,29 +15,52 @@ class SyncFailureQuerySet(models.QuerySet):
 
     skip_sentry_errors = (SailthruErrors.INVALID_EMAIL,)
 
+    # the columns record() writes, after content_type_id and object_id
+    recorded_fields = (
+        ("message", "text"),
+        ("sailthru_body", "jsonb"),
+        ("sailthru_error_code", "varchar"),
+        ("sailthru_error_message", "text"),
+        ("sailthru_error_description", "text"),
+        ("sailthru_error_status_code", "integer"),
+    )
+
+    def sentry_allowed(self, error_code):
+        """
+        Whether a failure with `error_code` may be sent to Sentry: at most
+        one is, per code, every SAILTHRU_FAILURE_SENTRY_INTERVAL seconds
+        between all the workers, so that outages do not flood Sentry.
+        """
+        return cache.add(
+            "sailthru_sync:sentry:{}".format(error_code or "none"),
+            True,
+            settings.SAILTHRU_FAILURE_SENTRY_INTERVAL,
+        )
+
     def should_log_to_sentry(self, sailthru_response):
         error = sailthru_response.get_error()
         if not error:
-            return True
-        return error.get_error_code() not in self.skip_sentry_errors
+            return self.sentry_allowed(None)
+        error_code = error.get_error_code()
+        if error_code in self.skip_sentry_errors:
+            return False
+        return self.sentry_allowed(error_code)
 
-    def from_message(self, msg, failed_instance):
-        data = {
+    def record_metric(self, failure):
+        metrics.FAILURES.inc(error_code=failure.sailthru_error_code or "none")
+
+    def message_data(self, msg, failed_instance):
+        return {
             "message": msg,
             "failed_instance": failed_instance,
         }
 
-        failure = self.model(**data)
-        failure.full_clean()
-        new_instance = self.create(**data)
-        return new_instance
-
-    def from_sailthru_error_response(self, msg, failed_instance, sailthru_response):
+    def sailthru_error_response_data(self, msg, failed_instance, sailthru_response):
         assert sailthru_response and not sailthru_response.is_ok()
 
         error_data = SailthruErrors.get_error_data(sailthru_response)
 
-        data = {
+        return {
             "message": msg,
             "failed_instance": failed_instance,
             "sailthru_body": sailthru_response.get_body(),
@@ -40,9 +70,36 @@ class SyncFailureQuerySet(models.QuerySet):
             "sailthru_error_status_code": error_data["response status"],
         }
 
+    def sailthru_response_data(self, msg, failed_instance, sailthru_response):
+        return {
+            "message": msg,
+            "failed_instance": failed_instance,
+            "sailthru_body": sailthru_response.get_body(),
+        }
+
+    def validate(self, data):
+        """
+        Runs the checks `_create()` runs on the data of a failure, without
+        the query that checks its content type, which record() takes from
+        the failed instance.
+        """
+        self.model(**data).full_clean(exclude=["content_type"])
+
+    def _create(self, data):
         failure = self.model(**data)
         failure.full_clean()
         new_instance = self.create(**data)
+        self.record_metric(new_instance)
+        return new_instance
+
+    def from_message(self, msg, failed_instance):
+        return self._create(self.message_data(msg, failed_instance))
+
+    def from_sailthru_error_response(self, msg, failed_instance, sailthru_response):
+        data = self.sailthru_error_response_data(
+            msg, failed_instance, sailthru_response
+        )
+        new_instance = self._create(data)
         if self.should_log_to_sentry(sailthru_response):
             with sentry_sdk.push_scope() as scope:
                 scope.set_extra("error_data", data)
@@ -50,17 +107,116 @@ class SyncFailureQuerySet(models.QuerySet):
         return new_instance
 
     def from_sailthru_response(self, msg, failed_instance, sailthru_response):
-        data = {
-            "message": msg,
-            "failed_instance": failed_instance,
-            "sailthru_body": sailthru_response.get_body(),
-        }
-
-        failure = self.model(**data)
-        failure.full_clean()
-        new_instance = self.create(**data)
+        data = self.sailthru_response_data(msg, failed_instance, sailthru_response)
+        new_instance = self._create(data)
         if self.should_log_to_sentry(sailthru_response):
             with sentry_sdk.push_scope() as scope:
                 scope.set_extra("data", data)
                 sentry_sdk.capture_message(msg)
         return new_instance
+
+    def record(self, failures):
+        """
+        Records many failures, given as the data of the `*_data()` methods
+        (plus, optionally, their "occurrences" and when they were
+        "last_seen"), with one statement.
+
+        A failure of an instance that already has an unresolved failure with
+        the same error code is counted against the latest of those, which
+        takes its message and response, instead of being recorded again.
+        Returns how many failures were newly recorded. Like the `from_*()`
+        methods, it raises ValidationError if a failure is not valid; unlike
+        them, it leaves counting the failures (metrics.FAILURES) to the
+        caller.
+        """
+        now = timezone.now()
+        collapsed = {}
+        for data in failures:
+            instance = data["failed_instance"]
+            content_type = ContentType.objects.get_for_model(instance)
+            key = (content_type.pk, instance.pk, data.get("sailthru_error_code"))
+            occurrences = data.get("occurrences", 1)
+            if key in collapsed:
+                occurrences += collapsed[key]["occurrences"]
+            collapsed[key] = dict(
+                data, occurrences=occurrences, last_seen=data.get("last_seen", now)
+            )
+        if not collapsed:
+            return 0
+        for data in collapsed.values():
+            self.validate(data)
+
+        params = []
+        for (content_type_id, object_id, _), data in collapsed.items():
+            params.extend([content_type_id, object_id])
+            for field, _ in self.recorded_fields:
+                value = data.get(field)
+                if field == "sailthru_body":
+                    value = json.dumps(data.get(field, {}))
+                params.append(value)
+            params.extend([data["occurrences"], data["last_seen"]])
+
+        row = "({})".format(
+            ", ".join(
+                ["%s::integer", "%s::integer"]
+                + ["%s::{}".format(cast) for _, cast in self.recorded_fields]
+                + ["%s::integer", "%s::timestamptz"]
+            )
+        )
+        fields = [field for field, _ in self.recorded_fields]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                WITH v (content_type_id, object_id, {fields}, occurrences,
+                        last_seen) AS (VALUES {rows}),
+                latest AS (
+                    SELECT DISTINCT ON (v.content_type_id, v.object_id,
+                                        v.sailthru_error_code)
+                        f.id, v.content_type_id, v.object_id, v.sailthru_error_code
+                    FROM v JOIN {table} f
+                    ON f.content_type_id = v.content_type_id
+                        AND f.object_id = v.object_id
+                        AND f.sailthru_error_code IS NOT DISTINCT FROM
+                            v.sailthru_error_code
+                        AND NOT f.resolved
+                    ORDER BY v.content_type_id, v.object_id,
+                        v.sailthru_error_code, f.id DESC
+                ),
+                repeated AS (
+                    UPDATE {table} f
+                    SET occurrences = f.occurrences + v.occurrences,
+                        last_seen = greatest(f.last_seen, v.last_seen),
+                        modified = v.last_seen,
+                        acknowledged = false,
+                        {updates}
+                    FROM latest, v
+                    WHERE f.id = latest.id
+                        AND v.content_type_id = latest.content_type_id
+                        AND v.object_id = latest.object_id
+                        AND v.sailthru_error_code IS NOT DISTINCT FROM
+                            latest.sailthru_error_code
+                    RETURNING f.id
+                )
+                INSERT INTO {table} (created, modified, content_type_id,
+                    object_id, {fields}, resolved, acknowledged, occurrences,
+                    last_seen)
+                SELECT v.last_seen, v.last_seen, v.content_type_id, v.object_id,
+                    {values}, false, false, v.occurrences, v.last_seen
+                FROM v
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM latest
+                    WHERE latest.content_type_id = v.content_type_id
+                        AND latest.object_id = v.object_id
+                        AND latest.sailthru_error_code IS NOT DISTINCT FROM
+                            v.sailthru_error_code
+                )
+                """.format(
+                    table=self.model._meta.db_table,
+                    fields=", ".join(fields),
+                    rows=", ".join([row] * len(collapsed)),
+                    updates=", ".join("{0} = v.{0}".format(f) for f in fields),
+                    values=", ".join("v.{}".format(f) for f in fields),
+                ),
+                params,
+            )
+            return cursor.rowcount
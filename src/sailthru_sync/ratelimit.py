@@ -0,0 +1,26 @@
+import threading
+import time
+
+
+class RateLimiter(object):
+    """
+    Spaces out calls to the Sailthru API so that no more than
+    `requests_per_second` are started, however many threads share it.
+    """
+
+    def __init__(self, requests_per_second, clock=time.monotonic, sleep=time.sleep):
+        assert requests_per_second > 0, "The rate must be a positive value."
+        self.interval = 1.0 / requests_per_second
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._next = None
+
+    def wait(self):
+        """Blocks until the caller may make its request."""
+        with self._lock:
+            now = self.clock()
+            start = now if self._next is None else max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            self.sleep(start - now)
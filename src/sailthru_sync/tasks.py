@@ -1,23 +1,42 @@
 import random
+import time
 from datetime import timedelta
 
 from audb import celery_app
+from celery.signals import task_postrun, worker_process_shutdown
 from celery.utils.log import get_task_logger
 from core.decorators import throttle
 from core.models import AudienceUser
 from django.conf import settings
 from django.core.mail import send_mail
-from django.db import transaction
+from django.utils import timezone
 import sentry_sdk
 
-from . import models as m, utils
+from . import metrics, models as m, utils
 from .converter.audienceuser_to_sailthru import AudienceUserToSailthru
 from .decorators import log_on_error
 from .errors import SailthruErrors
+from .writeback import WriteBackBuffer, sync_failures
 
 
 logger = get_task_logger(__name__)
 
+# the Sailthru IDs and sync times of the users synced by this worker process
+writeback = WriteBackBuffer()
+
+
+@task_postrun.connect
+def flush_due_writeback(**kwargs):
+    for buffer in (writeback, sync_failures):
+        buffer.flush_if_due()
+        buffer.schedule_flush()
+
+
+@worker_process_shutdown.connect
+def flush_writeback(**kwargs):
+    writeback.flush()
+    sync_failures.flush()
+
 
 @celery_app.task(bind=True)
 @log_on_error("Sailthru sync basic: unhandled exception.")
@@ -32,6 +51,7 @@ def sync_user_basic(self, user_pk):
         msg = "Sailthru sync basic: Unable to find user."
         sentry_sdk.capture_exception(e)
         logger.error("Sailthru sync basic: Unable to find user: %s", str(user_pk))
+        metrics.SYNC_TASKS.inc(outcome="user_missing")
         return
     try:
         lock = m.SyncLock.objects.get_from_locked_instance(aud_user)
@@ -40,6 +60,7 @@ def sync_user_basic(self, user_pk):
     else:
         max_age = timedelta(minutes=1)
         if lock.age > max_age:
+            metrics.LOCK_CONTENTION.inc(outcome="stale")
             msg = "Sailthru sync basic: User locked from syncing with Sailthru."
             with sentry_sdk.push_scope() as scope:
                 scope.set_extra("user", {"pk": aud_user.pk})
@@ -61,25 +82,37 @@ def sync_user_basic(self, user_pk):
             logger.warn(
                 "Sailthru sync basic: Sync lock exists for user %s.", str(user_pk)
             )
+            metrics.LOCK_CONTENTION.inc(outcome="retried")
+            metrics.RETRIES.inc(reason="locked")
             self.retry(
                 countdown=settings.SAILTHRU_TASK_THROTTLE_INTERVAL + 1
             )  # This should hopefully ensure we run a sync event without hitting a stale update lock
 
+    synced_modified = aud_user.modified
     try:
-        converter = AudienceUserToSailthru(aud_user)
-        request_data = converter.convert()
+        with metrics.CONVERSION_SECONDS.time(), metrics.count_queries() as queries:
+            converter = AudienceUserToSailthru(aud_user)
+            request_data = converter.convert()
     except Exception as e:
         msg = "Sailthru sync basic: Unable to convert user {}: {}.".format(user_pk, e)
-        m.SyncFailure.objects.from_message(msg, aud_user)
+        sync_failures.add_message(msg, aud_user)
         sentry_sdk.capture_exception(e)
         logger.error(msg)
+        metrics.SYNC_TASKS.inc(outcome="conversion_failed")
         return
+    metrics.CONVERSION_QUERIES.observe(queries.count)
 
+    request_started = time.monotonic()
     try:
         response = utils.sailthru_client().api_post("user", request_data)
     except Exception as e:
+        metrics.API_REQUEST_SECONDS.observe(
+            time.monotonic() - request_started, endpoint="user", outcome="exception"
+        )
         msg = "Sailthru sync basic: Problem occured during request to Sailthru."
-        sentry_sdk.capture_exception(e)
+        # every task fails this way while Sailthru is down
+        if m.SyncFailure.objects.sentry_allowed("request"):
+            sentry_sdk.capture_exception(e)
         logger.error(
             "Sailthru sync basic: Problem occured during request to Sailthru: %s",
             str(e),
@@ -88,12 +121,20 @@ def sync_user_basic(self, user_pk):
         max_retries = 10
         countdown = throttle_interval + (2**self.request.retries)  # Max = 17 min
         with_jitter = random.randint(throttle_interval, countdown)
+        metrics.RETRIES.inc(reason="request_error")
         self.retry(exc=e, countdown=with_jitter, max_retries=max_retries)
         return
 
+    metrics.API_REQUEST_SECONDS.observe(
+        time.monotonic() - request_started,
+        endpoint="user",
+        outcome="ok" if response.is_ok() else "error",
+    )
+
     if not response.is_ok():
+        metrics.SYNC_TASKS.inc(outcome="rejected")
         msg = "Sailthru sync basic: Sailthru rejected request to sync."
-        m.SyncFailure.objects.from_sailthru_error_response(msg, aud_user, response)
+        sync_failures.add_error_response(msg, aud_user, response)
         logger.error(
             "Sailthru sync basic: Sailthru rejected request to sync for user %s (%s)",
             str(aud_user.pk),
@@ -105,39 +146,47 @@ def sync_user_basic(self, user_pk):
         data = response.get_body()
         sid = data["keys"]["sid"]
     except KeyError:
+        metrics.SYNC_TASKS.inc(outcome="bad_response")
         msg = "Sailthru sync basic: Sailthru response missing expected values."
-        m.SyncFailure.objects.from_sailthru_response(msg, aud_user, response)
+        sync_failures.add_response(msg, aud_user, response)
         logger.error(
             "Sailthru sync basic: Sailthru response missing expected values on user %s (%s).",
             str(aud_user.pk),
             aud_user.email,
         )
     else:
-        changed_sid = False
-        with transaction.atomic():
-            aud_user.refresh_from_db()
-            if aud_user.sailthru_id:
-                changed_sid = sid != aud_user.sailthru_id
-            else:
-                AudienceUser.objects.filter(pk=aud_user.pk).update(sailthru_id=sid)
-            """
-            TODO: this idea made resubs more complicated. I'm commenting it out for
-            now. Maybe remove it later if we don't come across problems.
-            """
-            # utils.compare_and_update_optout(aud_user, sailthru_optout)
-        if changed_sid:
+        # compared with the ID loaded with the user; one that changed since
+        # is caught when the sync is written back
+        if aud_user.sailthru_id and sid != aud_user.sailthru_id:
             msg = (
                 "Sailthru sync basic: Sailthru attempted to change the synced"
                 " user's Sailthru ID from {} to {}."
             ).format(aud_user.sailthru_id, sid)
-            m.SyncFailure.objects.from_sailthru_response(msg, aud_user, response)
+            sync_failures.add_response(msg, aud_user, response)
             logger.error(msg)
+            metrics.SYNC_TASKS.inc(outcome="sid_changed")
             return
+        writeback.add(aud_user, sid, timezone.now(), response)
+        metrics.SYNC_TASKS.inc(outcome="synced")
+        metrics.SYNC_LAG_SECONDS.observe(
+            max((timezone.now() - synced_modified).total_seconds(), 0)
+        )
     logger.info(
         "Finished sailthru sync for user %s (%s).", str(aud_user.pk), aud_user.email
     )
 
 
+@celery_app.task
+def sync_users_basic(user_pks):
+    """
+    Queues a sync_user_basic task for each of `user_pks`; bulk writes queue
+    this once instead of one task per user from inside their transaction.
+    """
+    logger.info("Queueing sailthru sync for %d users.", len(user_pks))
+    for user_pk in user_pks:
+        sync_user_basic.apply_async([user_pk])
+
+
 @celery_app.task(bind=True)
 @log_on_error("Send sync failure notifications: unhandled exception.")
 def send_sync_failure_notifications(self):
@@ -214,7 +263,7 @@ def construct_message_from_failures(failures):
     for failure in failures:
         if failure.sailthru_error_code not in counts:
             counts[failure.sailthru_error_code] = 0
-        counts[failure.sailthru_error_code] += 1
+        counts[failure.sailthru_error_code] += failure.occurrences
 
     sorted_failures = sorted(
         [(hr_errors[failure.sailthru_error_code], failure) for failure in failures],
@@ -128,6 +128,23 @@ class AudienceUserToSailthruTest(test.TestCase):
         to_sailthru = converter.AudienceUserToSailthru(user)
         self.assertIn(last_name, to_sailthru.get_name())
 
+    def test_get_name_memoized(self):
+        mommy.make("core.VarKey", key="first_name", sync_with_sailthru=True)
+        user = mommy.make(
+            "core.AudienceUser", email="aa@aa.com", vars={"first_name": "Memo"}
+        )
+        converter.format_name.cache_clear()
+        for _ in range(2):
+            name = converter.AudienceUserToSailthru(user).get_name()
+        self.assertEqual(name, "Memo")
+        info = converter.format_name.cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 1))
+
+        # unhashable vars are formatted without the cache
+        user.vars["first_name"] = ["Memo"]
+        converter.AudienceUserToSailthru(user).get_name()
+        self.assertEqual(converter.format_name.cache_info().currsize, 1)
+
     def test_get_source_empty(self):
         """
         Tests that get_source will be unsyncable with there are no source signups
@@ -620,3 +637,23 @@ class AudienceUserToSailthruTest(test.TestCase):
         ]
         for key in var_keys:
             self.assertIn(key, data["vars"])
+
+    @test.override_settings(USER_INTEREST_SYNC_LIMIT=2)
+    def test_interest_vars(self):
+        user = mommy.make("core.AudienceUser", email="aa@aa.com")
+        now = datetime.now(pytz.utc)
+        for score, (kind, value) in enumerate(
+            [("topic", "a"), ("topic", "b"), ("topic", "c"), ("author", "d")]
+        ):
+            core_models.UserInterest.objects.create(
+                email=user.email, kind=kind, value=value, score=score, updated=now
+            )
+        data = converter.AudienceUserToSailthru(user).convert()
+        self.assertEqual(data["vars"]["top_topics"], ["c", "b"])
+        self.assertEqual(data["vars"]["top_authors"], ["d"])
+        self.assertEqual(data["vars"]["top_categories"], 0)
+
+    def test_interest_vars_disabled(self):
+        user = mommy.make("core.AudienceUser", email="aa@aa.com")
+        data = converter.AudienceUserToSailthru(user).convert()
+        self.assertNotIn("top_topics", data["vars"])
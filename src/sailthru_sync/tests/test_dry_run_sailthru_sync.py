@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django import test
+from django.core.management import call_command
+from model_mommy import mommy
+
+from core.models import AudienceUser
+from ..management.commands import dry_run_sailthru_sync as command
+
+
+class DryRunMixin(object):
+    def setUp(self):
+        mommy.make("core.VarKey", key="job_title", sync_with_sailthru=True)
+        mommy.make("core.List", slug="foo", type="list")
+        mommy.make("core.List", slug="bar", type="list")
+        self.users = []
+        for n in range(3):
+            user = AudienceUser.objects.validate_and_create(
+                email="user{}@example.com".format(n)
+            )
+            user.list_subscribe("foo")
+            self.users.append(user)
+        AudienceUser.objects.validate_and_create(email=None)
+
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def run_command(self, output, **options):
+        stdout = StringIO()
+        call_command(
+            "dry_run_sailthru_sync",
+            output=os.path.join(self.directory, output),
+            chunk_size=2,
+            stdout=stdout,
+            **options
+        )
+        return stdout.getvalue()
+
+    def snapshot(self, name):
+        return list(command.read_snapshot(os.path.join(self.directory, name)))
+
+
+@test.override_settings(SAILTHRU_SYNC_SIGNALS_ENABLED=False, RAVEN_CONFIG={"dsn": None})
+class DryRunSailthruSyncTest(DryRunMixin, test.TestCase):
+    def test_snapshot(self):
+        output = self.run_command("first.ndjson.gz", workers=1)
+        self.assertIn("Converted 3 users (0 errors)", output)
+
+        records = self.snapshot("first.ndjson.gz")
+        self.assertEqual([r["user_id"] for r in records], [u.pk for u in self.users])
+        payload = records[0]["payload"]
+        self.assertEqual(payload["id"], "user0@example.com")
+        self.assertEqual(payload["lists"], {"foo": 1})
+        self.assertNotIn("last_synced_time", payload["vars"])
+
+    def test_range(self):
+        self.run_command("range.ndjson.gz", workers=1, range="1:3")
+        self.assertEqual(
+            [r["user_id"] for r in self.snapshot("range.ndjson.gz")],
+            [self.users[1].pk, self.users[2].pk],
+        )
+
+    def test_diff(self):
+        self.run_command("first.ndjson.gz", workers=1)
+
+        self.users[0].list_subscribe("bar")
+        self.users[1].list_subscribe("bar")
+        self.users[1].list_unsubscribe("foo")
+        self.users[2].vars = {"job_title": "Clerk"}
+        self.users[2].save()
+        self.users[0].delete()
+        new_user = AudienceUser.objects.validate_and_create(email="new@example.com")
+
+        previous = os.path.join(self.directory, "first.ndjson.gz")
+        output = self.run_command("second.ndjson.gz", workers=1, previous=previous)
+        self.assertIn(
+            "2 users would change; 1 are new and 1 no longer in the snapshot.", output
+        )
+        self.assertIn("list bar added for 1 users", output)
+        self.assertIn("list foo changed for 1 users", output)
+        self.assertIn("var job_title added for 1 users", output)
+        self.assertEqual(self.snapshot("second.ndjson.gz")[-1]["user_id"], new_user.pk)
+
+    def test_diff_in_place(self):
+        self.run_command("snapshot.ndjson.gz", workers=1)
+        previous = os.path.join(self.directory, "snapshot.ndjson.gz")
+        output = self.run_command("snapshot.ndjson.gz", workers=1, previous=previous)
+        self.assertIn("0 users would change", output)
+        self.assertEqual(len(self.snapshot("snapshot.ndjson.gz")), 3)
+        self.assertFalse(os.path.exists(previous + ".partial"))
+
+    def test_diff_payloads(self):
+        old = {"id": "a", "lists": {"foo": 1}, "vars": {"x": 1, "y": 2}}
+        new = {"id": "b", "lists": {"foo": 0}, "vars": {"y": 2, "z": 3}}
+        self.assertEqual(
+            list(command.diff_payloads(old, new)),
+            [
+                ("list", "foo", "changed"),
+                ("var", "x", "removed"),
+                ("var", "z", "added"),
+                ("field", "id", "changed"),
+            ],
+        )
+
+
+@test.override_settings(SAILTHRU_SYNC_SIGNALS_ENABLED=False, RAVEN_CONFIG={"dsn": None})
+class DryRunSailthruSyncWorkersTest(DryRunMixin, test.TransactionTestCase):
+    def test_workers(self):
+        # the worker processes only see committed users
+        output = self.run_command("workers.ndjson.gz", workers=2)
+        self.assertIn("Converted 3 users (0 errors)", output)
+        self.assertEqual(
+            [r["user_id"] for r in self.snapshot("workers.ndjson.gz")],
+            [u.pk for u in self.users],
+        )
@@ -0,0 +1,127 @@
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from io import StringIO
+
+import pytz
+from django import test
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from model_mommy import mommy
+
+from core.models import AudienceUser, UserInterest
+from .. import export
+from ..converter import AudienceUserToSailthru
+
+
+class ExportMixin(object):
+    def setUp(self):
+        mommy.make("core.VarKey", key="first_name", sync_with_sailthru=True)
+        mommy.make("core.List", slug="foo", type="list")
+        self.topic = mommy.make("core.ProductTopic", _fill_optional=True)
+        product = mommy.make(
+            "core.Product", name="a", slug="a", _fill_optional=["brand", "type"]
+        )
+        product.topics.add(self.topic)
+        now = datetime.now(pytz.utc)
+
+        self.users = []
+        for n in range(4):
+            user = AudienceUser.objects.validate_and_create(
+                email="user{}@example.com".format(n),
+                vars={"first_name": "Jo {}".format(n), "unsynced": "x"},
+            )
+            user.list_subscribe("foo")
+            user.record_product_action(product.slug, "consumed", now)
+            mommy.make("core.UserSource", audience_user=user, name="signup")
+            UserInterest.objects.create(
+                email=user.email, kind="topic", value="a", score=n, updated=now
+            )
+            self.users.append(user)
+        AudienceUser.objects.validate_and_create(email=None)
+
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def run_command(self, **options):
+        stdout = StringIO()
+        call_command(
+            "export_users_to_sailthru",
+            output_dir=self.directory,
+            partition_size=1,
+            stdout=stdout,
+            **options
+        )
+        return stdout.getvalue()
+
+    def exported(self):
+        payloads = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.startswith("users-"):
+                with open(os.path.join(self.directory, name)) as shard:
+                    payloads.extend(json.loads(line) for line in shard)
+        return payloads
+
+
+@test.override_settings(
+    SAILTHRU_SYNC_SIGNALS_ENABLED=False,
+    RAVEN_CONFIG={"dsn": None},
+    USER_INTEREST_SYNC_LIMIT=2,
+)
+class ExportTest(ExportMixin, test.TestCase):
+    def test_convert_users_matches_converter(self):
+        users = export.load_users(AudienceUser.objects.filter(email__isnull=False))
+        for user, payload, error in export.convert_users(users):
+            self.assertIsNone(error)
+            expected = AudienceUserToSailthru(user).convert()
+            for data in (payload, expected):
+                data["vars"].pop("last_synced_time")
+            self.assertEqual(payload, expected)
+            self.assertEqual(payload["vars"]["top_topics"], ["a"])
+            self.assertEqual(payload["vars"]["product_topics"], [self.topic.name])
+
+    def test_convert_users_queries(self):
+        def count_queries(users):
+            with CaptureQueriesContext(connection) as queries:
+                list(export.convert_users(export.load_users(users)))
+            return len(queries)
+
+        self.assertEqual(
+            count_queries(AudienceUser.objects.filter(pk=self.users[0].pk)),
+            count_queries(AudienceUser.objects.filter(email__isnull=False)),
+        )
+
+    def test_id_partitions(self):
+        first = self.users[0].pk
+        self.assertEqual(
+            export.id_partitions(AudienceUser.objects.filter(email__isnull=False), 3),
+            [(first, first + 2), (first + 3, first + 3)],
+        )
+        self.assertEqual(export.id_partitions(AudienceUser.objects.none(), 3), [])
+
+    def test_export(self):
+        output = self.run_command(workers=1)
+        self.assertIn("Exporting 4 partitions.", output)
+        self.assertIn("Exported 4 users (0 errors)", output)
+        payloads = self.exported()
+        self.assertEqual([p["id"] for p in payloads], [u.email for u in self.users])
+        self.assertNotIn("fields", payloads[0])
+
+        # existing shards are kept
+        os.remove(export.shard_path(self.directory, self.users[3].pk, self.users[3].pk))
+        output = self.run_command(workers=1)
+        self.assertIn("Exporting 1 partitions.", output)
+        self.assertEqual(len(self.exported()), 4)
+
+
+@test.override_settings(SAILTHRU_SYNC_SIGNALS_ENABLED=False, RAVEN_CONFIG={"dsn": None})
+class ExportWorkersTest(ExportMixin, test.TransactionTestCase):
+    def test_workers(self):
+        output = self.run_command(workers=2)
+        self.assertIn("Exported 4 users (0 errors)", output)
+        self.assertEqual(
+            [p["id"] for p in self.exported()], [u.email for u in self.users]
+        )
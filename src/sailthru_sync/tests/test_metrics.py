@@ -0,0 +1,174 @@
+import logging
+from unittest import mock
+
+from core.tests.forms.mock_sailthru import MockedSailthruClient
+from django import test
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from model_mommy import mommy
+
+from .. import metrics
+from ..tasks import sync_failures, sync_user_basic, writeback
+
+
+class MetricsTestCase(test.TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.counter = metrics.REGISTRY["audb_sailthru_sync_tasks_total"]
+        self.histogram = metrics.REGISTRY["audb_sailthru_api_request_seconds"]
+
+    def tearDown(self):
+        metrics.reset()
+        cache.clear()
+
+    def test_counter_increments(self):
+        self.counter.inc(outcome="synced")
+        self.counter.inc(2, outcome="synced")
+        self.counter.inc(outcome="rejected")
+        self.assertEqual(self.counter.get(outcome="synced"), 3)
+        self.assertEqual(self.counter.get(outcome="rejected"), 1)
+
+    def test_unexpected_labels(self):
+        with self.assertRaises(ValueError):
+            self.counter.inc(status="synced")
+
+    @test.override_settings(SAILTHRU_SYNC_METRICS_ENABLED=False)
+    def test_disabled(self):
+        self.counter.inc(outcome="synced")
+        self.assertEqual(self.counter.get(outcome="synced"), 0)
+
+    def test_histogram_snapshot(self):
+        for value in (0.01, 0.2, 0.2, 60):
+            self.histogram.observe(value, endpoint="user", outcome="ok")
+        snapshot = self.histogram.snapshot(["user", "ok"])
+        self.assertEqual(snapshot["count"], 4)
+        self.assertAlmostEqual(snapshot["sum"], 60.41)
+        self.assertEqual(snapshot["buckets"][0.05], 1)
+        self.assertEqual(snapshot["buckets"][0.25], 3)
+        self.assertEqual(snapshot["buckets"][30], 3)
+        self.assertEqual(snapshot["buckets"][float("inf")], 4)
+        self.assertTrue(0.1 < self.histogram.quantile(snapshot, 0.5) <= 0.25)
+
+    def test_render_prometheus(self):
+        self.counter.inc(outcome="synced")
+        self.histogram.observe(0.3, endpoint="user", outcome="ok")
+        text = metrics.render_prometheus()
+        self.assertIn("# TYPE audb_sailthru_sync_tasks_total counter", text)
+        self.assertIn('audb_sailthru_sync_tasks_total{outcome="synced"} 1', text)
+        self.assertIn(
+            'audb_sailthru_api_request_seconds_bucket{endpoint="user",outcome="ok",le="0.5"} 1',
+            text,
+        )
+        self.assertIn(
+            'audb_sailthru_api_request_seconds_bucket{endpoint="user",outcome="ok",le="+Inf"} 1',
+            text,
+        )
+        self.assertIn(
+            'audb_sailthru_api_request_seconds_count{endpoint="user",outcome="ok"} 1',
+            text,
+        )
+
+    def test_count_queries(self):
+        with metrics.count_queries() as queries:
+            list(User.objects.all())
+            list(User.objects.all())
+        self.assertEqual(queries.count, 2)
+
+
+@test.override_settings(SAILTHRU_SYNC_SIGNALS_ENABLED=False, RAVEN_CONFIG={"dsn": None})
+class SyncTaskMetricsTestCase(test.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        logging.disable(logging.CRITICAL)
+
+    @classmethod
+    def tearDownClass(cls):
+        logging.disable(logging.NOTSET)
+        super().tearDownClass()
+
+    def setUp(self):
+        metrics.reset()
+        cache.clear()
+        self.user = mommy.make("core.AudienceUser", email="metrics@example.com")
+        self.client_mock = MockedSailthruClient()
+        patcher = mock.patch(
+            "sailthru_sync.tasks.utils.sailthru_client", return_value=self.client_mock
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(writeback.flush)
+        self.addCleanup(sync_failures.flush)
+
+    def tearDown(self):
+        metrics.reset()
+        cache.clear()
+
+    def test_successful_sync(self):
+        self.client_mock.api_post_return_value.body = {"keys": {"sid": "abc"}}
+        sync_user_basic(self.user.pk)
+        self.assertEqual(metrics.SYNC_TASKS.get(outcome="synced"), 1)
+        self.assertEqual(metrics.SYNC_LAG_SECONDS.snapshot([])["count"], 1)
+        self.assertEqual(metrics.CONVERSION_SECONDS.snapshot([])["count"], 1)
+        self.assertGreater(metrics.CONVERSION_QUERIES.snapshot([])["sum"], 0)
+        api = metrics.API_REQUEST_SECONDS.snapshot(["user", "ok"])
+        self.assertEqual(api["count"], 1)
+
+    def test_rejected_sync(self):
+        self.client_mock.api_post_return_value.ok = False
+        self.client_mock.api_post_return_value.body = {}
+        self.client_mock.api_post_return_value.response_error_code = 11
+        sync_user_basic(self.user.pk)
+        self.assertEqual(metrics.SYNC_TASKS.get(outcome="rejected"), 1)
+        self.assertEqual(metrics.FAILURES.get(error_code="11"), 1)
+        api = metrics.API_REQUEST_SECONDS.snapshot(["user", "error"])
+        self.assertEqual(api["count"], 1)
+
+    @mock.patch("core.decorators.celery_app.send_task")
+    def test_throttled_sync(self, send_task):
+        self.client_mock.api_post_return_value.body = {"keys": {"sid": "abc"}}
+        sync_user_basic(self.user.pk)
+        sync_user_basic(self.user.pk)
+        sync_user_basic(self.user.pk)
+        self.assertEqual(
+            metrics.THROTTLED_TASKS.get(task=sync_user_basic.name, outcome="requeued"),
+            1,
+        )
+        self.assertEqual(
+            metrics.THROTTLED_TASKS.get(task=sync_user_basic.name, outcome="dropped"),
+            1,
+        )
+
+
+class MetricsAdminTestCase(test.TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.admin = User.objects.create_superuser("admin", "admin@example.com", "pw")
+
+    def tearDown(self):
+        metrics.reset()
+        cache.clear()
+
+    def test_metrics_require_login(self):
+        response = self.client.get(reverse("admin:sailthru_sync_syncfailure_metrics"))
+        self.assertEqual(response.status_code, 302)
+
+    def test_metrics_exposition(self):
+        metrics.SYNC_TASKS.inc(outcome="synced")
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse("admin:sailthru_sync_syncfailure_metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        self.assertIn(
+            b'audb_sailthru_sync_tasks_total{outcome="synced"} 1', response.content
+        )
+
+    def test_metrics_summary(self):
+        metrics.SYNC_TASKS.inc(outcome="synced")
+        self.client.force_login(self.admin)
+        response = self.client.get(
+            reverse("admin:sailthru_sync_syncfailure_metrics_summary")
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"audb_sailthru_sync_tasks_total", response.content)
@@ -0,0 +1,22 @@
+from django.test import SimpleTestCase
+
+from ..ratelimit import RateLimiter
+
+
+class RateLimiterTestCase(SimpleTestCase):
+    def test_spaces_out_requests(self):
+        now = [100.0]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+
+        limiter = RateLimiter(4, clock=lambda: now[0], sleep=sleep)
+        for _ in range(3):
+            limiter.wait()
+        self.assertEqual(sleeps, [0.25, 0.5])
+
+        # time spent elsewhere counts towards the next request
+        now[0] = 101.0
+        limiter.wait()
+        self.assertEqual(sleeps, [0.25, 0.5])
@@ -0,0 +1,148 @@
+import logging
+from unittest import mock
+
+from django import test
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from model_mommy import mommy
+
+from core.tests.forms.mock_sailthru import MockedSailthruClient
+from .. import metrics
+from ..models import SyncFailure
+from ..tasks import construct_message_from_failures, sync_failures, sync_user_basic
+from ..writeback import FailureBuffer
+
+
+def error_response(code):
+    response = MockedSailthruClient.MockedResponse()
+    response.ok = False
+    response.response_error_code = code
+    return response
+
+
+@test.override_settings(SAILTHRU_SYNC_SIGNALS_ENABLED=False, RAVEN_CONFIG={"dsn": None})
+class SyncFailureRecordTestCase(test.TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.addCleanup(cache.clear)
+        self.users = [
+            mommy.make("core.AudienceUser", email="user{}@example.com".format(n))
+            for n in range(2)
+        ]
+
+    def data(self, user, code=None, msg="failed"):
+        if code is None:
+            return SyncFailure.objects.message_data(msg, user)
+        return SyncFailure.objects.sailthru_error_response_data(
+            msg, user, error_response(code)
+        )
+
+    def test_record(self):
+        with CaptureQueriesContext(connection) as queries:
+            created = SyncFailure.objects.record(
+                [
+                    self.data(self.users[0], 11),
+                    self.data(self.users[0], 11, "again"),
+                    self.data(self.users[0]),
+                    self.data(self.users[1], 11),
+                ]
+            )
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(created, 3)
+        failure = SyncFailure.objects.get(
+            object_id=self.users[0].pk, sailthru_error_code="11"
+        )
+        self.assertEqual(failure.failed_instance, self.users[0])
+        self.assertEqual((failure.occurrences, failure.message), (2, "again"))
+        self.assertEqual(failure.sailthru_error_status_code, 418)
+        self.assertEqual(
+            SyncFailure.objects.get(
+                object_id=self.users[0].pk, sailthru_error_code=None
+            ).sailthru_body,
+            {},
+        )
+
+    def test_record_repeats(self):
+        SyncFailure.objects.record([self.data(self.users[0], 11)])
+        SyncFailure.objects.update(acknowledged=True)
+        created = SyncFailure.objects.record(
+            [
+                self.data(self.users[0], 11, "again"),
+                self.data(self.users[0], 99),
+            ]
+        )
+        self.assertEqual(created, 1)
+        failure = SyncFailure.objects.get(sailthru_error_code="11")
+        self.assertEqual((failure.occurrences, failure.message), (2, "again"))
+        self.assertFalse(failure.acknowledged)
+        self.assertGreaterEqual(failure.last_seen, failure.created)
+
+        # resolved failures are not reopened
+        SyncFailure.objects.update(resolved=True)
+        self.assertEqual(SyncFailure.objects.record([self.data(self.users[0], 11)]), 1)
+        self.assertEqual(
+            SyncFailure.objects.filter(sailthru_error_code="11").count(), 2
+        )
+
+    def test_record_validates(self):
+        invalid = dict(self.data(self.users[1], 11), sailthru_error_code="123456")
+        with self.assertRaises(ValidationError):
+            SyncFailure.objects.record([self.data(self.users[0], 11), invalid])
+        self.assertFalse(SyncFailure.objects.exists())
+
+        buffer = FailureBuffer(max_size=10, max_seconds=60)
+        with self.assertRaises(ValidationError):
+            buffer.add_message("", self.users[0])
+        self.assertEqual(len(buffer), 0)
+
+    @test.override_settings(SAILTHRU_FAILURE_SENTRY_INTERVAL=60)
+    def test_sentry_rate_limited(self):
+        self.assertTrue(SyncFailure.objects.should_log_to_sentry(error_response(99)))
+        self.assertFalse(SyncFailure.objects.should_log_to_sentry(error_response(99)))
+        self.assertTrue(SyncFailure.objects.should_log_to_sentry(error_response(98)))
+        # invalid emails are never sent
+        self.assertFalse(SyncFailure.objects.should_log_to_sentry(error_response(11)))
+
+    @mock.patch("sailthru_sync.writeback.sentry_sdk.capture_message")
+    def test_buffer(self, capture_message):
+        buffer = FailureBuffer(max_size=10, max_seconds=60)
+        for _ in range(3):
+            buffer.add_error_response("failed", self.users[0], error_response(99))
+        buffer.add_message("failed", self.users[1])
+        self.assertEqual(len(buffer), 2)
+        self.assertFalse(SyncFailure.objects.exists())
+        self.assertEqual(capture_message.call_count, 1)
+        self.assertEqual(metrics.FAILURES.get(error_code="99"), 3)
+
+        buffer.flush()
+        self.assertEqual(
+            SyncFailure.objects.get(object_id=self.users[0].pk).occurrences, 3
+        )
+        self.assertEqual(
+            SyncFailure.objects.get(object_id=self.users[1].pk).occurrences, 1
+        )
+
+    def test_notification_counts_occurrences(self):
+        SyncFailure.objects.record([self.data(self.users[0], 11)] * 3)
+        message = construct_message_from_failures(SyncFailure.objects.all())
+        self.assertIn("There were 3 failure(s)", message)
+
+    @test.override_settings(SAILTHRU_WRITEBACK_BATCH_SIZE=1)
+    def test_sync_task(self):
+        client = MockedSailthruClient()
+        client.api_post_return_value.ok = False
+        client.api_post_return_value.body = {}
+        client.api_post_return_value.response_error_code = 11
+        self.addCleanup(sync_failures.flush)
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        with mock.patch(
+            "sailthru_sync.tasks.utils.sailthru_client", return_value=client
+        ):
+            sync_user_basic(self.users[0].pk)
+        failure = SyncFailure.objects.get()
+        self.assertEqual(failure.failed_instance, self.users[0])
+        self.assertEqual(failure.sailthru_error_code, "11")
@@ -0,0 +1,161 @@
+import logging
+from datetime import timedelta
+from unittest import mock
+
+from django import test
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from model_mommy import mommy
+
+from core.models import AudienceUser
+from core.tests.forms.mock_sailthru import MockedSailthruClient
+from .. import metrics
+from ..models import SyncFailure
+from ..tasks import sync_failures, sync_user_basic, writeback
+from ..writeback import WriteBackBuffer
+
+
+@test.override_settings(SAILTHRU_SYNC_SIGNALS_ENABLED=False, RAVEN_CONFIG={"dsn": None})
+class WriteBackTestCase(test.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        logging.disable(logging.CRITICAL)
+
+    @classmethod
+    def tearDownClass(cls):
+        logging.disable(logging.NOTSET)
+        super().tearDownClass()
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.users = [
+            mommy.make("core.AudienceUser", email="user{}@example.com".format(n))
+            for n in range(3)
+        ]
+        AudienceUser.objects.filter(pk=self.users[2].pk).update(sailthru_id="old")
+        self.users[2].refresh_from_db()
+        self.now = [0.0]
+        self.response = MockedSailthruClient.MockedResponse()
+
+    def buffer(self, **kwargs):
+        kwargs.setdefault("max_size", 10)
+        kwargs.setdefault("max_seconds", 5)
+        return WriteBackBuffer(clock=lambda: self.now[0], **kwargs)
+
+    def test_record_syncs(self):
+        synced_at = timezone.now()
+        with CaptureQueriesContext(connection) as queries:
+            conflicts = AudienceUser.objects.record_syncs(
+                [
+                    (self.users[0].pk, "a", synced_at),
+                    (self.users[1].pk, "b", synced_at),
+                    (self.users[2].pk, "c", synced_at),
+                ]
+            )
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(conflicts, {self.users[2].pk: ("old", "c")})
+        self.assertEqual(
+            list(
+                AudienceUser.objects.order_by("pk").values_list(
+                    "sailthru_id", "last_synced_at"
+                )
+            ),
+            [("a", synced_at), ("b", synced_at), ("old", synced_at)],
+        )
+
+        # sync times only move forward
+        AudienceUser.objects.record_syncs(
+            [(self.users[0].pk, "a", synced_at - timedelta(hours=1))]
+        )
+        self.users[0].refresh_from_db()
+        self.assertEqual(self.users[0].last_synced_at, synced_at)
+        self.assertEqual(AudienceUser.objects.record_syncs([]), {})
+
+    def test_flushes_when_full(self):
+        buffer = self.buffer(max_size=2)
+        buffer.add(self.users[0], "a", timezone.now(), self.response)
+        buffer.add(self.users[0], "a", timezone.now(), self.response)
+        self.assertEqual(len(buffer), 1)
+        self.assertFalse(AudienceUser.objects.filter(sailthru_id="a").exists())
+
+        buffer.add(self.users[1], "b", timezone.now(), self.response)
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(
+            set(AudienceUser.objects.values_list("sailthru_id", flat=True)),
+            {"a", "b", "old"},
+        )
+
+    def test_flushes_when_old(self):
+        buffer = self.buffer()
+        buffer.add(self.users[0], "a", timezone.now(), self.response)
+        self.now[0] = 5.0
+        buffer.add(self.users[1], "b", timezone.now(), self.response)
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(
+            AudienceUser.objects.filter(sailthru_id__in=["a", "b"]).count(), 2
+        )
+
+    def test_flush_if_due(self):
+        buffer = self.buffer()
+        buffer.flush_if_due()
+        buffer.add(self.users[0], "a", timezone.now(), self.response)
+        buffer.flush_if_due()
+        self.assertEqual(len(buffer), 1)
+
+        self.now[0] = 5.0
+        buffer.flush_if_due()
+        self.assertEqual(len(buffer), 0)
+        self.assertTrue(AudienceUser.objects.filter(sailthru_id="a").exists())
+
+    def test_schedule_flush(self):
+        buffer = self.buffer()
+        with mock.patch("sailthru_sync.writeback.threading.Timer") as timer:
+            buffer.schedule_flush()
+            self.assertFalse(timer.called)
+
+            buffer.add(self.users[0], "a", timezone.now(), self.response)
+            self.now[0] = 2.0
+            buffer.schedule_flush()
+            buffer.schedule_flush()
+            timer.assert_called_once_with(3.0, buffer._scheduled_flush)
+            timer.return_value.start.assert_called_once_with()
+
+            buffer.flush()
+            timer.return_value.cancel.assert_called_once_with()
+            buffer.add(self.users[1], "b", timezone.now(), self.response)
+            buffer.schedule_flush()
+            self.assertEqual(timer.call_count, 2)
+        buffer.flush()
+
+    def test_conflict_recorded(self):
+        buffer = self.buffer()
+        buffer.add(self.users[2], "new", timezone.now(), self.response)
+        buffer.flush()
+        sync_failures.flush()
+        failure = SyncFailure.objects.get()
+        self.assertEqual(failure.failed_instance, self.users[2])
+        self.assertIn("from old to new", failure.message)
+        self.assertEqual(metrics.SYNC_TASKS.get(outcome="sid_changed"), 1)
+
+    @test.override_settings(SAILTHRU_WRITEBACK_BATCH_SIZE=2)
+    def test_sync_task(self):
+        client = MockedSailthruClient()
+        client.api_post_return_value.body = {"keys": {"sid": "abc"}}
+        self.addCleanup(writeback.flush)
+        with mock.patch(
+            "sailthru_sync.tasks.utils.sailthru_client", return_value=client
+        ):
+            sync_user_basic(self.users[0].pk)
+            self.assertIsNone(
+                AudienceUser.objects.get(pk=self.users[0].pk).last_synced_at
+            )
+            sync_user_basic(self.users[1].pk)
+
+        for user in self.users[:2]:
+            user.refresh_from_db()
+            self.assertEqual(user.sailthru_id, "abc")
+            self.assertIsNotNone(user.last_synced_at)
+        self.assertEqual(metrics.SYNC_TASKS.get(outcome="synced"), 2)
@@ -0,0 +1,215 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+import sentry_sdk
+
+from core.models import AudienceUser
+from . import metrics, models as m
+
+
+logger = get_task_logger("sailthru_sync.tasks")
+
+
+Sync = namedtuple("Sync", ["user", "sid", "synced_at", "response"])
+
+
+class Buffer(object):
+    """
+    Collects what the sync tasks of a worker write to the database and
+    writes it in bulk, once `max_size` entries have been collected or the
+    oldest has waited `max_seconds` (by default the SAILTHRU_WRITEBACK_*
+    settings). Subclasses implement `_write(entries)`.
+
+    Adding an entry only writes the buffer if it is full or overdue; the
+    worker calls `flush_if_due()` and `schedule_flush()` after each task, so
+    that what an idle worker holds is still written about `max_seconds`
+    after it was added.
+    """
+
+    def __init__(self, max_size=None, max_seconds=None, clock=time.monotonic):
+        self.max_size = max_size
+        self.max_seconds = max_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._oldest = None
+        self._timer = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _max_seconds(self):
+        if self.max_seconds is None:
+            return settings.SAILTHRU_WRITEBACK_MAX_SECONDS
+        return self.max_seconds
+
+    def _is_due(self):
+        max_size = self.max_size or settings.SAILTHRU_WRITEBACK_BATCH_SIZE
+        return (
+            len(self._entries) >= max_size
+            or self.clock() - self._oldest >= self._max_seconds()
+        )
+
+    def _merge(self, previous, entry):
+        """The entry kept when `entry` has the key of a `previous` one."""
+        return entry
+
+    def _add(self, key, entry):
+        with self._lock:
+            if not self._entries:
+                self._oldest = self.clock()
+            if key in self._entries:
+                entry = self._merge(self._entries.pop(key), entry)
+            self._entries[key] = entry
+            if not self._is_due():
+                return
+            entries = self._take()
+        self._write(entries)
+
+    def flush(self):
+        with self._lock:
+            entries = self._take()
+        if entries:
+            self._write(entries)
+
+    def flush_if_due(self):
+        with self._lock:
+            if not self._entries or not self._is_due():
+                return
+            entries = self._take()
+        self._write(entries)
+
+    def schedule_flush(self):
+        """
+        Makes sure the entries buffered so far are written once the oldest
+        has waited `max_seconds`, even if nothing is added in the meantime.
+        """
+        with self._lock:
+            if not self._entries or self._timer is not None:
+                return
+            delay = max(self._max_seconds() - (self.clock() - self._oldest), 0)
+            self._timer = threading.Timer(delay, self._scheduled_flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _scheduled_flush(self):
+        try:
+            self.flush()
+        finally:
+            # the timer's thread has a database connection of its own
+            connection.close()
+
+    def _take(self):
+        entries = list(self._entries.values())
+        self._entries.clear()
+        self._oldest = None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return entries
+
+    def _write(self, entries):
+        raise NotImplementedError
+
+
+class WriteBackBuffer(Buffer):
+    """Writes back the Sailthru IDs and sync times of synced users."""
+
+    def add(self, user, sid, synced_at, response):
+        """Buffers a successful sync of `user`, flushing if it is time to."""
+        # only the latest sync of a user is written back
+        self._add(user.pk, Sync(user, sid, synced_at, response))
+
+    def _write(self, syncs):
+        try:
+            conflicts = AudienceUser.objects.record_syncs(
+                (sync.user.pk, sync.sid, sync.synced_at) for sync in syncs
+            )
+        except Exception as e:
+            # the IDs are written back again the next time the users sync
+            sentry_sdk.capture_exception(e)
+            logger.error(
+                "Sailthru sync basic: Unable to write back %d syncs: %s",
+                len(syncs),
+                str(e),
+            )
+            return
+
+        for sync in syncs:
+            if sync.user.pk not in conflicts:
+                continue
+            existing, sid = conflicts[sync.user.pk]
+            msg = (
+                "Sailthru sync basic: Sailthru attempted to change the synced"
+                " user's Sailthru ID from {} to {}."
+            ).format(existing, sid)
+            sync_failures.add_response(msg, sync.user, sync.response)
+            logger.error(msg)
+            metrics.SYNC_TASKS.inc(outcome="sid_changed")
+
+
+class FailureBuffer(Buffer):
+    """
+    Records sync failures in bulk (see SyncFailureQuerySet.record), repeats
+    of a failure (same instance and error code) counted as one; each is
+    validated and sent to Sentry, as SyncFailureQuerySet.should_log_to_sentry()
+    allows, when it is added.
+    """
+
+    def _failure(self, data, sailthru_response=None):
+        data["last_seen"] = timezone.now()
+        # an invalid failure raises here, in its task, rather than making the
+        # whole batch fail to be recorded
+        m.SyncFailure.objects.validate(data)
+        metrics.FAILURES.inc(error_code=data.get("sailthru_error_code") or "none")
+        if sailthru_response is not None and (
+            m.SyncFailure.objects.should_log_to_sentry(sailthru_response)
+        ):
+            with sentry_sdk.push_scope() as scope:
+                scope.set_extra("data", data)
+                sentry_sdk.capture_message(data["message"])
+        instance = data["failed_instance"]
+        self._add((type(instance), instance.pk, data.get("sailthru_error_code")), data)
+
+    def _merge(self, previous, data):
+        data["occurrences"] = previous.get("occurrences", 1) + 1
+        return data
+
+    def add_message(self, msg, failed_instance):
+        self._failure(m.SyncFailure.objects.message_data(msg, failed_instance))
+
+    def add_error_response(self, msg, failed_instance, sailthru_response):
+        self._failure(
+            m.SyncFailure.objects.sailthru_error_response_data(
+                msg, failed_instance, sailthru_response
+            ),
+            sailthru_response,
+        )
+
+    def add_response(self, msg, failed_instance, sailthru_response):
+        self._failure(
+            m.SyncFailure.objects.sailthru_response_data(
+                msg, failed_instance, sailthru_response
+            ),
+            sailthru_response,
+        )
+
+    def _write(self, failures):
+        try:
+            m.SyncFailure.objects.record(failures)
+        except Exception as e:
+            sentry_sdk.capture_exception(e)
+            logger.error(
+                "Sailthru sync basic: Unable to record %d sync failures: %s",
+                len(failures),
+                str(e),
+            )
+
+
+# the failures of the sync tasks of this worker process
+sync_failures = FailureBuffer()